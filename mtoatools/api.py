@@ -9,7 +9,10 @@ from maya import cmds
 from .models import MatteAOV
 from .plugins import load
 from .hdr import create_hdr_rig
-from .packages import yaml
+from .rules import install_rules
+from .files import SaveCache, iter_mattes
+from .library import MatteLibrary, dump_library
+from .workers import read_matte_files
 
 
 def matte_aov(name):
@@ -83,29 +86,72 @@ def apply_swatch(lights=None):
 
 
 def save_mattes(mattes, filepath):
+    '''Save mattes to a matte file, one matte at a time. Mattes unchanged
+    since the last save to filepath are copied from the existing file.
+    '''
 
-    data = [matte.data() for matte in mattes]
-    serialized = yaml.safe_dump(data)
+    SaveCache.save(mattes, filepath)
 
-    with open(filepath, 'w') as f:
-        f.write(serialized)
 
+def load_mattes(filepath, ignore_namespaces=False):
+    '''Load every matte of a matte file as it is parsed
 
-def load_mattes(filepath):
+    :returns: list of loaded mattes
+    '''
 
-    with open(filepath, 'w') as f:
-        data = yaml.load(f.read())
+    with open(filepath, 'r') as f:
+        return [
+            MatteAOV.load(matte_data, ignore_namespaces)
+            for matte_data in iter_mattes(f)
+        ]
 
-    for matte_data in data:
-        MatteAOV.load(matte_data)
+
+def save_library(mattes, filepath):
+    '''Save mattes to a binary matte library'''
+
+    with open(filepath, 'wb') as f:
+        dump_library((matte.data() for matte in mattes), f)
+
+
+def load_library(filepath, names=None, ignore_namespaces=False):
+    '''Load mattes from a binary matte library, reading only the mattes
+    that are loaded.
+
+    :param names: names of the mattes to load, defaults to every matte
+    :returns: list of loaded mattes
+    '''
+
+    with MatteLibrary(filepath) as library:
+        if names is None:
+            names = library.names()
+        return [
+            MatteAOV.load(library[name], ignore_namespaces)
+            for name in names
+        ]
 
 
 def show_mattes_ui(instance=[]):
     '''Show the mtoatools mattes ui'''
     from .ui.controllers import MattesController
+    install_rules()
     if not instance:
         instance.append(MattesController())
 
     controller = instance[0]
     controller.show()
     return controller
+
+
+def load_matte_files(filepaths, ignore_namespaces=False, **kwargs):
+    '''Parse and merge matte files in parallel, then load the merged
+    mattes.
+
+    :param kwargs: precedence, merge_shapes, processes and worker_bytes,
+        see workers.read_matte_files
+    :returns: list of loaded mattes
+    '''
+
+    return [
+        MatteAOV.load(matte_data, ignore_namespaces)
+        for matte_data in read_matte_files(filepaths, **kwargs)
+    ]
@@ -0,0 +1,474 @@
+'''
+mtoatools.bulk
+==============
+OpenMaya 2.0 backend for bulk Matte AOV edits. Attribute adds, removes and
+sets for any number of shapes are collected in one MDGModifier and executed
+through the mtoatoolsModifier command, giving a single undo step.
+
+A transaction opens an undo chunk and runs each of its modifiers as its own
+command inside it. So edits made with cmds or pymel inside a transaction
+land in the same chunk, in order, and undo as one step. On failure the
+chunk is undone, rolling back modifier and cmds edits alike. With undo
+turned off only the modifiers can be rolled back.
+'''
+
+from contextlib import contextmanager
+from maya import cmds
+import maya.api.OpenMaya as om
+from . import plugins
+from .index import MatteIndex, NodeHandle
+from .journal import Journal
+
+
+_pending = []
+_transactions = []
+
+
+def pop_pending():
+    '''Used by the mtoatoolsModifier command to collect its modifier'''
+
+    return _pending.pop()
+
+
+def execute(modifier):
+    '''Execute a modifier as a single undoable command. Inside a transaction
+    the modifier is applied and becomes part of the transaction's undo step.
+
+    :param modifier: MDGModifier, Batch or any object with doIt and undoIt
+        methods
+    '''
+
+    if _transactions:
+        _transactions[-1].run(modifier)
+        return
+
+    run_command(modifier)
+
+
+def run_command(modifier):
+    '''Execute a modifier through the mtoatoolsModifier command'''
+
+    plugins.load('modifier')
+    _pending.append(modifier)
+    try:
+        cmds.mtoatoolsModifier()
+    except:
+        del _pending[:]
+        modifier.undoIt()
+        raise
+
+
+class Batch(object):
+    '''Sequence of modifier steps executed as one command. Each step is a
+    callable filling a fresh MDGModifier, built only after the previous
+    steps ran so it can use the nodes and attributes they created.
+    '''
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.modifiers = []
+
+    def doIt(self):
+        if self.modifiers:
+            for modifier in self.modifiers:
+                modifier.doIt()
+            return
+
+        for step in self.steps:
+            modifier = om.MDGModifier()
+            self.modifiers.append(modifier)
+            step(modifier)
+            modifier.doIt()
+
+    def undoIt(self):
+        for modifier in reversed(self.modifiers):
+            modifier.undoIt()
+
+
+class Transaction(object):
+    '''Edits applied as soon as they are queued. Inside an undo chunk every
+    edit runs as its own command, with undo turned off edits are kept to be
+    undone on failure. Use through the transaction context manager.
+    '''
+
+    def __init__(self, chunked):
+        self.actions = []
+        self.chunked = chunked
+
+    def apply(self, step, *args, **kwargs):
+        '''Fill a fresh MDGModifier with step and apply it
+
+        :param step: callable taking a modifier followed by args and kwargs
+        :returns: the return value of step
+        '''
+
+        modifier = om.MDGModifier()
+        result = step(modifier, *args, **kwargs)
+        self.run(modifier)
+        return result
+
+    def run(self, action):
+        if self.chunked:
+            run_command(action)
+            return
+
+        try:
+            action.doIt()
+        except:
+            try:
+                action.undoIt()
+            except RuntimeError:
+                pass
+            raise
+        self.actions.append(action)
+
+    def undoIt(self):
+        for action in reversed(self.actions):
+            action.undoIt()
+
+
+@contextmanager
+def transaction():
+    '''Group edits into one undo step. Every edit is rolled back when an
+    exception is raised inside the block. Nested transactions join the
+    outermost one.
+    '''
+
+    if _transactions:
+        yield _transactions[-1]
+        return
+
+    tx = Transaction(cmds.undoInfo(q=True, state=True))
+    if tx.chunked:
+        cmds.undoInfo(openChunk=True, chunkName='mtoatools')
+        # An empty command first, so undoing on failure never undoes an
+        # edit made before the transaction
+        run_command(om.MDGModifier())
+    _transactions.append(tx)
+    try:
+        yield tx
+    except:
+        _transactions.pop()
+        if tx.chunked:
+            cmds.undoInfo(closeChunk=True)
+            cmds.undo()
+        else:
+            tx.undoIt()
+        MatteIndex.clear()
+        Journal.record('reset')
+        raise
+
+    _transactions.pop()
+    if tx.chunked:
+        cmds.undoInfo(closeChunk=True)
+
+
+def get_shapes(nodes, attr_name=None):
+    '''Resolve nodes to shape MObjects using a single MSelectionList. A
+    transform or group resolves to every shape below it, found in one DAG
+    traversal, unless it carries attr_name. Instanced shapes are listed once.
+
+    :param nodes: PyNodes, NodeHandles, node names or MObjects
+    :param attr_name: Keep transforms that already have this attribute
+    '''
+
+    sel = om.MSelectionList()
+    shapes = []
+    for node in nodes:
+        if isinstance(node, NodeHandle):
+            mobject = node.object()
+            if mobject.hasFn(om.MFn.kTransform):
+                sel.add(node.long_name)
+            else:
+                shapes.append(mobject)
+        elif isinstance(node, om.MObject):
+            shapes.append(node)
+        else:
+            sel.add(str(node))
+
+    roots = []
+    fn = om.MFnDependencyNode()
+    for i in xrange(sel.length()):
+        mobject = sel.getDependNode(i)
+        if mobject.hasFn(om.MFn.kTransform):
+            if attr_name and fn.setObject(mobject).hasAttribute(attr_name):
+                shapes.append(mobject)
+            else:
+                roots.append(sel.getDagPath(i))
+            continue
+        shapes.append(mobject)
+
+    if roots:
+        shapes.extend(get_descendant_shapes(roots))
+
+    seen = set()
+    unique = []
+    for shape in shapes:
+        key = NodeHandle(shape)
+        if key not in seen:
+            seen.add(key)
+            unique.append(shape)
+    return unique
+
+
+def get_descendant_shapes(roots):
+    '''Shapes below dag paths, intermediate objects excluded. Roots nested
+    in another root are skipped.
+
+    :param roots: list of MDagPaths
+    '''
+
+    by_path = dict((root.fullPathName(), root) for root in roots)
+    top = []
+    for path in sorted(by_path):
+        if not top or not path.startswith(top[-1] + '|'):
+            top.append(path)
+
+    shapes = []
+    dag_iter = om.MItDag()
+    fn = om.MFnDagNode()
+    for path in top:
+        dag_iter.reset(by_path[path], om.MItDag.kDepthFirst, om.MFn.kShape)
+        while not dag_iter.isDone():
+            mobject = dag_iter.currentItem()
+            if not fn.setObject(mobject).isIntermediateObject:
+                shapes.append(mobject)
+            dag_iter.next()
+    return shapes
+
+
+def create_vector_attr(name):
+    '''Create a keyable float3 color attribute with R, G and B children,
+    defaulting to black
+    '''
+
+    fn = om.MFnNumericAttribute()
+    children = []
+    for c in 'RGB':
+        children.append(fn.create(
+            name + c,
+            name + c,
+            om.MFnNumericData.kFloat,
+            0
+        ))
+        fn.keyable = True
+
+    attr = fn.create(name, name, *children)
+    fn.usedAsColor = True
+    fn.keyable = True
+    return attr
+
+
+def add_color_attr(modifier, shape, attr_name, rgb=(0, 0, 0)):
+    '''Queue a vector attribute add followed by sets of its non zero
+    channels. The attribute defaults to black so colors are stored as plug
+    values, never as attribute defaults.
+    '''
+
+    attr = create_vector_attr(attr_name)
+    modifier.addAttribute(shape, attr)
+    children = om.MFnCompoundAttribute(attr)
+    for i, value in enumerate(rgb):
+        if value:
+            plug = om.MPlug(shape, children.child(i))
+            modifier.newPlugValueFloat(plug, value)
+
+
+def add_attrs(modifier, shapes, attr_name, rgb=(0, 0, 0)):
+    '''Queue vector attribute adds for shapes missing attr_name
+
+    :returns: list of shapes the attribute will be added to
+    '''
+
+    fn = om.MFnDependencyNode()
+    added = []
+    for shape in shapes:
+        if fn.setObject(shape).hasAttribute(attr_name):
+            continue
+        add_color_attr(modifier, shape, attr_name, rgb)
+        added.append(shape)
+    return added
+
+
+def remove_attrs(modifier, shapes, attr_name):
+    '''Queue removal of attr_name from shapes
+
+    :returns: list of shapes the attribute will be removed from
+    '''
+
+    fn = om.MFnDependencyNode()
+    removed = []
+    for shape in shapes:
+        fn.setObject(shape)
+        if not fn.hasAttribute(attr_name):
+            continue
+        modifier.removeAttribute(shape, fn.attribute(attr_name))
+        removed.append(shape)
+    return removed
+
+
+def set_colors(modifier, shapes, attr_name, rgb):
+    '''Queue color sets, adding attr_name where it is missing'''
+
+    fn = om.MFnDependencyNode()
+    for shape in shapes:
+        fn.setObject(shape)
+        if not fn.hasAttribute(attr_name):
+            add_color_attr(modifier, shape, attr_name, rgb)
+            continue
+        plug = fn.findPlug(attr_name, False)
+        for i, value in enumerate(rgb):
+            modifier.newPlugValueFloat(plug.child(i), value)
+    return shapes
+
+
+def set_channel(modifier, shapes, attr_name, channel, value):
+    '''Queue a single channel set, adding attr_name where it is missing. Used
+    by packed mattes which store one logical matte per channel.
+    '''
+
+    rgb = [0, 0, 0]
+    rgb[channel] = value
+    fn = om.MFnDependencyNode()
+    for shape in shapes:
+        fn.setObject(shape)
+        if not fn.hasAttribute(attr_name):
+            add_color_attr(modifier, shape, attr_name, rgb)
+            continue
+        plug = fn.findPlug(attr_name, False).child(channel)
+        modifier.newPlugValueFloat(plug, value)
+    return shapes
+
+
+def clear_channel(modifier, shapes, attr_name, channel):
+    '''Queue a single channel reset. The attribute is removed from shapes
+    where no other channel is in use.
+
+    :returns: list of shapes that had the channel set
+    '''
+
+    fn = om.MFnDependencyNode()
+    cleared = []
+    for shape in shapes:
+        fn.setObject(shape)
+        if not fn.hasAttribute(attr_name):
+            continue
+        plug = fn.findPlug(attr_name, False)
+        values = [plug.child(i).asFloat() for i in xrange(3)]
+        if not values[channel]:
+            continue
+        values[channel] = 0
+        if any(values):
+            modifier.newPlugValueFloat(plug.child(channel), 0)
+        else:
+            modifier.removeAttribute(shape, fn.attribute(attr_name))
+        cleared.append(shape)
+    return cleared
+
+
+def copy_channel(modifier, shapes, src_attr, src_channel, dst_attr,
+                 dst_channel):
+    '''Queue a copy of one channel of src_attr into a channel of dst_attr'''
+
+    fn = om.MFnDependencyNode()
+    for shape in shapes:
+        fn.setObject(shape)
+        plug = fn.findPlug(src_attr, False)
+        value = plug.child(src_channel).asFloat()
+        if not value:
+            continue
+        if not fn.hasAttribute(dst_attr):
+            rgb = [0, 0, 0]
+            rgb[dst_channel] = value
+            add_color_attr(modifier, shape, dst_attr, rgb)
+            continue
+        plug = fn.findPlug(dst_attr, False).child(dst_channel)
+        modifier.newPlugValueFloat(plug, value)
+
+
+def get_plug(name):
+    '''Get an MPlug from a "node.attr" string'''
+
+    sel = om.MSelectionList()
+    sel.add(name)
+    return sel.getPlug(0)
+
+
+def next_index(plug):
+    '''Next free logical index of an array plug'''
+
+    indices = plug.getExistingArrayAttributeIndices()
+    return max(indices) + 1 if indices else 0
+
+
+def rename_attrs(modifier, shapes, attr_name, new_attr_name):
+    '''Queue renames of a vector attribute and its R, G and B children'''
+
+    fn = om.MFnDependencyNode()
+    for shape in shapes:
+        fn.setObject(shape)
+        if not fn.hasAttribute(attr_name):
+            continue
+        for c in ('', 'R', 'G', 'B'):
+            modifier.renameAttribute(
+                shape,
+                fn.attribute(attr_name + c),
+                new_attr_name + c,
+                new_attr_name + c
+            )
+    return shapes
+
+
+def delete_nodes(modifier, nodes):
+    '''Queue deletion of dependency nodes'''
+
+    for node in nodes:
+        modifier.deleteNode(node)
+    return nodes
+
+
+def add_string_attr(modifier, node, attr_name):
+    '''Queue a string attribute add'''
+
+    attr = om.MFnTypedAttribute().create(
+        attr_name,
+        attr_name,
+        om.MFnData.kString
+    )
+    modifier.addAttribute(node, attr)
+
+
+def set_string(modifier, node, attr_name, value):
+    '''Queue a string attribute set'''
+
+    plug = om.MFnDependencyNode(node).findPlug(attr_name, False)
+    modifier.newPlugValueString(plug, value)
+
+
+def set_value(modifier, plug, value):
+    '''Queue a plug set, the plug type is chosen from the value type'''
+
+    if isinstance(value, (list, tuple)):
+        for i, child_value in enumerate(value):
+            set_value(modifier, plug.child(i), child_value)
+    elif isinstance(value, bool):
+        modifier.newPlugValueBool(plug, value)
+    elif isinstance(value, (int, long)):
+        modifier.newPlugValueInt(plug, value)
+    elif isinstance(value, float):
+        modifier.newPlugValueDouble(plug, value)
+    elif isinstance(value, basestring):
+        modifier.newPlugValueString(plug, value)
+    else:
+        raise TypeError('Can not set {} to {!r}'.format(plug.name(), value))
+
+
+def set_values(modifier, node, values):
+    '''Queue many attribute sets on a single node
+
+    :param values: dict mapping attribute names to values
+    '''
+
+    fn = om.MFnDependencyNode(node)
+    for attr_name, value in values.iteritems():
+        set_value(modifier, fn.findPlug(attr_name, False), value)
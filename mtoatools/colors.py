@@ -0,0 +1,182 @@
+'''
+mtoatools.colors
+================
+Color utilities for Matte AOVs. Uses numpy when it is available.
+'''
+
+import hashlib
+from itertools import product
+from collections import defaultdict
+from operator import itemgetter
+try:
+    import numpy as np
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+
+COLOR_TOLERANCE = 1e-3
+ID_LEVELS = 10
+PACK_OFFSET = 1 << 20
+_palettes = {}
+
+
+def quantize(color, tolerance=COLOR_TOLERANCE):
+    '''Snap a color to the tolerance grid'''
+
+    return tuple(round(round(c / tolerance) * tolerance, 6) for c in color)
+
+
+def group_by_color(items, tolerance=COLOR_TOLERANCE):
+    '''Group (node, color) items by color, treating colors within tolerance
+    as equal.
+
+    :param items: list of (node, color) tuples
+    :param tolerance: Quantization step applied to each channel
+    :returns: list of (color, [nodes]) sorted by color in reverse order
+    '''
+
+    if not items:
+        return []
+
+    if not numpy_enabled:
+        groups = defaultdict(list)
+        for node, color in items:
+            groups[quantize(color, tolerance)].append(node)
+        return sorted(groups.items(), key=itemgetter(0), reverse=True)
+
+    nodes = [node for node, color in items]
+    colors = np.array([color for node, color in items], dtype=np.float64)
+    return [
+        (key, [nodes[j] for j in rows])
+        for key, rows in group_rows(colors, tolerance)
+    ]
+
+
+def group_rows(colors, tolerance=COLOR_TOLERANCE):
+    '''Group the rows of an Nx3 color array by color, requires numpy
+
+    :returns: list of (color, row indices) sorted by color in reverse order
+    '''
+
+    colors = np.asarray(colors, dtype=np.float64)
+    quantized = np.round(colors / tolerance).astype(np.int64)
+    if len(quantized) and np.abs(quantized).max() < PACK_OFFSET:
+        # Pack each row into a single integer, a unique over one column is
+        # several times faster than a unique over rows and sorts alike
+        packed = quantized + PACK_OFFSET
+        packed = (packed[:, 0] << 42) | (packed[:, 1] << 21) | packed[:, 2]
+        packed, inverse = np.unique(packed, return_inverse=True)
+        mask = (1 << 21) - 1
+        keys = np.stack(
+            [packed >> 42, (packed >> 21) & mask, packed & mask],
+            axis=1
+        ) - PACK_OFFSET
+    else:
+        keys, inverse = np.unique(quantized, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    keys = np.round(keys * tolerance, 6)
+
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+
+    groups = []
+    for i, key in enumerate(keys):
+        groups.append(
+            (tuple(float(v) for v in key), order[bounds[i]:bounds[i + 1]])
+        )
+    return sorted(groups, key=itemgetter(0), reverse=True)
+
+
+def lattice(levels):
+    '''Colors on a regular lattice of the RGB cube, black excluded. A cubic
+    lattice maximizes the nearest neighbour distance for its number of
+    colors, 1 / (levels - 1) here.
+    '''
+
+    key = ('lattice', levels)
+    palette = _palettes.get(key)
+    if palette is None:
+        steps = [i / float(levels - 1) for i in range(levels)]
+        palette = [c for c in product(steps, repeat=3) if any(c)]
+        _palettes[key] = palette
+    return palette
+
+
+def id_palette(levels=ID_LEVELS):
+    '''Palette ID colors are picked from, the lattice of levels steps per
+    channel. The default palette has 999 colors at least 1 / 9 apart, above
+    analysis.COLLISION_THRESHOLD, so any two ID colors stay separable in
+    comp.
+
+    :param levels: Steps per channel
+    '''
+
+    return lattice(levels)
+
+
+def id_key(name, mode='shape'):
+    '''Key an ID color is derived from
+
+    :param name: Shape name, namespaces included
+    :param mode: "shape" to key on the shape name or "namespace" to key on
+        its namespace, shapes without a namespace fall back to their name
+    '''
+
+    name = name.rpartition('|')[-1]
+    if mode == 'namespace':
+        namespace = name.rpartition(':')[0]
+        if namespace:
+            return namespace
+    return name
+
+
+def id_index(key, size):
+    '''Palette index a key hashes to'''
+
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest(), 16) % size
+
+
+def id_color(name, mode='shape', levels=ID_LEVELS):
+    '''ID color a shape hashes to. Derived from an md5 hash of the id_key
+    only, so it is stable across sessions and machines. Use id_colors to
+    color a batch of shapes without collisions.
+    '''
+
+    palette = id_palette(levels)
+    return palette[id_index(id_key(name, mode), len(palette))]
+
+
+def id_colors(names, mode='shape', levels=ID_LEVELS, taken=None):
+    '''Deterministic, collision free ID colors for a batch of shapes. Keys
+    are visited in sorted order and a key hashing to a color already used
+    in the batch takes the next free palette color, linear probing. So the
+    colors only depend on the set of keys in the batch. Palette colors are
+    reused once every color is used.
+
+    :param names: Shape names, namespaces included
+    :param taken: dict mapping keys outside the batch to their colors, these
+        keys keep their color and other keys avoid it
+    :returns: dict mapping names to colors
+    '''
+
+    palette = id_palette(levels)
+    size = len(palette)
+    keys = dict((name, id_key(name, mode)) for name in names)
+    colors = dict(taken or {})
+    used = set(quantize(color) for color in colors.itervalues())
+
+    for key in sorted(set(keys.itervalues())):
+        if key in colors:
+            continue
+        index = id_index(key, size)
+        for i in xrange(size):
+            color = palette[(index + i) % size]
+            if quantize(color) not in used:
+                break
+        else:
+            color = palette[index]
+        used.add(quantize(color))
+        colors[key] = color
+
+    return dict((name, colors[key]) for name, key in keys.iteritems())
@@ -0,0 +1,248 @@
+'''
+mtoatools.columns
+=================
+Columnar mirror of matte memberships. Namespaces are interned in a table,
+names are kept in a list and colors in an Nx3 float32 array, so that
+serialization, grouping, filtering and diffing run on whole columns instead
+of per shape dicts. Uses numpy when it is available.
+
+The MatteIndex member dicts stay the primary store, a mirror is an extra
+copy built on demand and dropped when its members change. It saves time on
+whole matte operations, not memory.
+'''
+
+from fnmatch import fnmatchcase
+from .colors import COLOR_TOLERANCE, group_by_color, group_rows
+try:
+    import numpy as np
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+__all__ = ['MatteColumns']
+
+
+def split_name(name):
+    '''Split a node name into its namespace, None when empty, and name'''
+
+    namespace, _, name = name.rpartition(':')
+    return namespace or None, name
+
+
+class MatteColumns(object):
+    '''Memberships of a matte stored column by column
+
+    :ivar nodes: list of member nodes, None for deserialized rows
+    :ivar namespaces: table of unique namespaces
+    :ivar namespace_ids: index into namespaces of each row
+    :ivar names: names of each row without namespace
+    :ivar colors: Nx3 float32 array, a list of tuples without numpy
+    '''
+
+    __slots__ = ('nodes', 'namespaces', 'namespace_ids', 'names', 'colors')
+
+    def __init__(self, nodes, namespaces, namespace_ids, names, colors):
+        self.nodes = nodes
+        self.namespaces = namespaces
+        self.namespace_ids = namespace_ids
+        self.names = names
+        self.colors = colors
+
+    def __repr__(self):
+        return '<MatteColumns>({} rows, {} namespaces)'.format(
+            len(self),
+            len(self.namespaces)
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_rows(cls, nodes, names, colors):
+        '''Build columns from node names including their namespaces'''
+
+        table = {}
+        namespaces = []
+        namespace_ids = []
+        short_names = []
+        for full_name in names:
+            namespace, name = split_name(full_name)
+            index = table.get(namespace)
+            if index is None:
+                index = table[namespace] = len(namespaces)
+                namespaces.append(namespace)
+            namespace_ids.append(index)
+            short_names.append(name)
+
+        if numpy_enabled:
+            namespace_ids = np.array(namespace_ids, dtype=np.int32)
+            colors = np.array(colors, dtype=np.float32).reshape(-1, 3)
+        else:
+            colors = [tuple(color) for color in colors]
+        return cls(nodes, namespaces, namespace_ids, short_names, colors)
+
+    @classmethod
+    def from_items(cls, items):
+        '''Build columns from (node, color) items'''
+
+        nodes = [node for node, color in items]
+        return cls.from_rows(
+            nodes,
+            [str(node) for node in nodes],
+            [color for node, color in items]
+        )
+
+    @classmethod
+    def from_data(cls, shapes):
+        '''Build columns from serialized shape dicts'''
+
+        names = [
+            s['namespace'] + ':' + s['name'] if s['namespace'] else s['name']
+            for s in shapes
+        ]
+        return cls.from_rows(
+            [None] * len(shapes),
+            names,
+            [s['color'] for s in shapes]
+        )
+
+    def keys(self):
+        '''List of (namespace, name) tuples'''
+
+        namespaces = self.namespaces
+        return [
+            (namespaces[i], name)
+            for i, name in zip(list(self.namespace_ids), self.names)
+        ]
+
+    def color_list(self):
+        '''Colors as a list of tuples of floats'''
+
+        if numpy_enabled:
+            return [tuple(color) for color in self.colors.tolist()]
+        return list(self.colors)
+
+    def data(self):
+        '''Serializable list of shape dicts'''
+
+        return [
+            {'name': name, 'namespace': namespace, 'color': color}
+            for (namespace, name), color in zip(self.keys(), self.color_list())
+        ]
+
+    def take(self, rows):
+        '''New columns holding only the given rows, in that order'''
+
+        rows = list(rows)
+        if numpy_enabled:
+            index = np.asarray(rows, dtype=np.int64)
+            namespace_ids = self.namespace_ids[index]
+            colors = self.colors[index].reshape(-1, 3)
+        else:
+            namespace_ids = [self.namespace_ids[i] for i in rows]
+            colors = [self.colors[i] for i in rows]
+        return MatteColumns(
+            [self.nodes[i] for i in rows],
+            self.namespaces,
+            namespace_ids,
+            [self.names[i] for i in rows],
+            colors
+        )
+
+    def in_namespace(self, namespace):
+        '''Rows in a namespace, None for the root namespace'''
+
+        if namespace not in self.namespaces:
+            return self.take([])
+
+        index = self.namespaces.index(namespace)
+        if numpy_enabled:
+            return self.take(np.nonzero(self.namespace_ids == index)[0])
+        return self.take(
+            i for i, ns in enumerate(self.namespace_ids) if ns == index
+        )
+
+    def match(self, pattern):
+        '''Rows whose name matches a glob pattern'''
+
+        return self.take(
+            i for i, name in enumerate(self.names)
+            if fnmatchcase(name, pattern)
+        )
+
+    def sort(self):
+        '''Rows sorted by namespace and name'''
+
+        keys = self.keys()
+        return self.take(sorted(
+            range(len(keys)),
+            key=lambda i: (keys[i][0] or '', keys[i][1])
+        ))
+
+    def channel(self, channel):
+        '''Rows with a non zero value in channel, as grey colors'''
+
+        if numpy_enabled:
+            values = self.colors[:, channel]
+            rows = np.nonzero(values)[0]
+            columns = self.take(rows)
+            columns.colors = np.repeat(values[rows][:, None], 3, axis=1)
+            return columns
+
+        rows = [i for i, color in enumerate(self.colors) if color[channel]]
+        columns = self.take(rows)
+        columns.colors = [(c[channel],) * 3 for c in columns.colors]
+        return columns
+
+    def groups(self, tolerance=COLOR_TOLERANCE):
+        '''List of (color, nodes) sorted by color in reverse order'''
+
+        if not len(self):
+            return []
+        if not numpy_enabled:
+            return group_by_color(zip(self.nodes, self.colors), tolerance)
+        nodes = np.empty(len(self.nodes), dtype=object)
+        nodes[:] = self.nodes
+        return [
+            (color, nodes[rows].tolist())
+            for color, rows in group_rows(self.colors, tolerance)
+        ]
+
+    def diff(self, other, tolerance=COLOR_TOLERANCE):
+        '''Rows that changed between these columns and other
+
+        :returns: (added, removed, changed) where added and changed are row
+            indices of other and removed are row indices of these columns
+        '''
+
+        index = dict((key, i) for i, key in enumerate(self.keys()))
+        added = []
+        rows = []
+        other_rows = []
+        for j, key in enumerate(other.keys()):
+            i = index.pop(key, None)
+            if i is None:
+                added.append(j)
+            else:
+                rows.append(i)
+                other_rows.append(j)
+        removed = sorted(index.values())
+
+        if not rows:
+            return added, removed, []
+
+        if numpy_enabled:
+            delta = np.abs(
+                self.colors[np.asarray(rows)] -
+                other.colors[np.asarray(other_rows)]
+            ).max(axis=1)
+            changed = np.asarray(other_rows)[delta > tolerance].tolist()
+        else:
+            changed = [
+                j for i, j in zip(rows, other_rows)
+                if max(
+                    abs(a - b)
+                    for a, b in zip(self.colors[i], other.colors[j])
+                ) > tolerance
+            ]
+        return added, removed, changed
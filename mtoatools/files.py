@@ -0,0 +1,498 @@
+'''
+mtoatools.files
+===============
+Reading and writing matte files. A matte file is a YAML stream holding one
+document per matte, so mattes are written and parsed one at a time and a
+library never has to fit in memory as a whole.
+
+Matte files only hold mattes of the form
+{name, shapes: [{name, namespace, color}]}, so they are read with libyaml
+when it is available and otherwise with a parser for exactly the layout
+dump_mattes writes. Documents the parser does not recognize are handed to
+the general YAML loader.
+
+SaveCache remembers a hash and the revision of each matte document it
+saves. Mattes without changes in the journal and with the same revision
+since the last save are copied from the existing file on the next save
+instead of being queried again.
+
+read_matte_file and merge_mattes do not need Maya, so matte files can be
+parsed in worker processes.
+'''
+
+import os
+import re
+import hashlib
+from itertools import chain
+from collections import OrderedDict
+from .journal import Journal
+from .library import MAGIC, MatteLibrary
+from .packages import yaml
+from .packages.yaml.resolver import Resolver
+
+__all__ = ['dump_mattes', 'iter_mattes', 'load_documents', 'SaveCache',
+           'read_matte_file', 'merge_mattes']
+
+
+INT_PATTERN = re.compile(r'-?(?:0|[1-9][0-9]*)$')
+FLOAT_PATTERN = re.compile(r'-?[0-9]+\.[0-9]*(?:e[-+][0-9]+)?$')
+KEY_PATTERN = re.compile(r'[a-z_]+$')
+PLAIN_INDICATORS = frozenset('-?:,[]{}#&*!|>\'"%@`')
+RESOLVERS = Resolver.yaml_implicit_resolvers
+PRECEDENCES = ('first', 'last')
+
+
+class SchemaError(ValueError):
+    '''Raised by the matte parser for text outside of the matte schema'''
+
+
+def dump_mattes(mattes, stream):
+    '''Write matte data to stream, one YAML document per matte
+
+    :param mattes: iterable of matte data dicts, consumed one at a time
+    :param stream: file like object opened for writing
+    '''
+
+    yaml.safe_dump_all(mattes, stream, explicit_start=True)
+
+
+def dump_matte(matte_data, stream):
+    '''Write a single matte document to stream
+
+    :returns: hash of the document
+    '''
+
+    text = yaml.safe_dump(matte_data, explicit_start=True)
+    stream.write(text)
+    return hash_document(text)
+
+
+def hash_document(text):
+    return hashlib.md5(text).hexdigest()
+
+
+def iter_mattes(stream):
+    '''Parse matte data from stream one document at a time. Files written as
+    a single list of mattes are read as well.
+
+    :param stream: file like object opened for reading
+    :returns: generator yielding matte data dicts
+    '''
+
+    if yaml.__with_libyaml__:
+        documents = yaml.load_all(stream, Loader=yaml.CSafeLoader)
+    else:
+        documents = load_documents(stream)
+
+    for document in documents:
+        if isinstance(document, list):
+            for matte_data in document:
+                yield matte_data
+        elif document is not None:
+            yield document
+
+
+def read_matte_file(filepath):
+    '''List the mattes of a matte file or of a binary matte library
+
+    :returns: list of matte data dicts
+    '''
+
+    with open(filepath, 'rb') as f:
+        is_library = f.read(len(MAGIC)) == MAGIC
+    if is_library:
+        with MatteLibrary(filepath) as library:
+            return list(library)
+
+    with open(filepath, 'r') as f:
+        return list(iter_mattes(f))
+
+
+def merge_mattes(files, precedence='last', merge_shapes=False):
+    '''Merge the mattes of several matte files into one matte per name
+
+    :param files: list of lists of matte data dicts, in file order
+    :param precedence: "first" or "last", the file whose matte wins when
+        several files hold a matte of the same name. Or a callable taking
+        the merged and the next matte data and returning the merged data.
+    :param merge_shapes: Combine the shapes of mattes of the same name
+        instead of replacing them, the winning matte's colors are kept for
+        shapes in both
+    :returns: list of matte data dicts in the order they were first seen
+    '''
+
+    if not callable(precedence) and precedence not in PRECEDENCES:
+        raise ValueError('Unknown precedence: {}'.format(precedence))
+
+    merged = OrderedDict()
+    for mattes in files:
+        for matte_data in mattes:
+            name = matte_data['name']
+            if name not in merged:
+                merged[name] = matte_data
+                continue
+
+            if callable(precedence):
+                merged[name] = precedence(merged[name], matte_data)
+                continue
+
+            loser, winner = merged[name], matte_data
+            if precedence == 'first':
+                loser, winner = winner, loser
+            if not merge_shapes:
+                merged[name] = winner
+                continue
+
+            shapes = OrderedDict()
+            for shape in chain(loser['shapes'], winner['shapes']):
+                shapes[(shape['namespace'], shape['name'])] = shape
+            data = dict(loser)
+            data.update(winner)
+            data['shapes'] = list(shapes.values())
+            merged[name] = data
+
+    return list(merged.values())
+
+
+def load_documents(stream):
+    '''Parse the documents of a matte file without the general YAML
+    loader, documents outside of the matte schema are loaded with
+    yaml.safe_load.
+
+    :returns: generator yielding one object per document
+    '''
+
+    for lines in split_documents(stream):
+        try:
+            yield parse_matte(lines)
+        except SchemaError:
+            yield yaml.safe_load(''.join(lines))
+
+
+def split_documents(stream):
+    '''Split a YAML stream into lists of lines, one list per document'''
+
+    for offset, lines in split_spans(stream):
+        yield lines
+
+
+def split_spans(stream):
+    '''Split a YAML stream into documents
+
+    :returns: generator yielding (offset of the document, list of lines)
+    '''
+
+    lines = []
+    start = offset = 0
+    for line in stream:
+        if line.startswith('---'):
+            if lines and not lines[-1].startswith('%'):
+                yield start, lines
+                lines = []
+        elif line.startswith('...'):
+            if lines:
+                yield start, lines
+            lines = []
+            offset += len(line)
+            continue
+        elif line.startswith('%'):
+            if lines and not lines[-1].startswith('%'):
+                yield start, lines
+                lines = []
+        if not lines:
+            start = offset
+        lines.append(line)
+        offset += len(line)
+    if lines:
+        yield start, lines
+
+
+def index_mattes(stream):
+    '''List the mattes of a matte file parsing only their names, documents
+    outside of the matte schema are loaded in full.
+
+    :param stream: file like object opened for reading in binary mode
+    :returns: generator yielding (name, offset, position) tuples, the
+        offset of the matte's document and the position of the matte in a
+        document holding a list of mattes, None otherwise
+    '''
+
+    for offset, lines in split_spans(stream):
+        name = document_name(lines)
+        if name is not None:
+            yield name, offset, None
+            continue
+
+        document = yaml.safe_load(''.join(lines))
+        if isinstance(document, list):
+            for position, matte_data in enumerate(document):
+                yield matte_data['name'], offset, position
+        elif document is not None:
+            yield document['name'], offset, None
+
+
+def read_matte(stream, offset, position=None):
+    '''Parse a single matte listed by index_mattes
+
+    :param stream: file like object opened for reading in binary mode
+    :returns: matte data dict
+    '''
+
+    stream.seek(offset)
+    document = next(load_documents(stream))
+    if position is not None:
+        document = document[position]
+    return document
+
+
+def parse_matte(lines):
+    '''Parse the lines of a matte document
+
+    :raises: SchemaError when the document is not a matte written by
+        dump_mattes
+    '''
+
+    if lines[0].rstrip('\r\n') == '---':
+        lines = lines[1:]
+
+    matte = {}
+    shapes = None
+    shape = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.startswith('- '):
+            if shapes is None:
+                raise SchemaError(line)
+            shape = {}
+            shapes.append(shape)
+            line = line[2:]
+        elif line.startswith('  '):
+            if shape is None:
+                raise SchemaError(line)
+            line = line[2:]
+        else:
+            shape = shapes = None
+            key, value = split_key(line)
+            if key in ('name', 'backend'):
+                matte[key] = parse_string(value)
+            elif key == 'packed':
+                matte[key] = parse_mapping(value)
+            elif key == 'default_color':
+                matte[key] = parse_color(value)
+            elif key == 'shapes':
+                if value not in ('', '[]'):
+                    raise SchemaError(line)
+                shapes = matte[key] = []
+            else:
+                raise SchemaError(line)
+            continue
+
+        key, value = split_key(line)
+        if key == 'color':
+            shape[key] = parse_color(value)
+        elif key in ('name', 'namespace'):
+            shape[key] = parse_string(value)
+        else:
+            raise SchemaError(line)
+
+    if 'name' not in matte:
+        raise SchemaError('Missing matte name')
+    return matte
+
+
+def split_key(line):
+    key, sep, value = line.partition(': ')
+    if not sep:
+        if not line.endswith(':'):
+            raise SchemaError(line)
+        key = line[:-1]
+    if not KEY_PATTERN.match(key):
+        raise SchemaError(line)
+    return key, value
+
+
+def parse_string(value):
+    '''Parse a plain or single quoted scalar holding a string or null'''
+
+    if not value:
+        raise SchemaError(value)
+
+    if value[0] == "'":
+        if len(value) < 2 or value[-1] != "'":
+            raise SchemaError(value)
+        value = value[1:-1]
+        if "'" in value.replace("''", ''):
+            raise SchemaError(value)
+        value = value.replace("''", "'")
+    else:
+        if value in ('null', '~'):
+            return None
+        if value[0] in PLAIN_INDICATORS or value != value.strip():
+            raise SchemaError(value)
+        if ' #' in value or ': ' in value:
+            raise SchemaError(value)
+        for tag, regexp in RESOLVERS.get(value[0], ()):
+            if regexp.match(value):
+                raise SchemaError(value)
+
+    if not isinstance(value, unicode):
+        value = value.decode('utf-8')
+    try:
+        return str(value)
+    except UnicodeError:
+        return value
+
+
+def parse_mapping(value):
+    '''Parse a flow mapping of string values'''
+
+    if value[:1] != '{' or value[-1:] != '}' or "'" in value:
+        raise SchemaError(value)
+
+    mapping = {}
+    for item in value[1:-1].split(', '):
+        key, value = split_key(item)
+        mapping[key] = parse_string(value)
+    return mapping
+
+
+def parse_color(value):
+    '''Parse a flow sequence of three numbers'''
+
+    if value[:1] != '[' or value[-1:] != ']':
+        raise SchemaError(value)
+
+    color = []
+    for number in value[1:-1].split(', '):
+        if INT_PATTERN.match(number):
+            color.append(int(number))
+        elif FLOAT_PATTERN.match(number):
+            color.append(float(number))
+        else:
+            raise SchemaError(value)
+    if len(color) != 3:
+        raise SchemaError(value)
+    return color
+
+
+def document_name(lines):
+    '''Name of the matte of a document, None when it can not be found'''
+
+    for line in lines:
+        if line.startswith('name: '):
+            try:
+                return parse_string(line.rstrip('\r\n')[6:])
+            except SchemaError:
+                return None
+
+
+def get_revision(matte):
+    '''Revision of a matte, None for mattes without a revision method'''
+
+    revision = getattr(matte, 'revision', None)
+    return revision() if revision else None
+
+
+class SaveCache(object):
+    '''Remembers the matte documents last saved to each matte file, so
+    that saving again only queries the mattes changed since.
+
+    A matte is unchanged when the journal holds no change of it and its
+    revision, which also follows edits made outside of the models like
+    attribute edits, shape renames and deletes, is the one saved. An undo,
+    redo or scene change invalidates every saved file.
+    '''
+
+    def __init__(self):
+        self._saves = {}
+
+    def clean(self, filepath):
+        '''Mattes of a matte file unchanged since it was last saved
+
+        :returns: dict mapping matte names to (document hash, revision)
+        '''
+
+        filepath = os.path.abspath(filepath)
+        if filepath not in self._saves or not os.path.isfile(filepath):
+            return {}
+
+        seq, hashes = self._saves[filepath]
+        changes = Journal.changes_since(seq)
+        if changes is None:
+            return {}
+
+        hashes = dict(hashes)
+        for change in changes:
+            if change.kind == 'reset':
+                return {}
+            hashes.pop(change.name, None)
+            hashes.pop(change.old_name, None)
+        return hashes
+
+    def save(self, mattes, filepath):
+        '''Save mattes to a matte file. Mattes unchanged since the last
+        save are copied from the existing file, when their documents were
+        not edited on disk.
+
+        :param mattes: list of mattes, objects with a name and a data
+            method, and a revision method returning a value that changes
+            with the data
+        :param filepath: path of the matte file
+        '''
+
+        filepath = os.path.abspath(filepath)
+        clean = self.clean(filepath)
+        seq = Journal.seq
+        pending = OrderedDict((matte.name, matte) for matte in mattes)
+        hashes = {}
+
+        tmp_path = filepath + '.tmp'
+        try:
+            with open(tmp_path, 'w') as dst:
+                if clean:
+                    self._copy(filepath, dst, pending, clean, hashes)
+                for name, matte in pending.iteritems():
+                    hashes[name] = self._dump(matte, dst)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        if os.name == 'nt' and os.path.isfile(filepath):
+            os.remove(filepath)
+        os.rename(tmp_path, filepath)
+        self._saves[filepath] = (seq, hashes)
+
+    def _copy(self, filepath, dst, pending, clean, hashes):
+        '''Write the documents of pending mattes in the order of the existing
+        file, copying clean documents and popping written mattes.
+        '''
+
+        with open(filepath, 'r') as src:
+            for lines in split_documents(src):
+                name = document_name(lines)
+                matte = pending.pop(name, None)
+                if matte is None:
+                    continue
+                text = ''.join(lines)
+                saved = clean.get(name)
+                if saved == (hash_document(text), get_revision(matte)):
+                    dst.write(text)
+                    hashes[name] = saved
+                else:
+                    hashes[name] = self._dump(matte, dst)
+
+    @staticmethod
+    def _dump(matte, dst):
+        revision = get_revision(matte)
+        return dump_matte(matte.data(), dst), revision
+
+    def forget(self, filepath=None):
+        '''Forget the last save of filepath or of every file'''
+
+        if filepath is None:
+            self._saves.clear()
+        else:
+            self._saves.pop(os.path.abspath(filepath), None)
+
+
+SaveCache = SaveCache()
@@ -0,0 +1,561 @@
+'''
+mtoatools.index
+===============
+Scene-level membership index for Matte AOVs. Maps mtoa_constant_* attribute
+names to the shapes carrying them and their colors. The index is built lazily
+one attribute at a time and kept current by Maya DG messages, so MatteAOV
+queries read from memory instead of rescanning every namespace.
+'''
+
+from maya import cmds
+import maya.api.OpenMaya as om
+import pymel.core as pmc
+
+__all__ = ['MatteIndex', 'NodeHandle']
+
+
+ATTR_PREFIX = 'mtoa_constant_'
+
+
+def get_mobject(node):
+    '''Get an MObject from a PyNode, node name or MObject'''
+
+    if isinstance(node, om.MObject):
+        return node
+    if isinstance(node, NodeHandle):
+        return node.object()
+    sel = om.MSelectionList()
+    sel.add(str(node))
+    return sel.getDependNode(0)
+
+
+def get_mobjects(nodes):
+    '''Resolve many nodes to MObjects using a single MSelectionList'''
+
+    sel = om.MSelectionList()
+    mobjects = []
+    for node in nodes:
+        if isinstance(node, om.MObject):
+            mobjects.append(node)
+            continue
+        if isinstance(node, NodeHandle):
+            mobjects.append(node.object())
+            continue
+        sel.add(str(node))
+        mobjects.append(None)
+
+    i = 0
+    for j, mobject in enumerate(mobjects):
+        if mobject is None:
+            mobjects[j] = sel.getDependNode(i)
+            i += 1
+    return mobjects
+
+
+def get_node_name(mobject):
+    '''Unique name of a node, full path for dag nodes'''
+
+    if mobject.hasFn(om.MFn.kDagNode):
+        return om.MDagPath.getAPathTo(mobject).fullPathName()
+    return om.MFnDependencyNode(mobject).name()
+
+
+def get_uuid(mobject):
+    '''Uuid of a node as a string'''
+
+    return om.MFnDependencyNode(mobject).uuid().asString()
+
+
+def get_partial_name(mobject):
+    '''Shortest unique name of a node, like str(PyNode)'''
+
+    if mobject.hasFn(om.MFn.kDagNode):
+        return om.MDagPath.getAPathTo(mobject).partialPathName()
+    return om.MFnDependencyNode(mobject).name()
+
+
+def get_string(mobject, attr_name):
+    '''Read a string attribute from a node'''
+
+    plug = om.MFnDependencyNode(mobject).findPlug(attr_name, False)
+    return plug.asString()
+
+
+def get_source(mobject, attr_name):
+    '''Node connected to the input of an attribute or None'''
+
+    plug = om.MFnDependencyNode(mobject).findPlug(attr_name, False)
+    source = plug.source()
+    if source.isNull:
+        return None
+    return source.node()
+
+
+def get_color(mobject, attr_name):
+    '''Read a float3 attribute from a node as a tuple'''
+
+    plug = om.MFnDependencyNode(mobject).findPlug(attr_name, False)
+    return tuple(plug.child(i).asFloat() for i in xrange(3))
+
+
+def get_plug_value(plug):
+    '''Read a plug as a python value, compounds are read as tuples'''
+
+    if plug.isCompound:
+        return tuple(
+            get_plug_value(plug.child(i)) for i in xrange(plug.numChildren())
+        )
+
+    attr = plug.attribute()
+    if attr.hasFn(om.MFn.kTypedAttribute):
+        return plug.asString()
+    if attr.hasFn(om.MFn.kEnumAttribute):
+        return plug.asInt()
+    if attr.hasFn(om.MFn.kNumericAttribute):
+        numeric_type = om.MFnNumericAttribute(attr).numericType()
+        if numeric_type == om.MFnNumericData.kBoolean:
+            return plug.asBool()
+        if numeric_type in (om.MFnNumericData.kShort,
+                            om.MFnNumericData.kInt,
+                            om.MFnNumericData.kLong,
+                            om.MFnNumericData.kByte,
+                            om.MFnNumericData.kChar):
+            return plug.asInt()
+        return plug.asDouble()
+    if attr.hasFn(om.MFn.kMessageAttribute):
+        return None
+    return cmds.getAttr(plug.name())
+
+
+def get_matte_attrs(mobject):
+    '''List the mtoa_constant_* float3 attributes of a node'''
+
+    attrs = cmds.listAttr(
+        get_node_name(mobject),
+        userDefined=True,
+        string=ATTR_PREFIX + '*'
+    ) or []
+    attrs = set(attrs)
+    return [a for a in attrs if a + 'R' in attrs and a + 'B' in attrs]
+
+
+def get_matte_attr_names():
+    '''List the shape attribute names of every matte aov in the scene'''
+
+    names = set()
+    nodes = cmds.ls('*.is_aov_matte', r=True, objectsOnly=True) or []
+    for node in get_mobjects(nodes):
+        user_data = get_source(node, 'defaultValue')
+        if user_data is not None:
+            names.add(ATTR_PREFIX + get_string(user_data, 'colorAttrName'))
+    return sorted(names)
+
+
+class NodeHandle(object):
+    '''Lightweight reference to a Maya node. Wraps an MObjectHandle and only
+    builds a PyNode when one is requested, attributes missing here are looked
+    up on that PyNode.
+    '''
+
+    __slots__ = ('_handle', '_pynode')
+
+    def __init__(self, node):
+        if isinstance(node, NodeHandle):
+            self._handle = node._handle
+            self._pynode = node._pynode
+            return
+
+        self._pynode = node if isinstance(node, pmc.PyNode) else None
+        self._handle = om.MObjectHandle(get_mobject(node))
+
+    def __repr__(self):
+        return '<NodeHandle>({})'.format(self.name)
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        if not isinstance(other, NodeHandle):
+            return NotImplemented
+        return self._handle == other._handle
+
+    def __ne__(self, other):
+        if not isinstance(other, NodeHandle):
+            return NotImplemented
+        return not self._handle == other._handle
+
+    def __hash__(self):
+        return self._handle.hashCode()
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.pynode(), attr)
+
+    @property
+    def key(self):
+        '''Dict key of this node. Hash codes are not unique, NodeHandles
+        hash by hash code and compare their MObjectHandles.
+        '''
+
+        return self
+
+    @property
+    def name(self):
+        return get_partial_name(self.object())
+
+    @property
+    def long_name(self):
+        return get_node_name(self.object())
+
+    def object(self):
+        return self._handle.object()
+
+    def isValid(self):
+        return self._handle.isValid()
+
+    def hasAttr(self, attr_name):
+        return om.MFnDependencyNode(self.object()).hasAttribute(attr_name)
+
+    def pynode(self):
+        '''PyNode of this node, created on first use'''
+
+        if self._pynode is None:
+            self._pynode = pmc.PyNode(self.long_name)
+        return self._pynode
+
+
+class Members(dict):
+    '''Member colors by key, counting modifications so derived data like
+    the columnar mirror can tell when it is stale.
+    '''
+
+    __slots__ = ('version',)
+
+    def __init__(self, *args, **kwargs):
+        super(Members, self).__init__(*args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        super(Members, self).__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super(Members, self).__delitem__(key)
+        self.version += 1
+
+    def pop(self, key, *default):
+        if key in self:
+            self.version += 1
+        return super(Members, self).pop(key, *default)
+
+    def touch(self):
+        '''Count a change of the members not made through the dict, like a
+        member rename.
+        '''
+
+        self.version += 1
+
+
+class MatteIndex(object):
+    '''Membership index mapping attribute names to shapes and colors.
+
+    Members are keyed by NodeHandle, hashed by MObjectHandle hash code and
+    compared by MObjectHandle. Only nodes that carry or carried matte
+    attributes have a node callback registered, so attribute sets, adds,
+    removes and renames keep the index current. Added shapes are checked for
+    matte attributes on the next query, once duplicates and imports have
+    their attributes. Node removed and scene messages handle the rest.
+
+    Maya has no global attribute added message, so a matte attribute added
+    outside of mtoatools to an existing shape that never carried one, by
+    cmds.addAttr or a reference edit, is not seen until the attribute is
+    forgotten or the index cleared. Loading and deleting mattes forget
+    their attributes first.
+    '''
+
+    def __init__(self):
+        self._members = {}
+        self._columns = {}
+        self._node_callbacks = {}
+        self._added = set()
+        self._callbacks = []
+        self._generation = 0
+        self.dag_version = 0
+
+    def _install(self):
+        if self._callbacks:
+            return
+
+        self._callbacks.append(om.MDGMessage.addNodeAddedCallback(
+            self._on_node_added,
+            'shape'
+        ))
+        self._callbacks.append(om.MDGMessage.addNodeRemovedCallback(
+            self._on_node_removed,
+            'shape'
+        ))
+        self._callbacks.append(om.MNodeMessage.addNameChangedCallback(
+            om.MObject.kNullObj,
+            self._on_name_changed
+        ))
+        reset_messages = [
+            om.MSceneMessage.kBeforeNew,
+            om.MSceneMessage.kBeforeOpen,
+            om.MSceneMessage.kAfterImport,
+            om.MSceneMessage.kAfterCreateReference,
+            om.MSceneMessage.kAfterLoadReference,
+            om.MSceneMessage.kAfterUnloadReference,
+            om.MSceneMessage.kAfterRemoveReference,
+        ]
+        for msg in reset_messages:
+            self._callbacks.append(om.MSceneMessage.addCallback(
+                msg,
+                self._on_scene_changed
+            ))
+
+    def uninstall(self):
+        '''Remove all Maya callbacks and clear the index'''
+
+        self.clear()
+        for callback_id in self._callbacks:
+            om.MMessage.removeCallback(callback_id)
+        self._callbacks = []
+
+    def clear(self):
+        '''Forget everything, the index is rebuilt lazily on next query'''
+
+        for callback_id in self._node_callbacks.values():
+            om.MMessage.removeCallback(callback_id)
+        self._node_callbacks = {}
+        self._added = set()
+        self._members = {}
+        self._columns = {}
+        self._generation += 1
+
+    def _build(self, attr_name):
+        from .scanner import Scanner
+
+        self._install()
+
+        # Scan the attributes of every matte not indexed yet in one pass,
+        # other mattes are usually queried right after the first one
+        attrs = [attr_name] + [
+            name for name in get_matte_attr_names()
+            if name != attr_name and name not in self._members
+        ]
+        for name, found in Scanner.scan(attrs).iteritems():
+            members = Members()
+            self._members[name] = members
+            for mobject, color in Scanner.resolve(name, found):
+                key = self._watch(mobject)
+                members[key] = color
+        return self._members[attr_name]
+
+    def _get(self, attr_name):
+        if self._added:
+            self._scan_added()
+        members = self._members.get(attr_name)
+        if members is None:
+            members = self._build(attr_name)
+        return members
+
+    def _watch(self, mobject):
+        key = NodeHandle(mobject)
+        if key not in self._node_callbacks:
+            self._node_callbacks[key] = (
+                om.MNodeMessage.addAttributeChangedCallback(
+                    mobject,
+                    self._on_attribute_changed,
+                )
+            )
+        return key
+
+    def _unwatch(self, key):
+        callback_id = self._node_callbacks.pop(key, None)
+        if callback_id is not None:
+            om.MMessage.removeCallback(callback_id)
+
+    def _scan(self, mobject):
+        '''Rescan all matte attributes of a single node. Nodes without
+        matte attributes are only watched when they had some before, so
+        undoing the removal of an attribute is seen.
+        '''
+
+        attrs = set(get_matte_attrs(mobject))
+        key = NodeHandle(mobject)
+        if attrs:
+            self._watch(mobject)
+        elif key not in self._node_callbacks:
+            return
+
+        for attr_name, members in self._members.iteritems():
+            if attr_name in attrs:
+                members[key] = get_color(mobject, attr_name)
+            else:
+                members.pop(key, None)
+
+    def _scan_added(self):
+        added, self._added = self._added, set()
+        for handle in added:
+            if handle.isValid():
+                self._scan(handle.object())
+
+    def _on_node_added(self, mobject, data):
+        if om.MFileIO.isReadingFile():
+            return
+        self._added.add(NodeHandle(mobject))
+
+    def _on_node_removed(self, mobject, data):
+        self.dag_version += 1
+        key = NodeHandle(mobject)
+        self._added.discard(key)
+        for members in self._members.itervalues():
+            members.pop(key, None)
+        self._unwatch(key)
+
+    def _on_attribute_changed(self, msg, plug, other_plug, data):
+        structure = (
+            om.MNodeMessage.kAttributeAdded |
+            om.MNodeMessage.kAttributeRemoved |
+            om.MNodeMessage.kAttributeRenamed
+        )
+        if msg & structure:
+            self._scan(plug.node())
+            self._edit_referenced(plug.node())
+        elif msg & om.MNodeMessage.kAttributeSet:
+            if plug.isChild:
+                plug = plug.parent()
+            attr_name = plug.partialName(
+                False, False, False, False, False, True
+            )
+            if not attr_name.startswith(ATTR_PREFIX):
+                return
+            self._edit_referenced(plug.node())
+            members = self._members.get(attr_name)
+            if members is not None:
+                key = NodeHandle(plug.node())
+                members[key] = tuple(
+                    plug.child(i).asFloat() for i in xrange(3)
+                )
+
+    def _edit_referenced(self, mobject):
+        '''Matte edits of referenced nodes change the edits signatures the
+        scanner keeps.
+        '''
+
+        if om.MFnDependencyNode(mobject).isFromReferencedFile:
+            from .scanner import Scanner
+            Scanner.invalidate()
+
+    def _on_name_changed(self, mobject, old_name, data):
+        if om.MFileIO.isReadingFile() or not mobject.hasFn(om.MFn.kDagNode):
+            return
+
+        self.dag_version += 1
+        keys = [NodeHandle(mobject)]
+        if mobject.hasFn(om.MFn.kTransform):
+            # Partial names of shapes below a transform include its name
+            it = om.MItDag()
+            it.reset(mobject)
+            while not it.isDone():
+                keys.append(NodeHandle(it.currentItem()))
+                it.next()
+
+        for members in self._members.itervalues():
+            if any(key in members for key in keys):
+                members.touch()
+
+    def _on_scene_changed(self, *args):
+        from .journal import Journal
+        from .scanner import Scanner
+
+        self.clear()
+        Scanner.invalidate()
+        Journal.record('reset')
+
+    def node(self, key):
+        '''Get the NodeHandle of a member key'''
+
+        return key
+
+    def pynode(self, key):
+        '''Get a cached PyNode for a member key'''
+
+        return key.pynode()
+
+    def items(self, attr_name):
+        '''List of (NodeHandle, color) tuples for the given attribute'''
+
+        members = self._get(attr_name)
+        return members.items()
+
+    def objects(self, attr_name):
+        '''List of NodeHandles carrying the given attribute'''
+
+        members = self._get(attr_name)
+        return members.keys()
+
+    def mobjects(self, attr_name):
+        '''List of MObjects carrying the given attribute'''
+
+        members = self._get(attr_name)
+        return [k.object() for k in members]
+
+    def update(self, attr_name, *nodes):
+        '''Synchronize the index with nodes that were just edited'''
+
+        if attr_name not in self._members:
+            return
+        if self._added:
+            self._scan_added()
+
+        members = self._members[attr_name]
+        for mobject in get_mobjects(nodes):
+            fn = om.MFnDependencyNode(mobject)
+            if fn.hasAttribute(attr_name):
+                key = self._watch(mobject)
+                members[key] = get_color(mobject, attr_name)
+            else:
+                members.pop(NodeHandle(mobject), None)
+
+    def revision(self, attr_name):
+        '''Value changing whenever the members of an attribute, their colors
+        or their names change, including edits made outside of mtoatools.
+        '''
+
+        members = self._get(attr_name)
+        return self._generation, members.version
+
+    def forget(self, attr_name):
+        '''Drop an attribute from the index, it is rescanned on next query'''
+
+        self._members.pop(attr_name, None)
+        self._columns.pop(attr_name, None)
+        self._generation += 1
+
+    def color(self, attr_name, mobject):
+        '''Indexed color of a node or None when it is not a member'''
+
+        key = NodeHandle(mobject)
+        return self._get(attr_name).get(key)
+
+    def columns(self, attr_name):
+        '''Columnar mirror of the given attribute's members, rebuilt only
+        after the members changed. The mirror is a copy kept next to the
+        members, it speeds up whole matte operations at the cost of memory.
+
+        :returns: MatteColumns
+        '''
+
+        from .columns import MatteColumns
+
+        members = self._get(attr_name)
+        version, columns = self._columns.get(attr_name, (None, None))
+        if version != members.version:
+            columns = MatteColumns.from_items(self.items(attr_name))
+            self._columns[attr_name] = (members.version, columns)
+        return columns
+
+
+MatteIndex = MatteIndex()
@@ -0,0 +1,106 @@
+'''
+mtoatools.journal
+=================
+Change journal of Matte AOV edits. Every create, add, discard, color set,
+rename and delete made through the models is recorded with a sequence
+number, so consumers like the UI, autosave or exporters can ask for the
+changes since the last sequence number they processed instead of rescanning
+every matte.
+'''
+
+from collections import deque, namedtuple
+
+__all__ = ['Change', 'Journal']
+
+
+JOURNAL_SIZE = 10000
+KINDS = ('create', 'add', 'discard', 'color', 'rename', 'delete', 'reset')
+
+
+class Change(namedtuple('Change', 'seq kind name aov nodes color old_name')):
+    '''A single recorded change
+
+    :ivar seq: Sequence number, increasing by one per change
+    :ivar kind: "create", "add", "discard", "color", "rename", "delete" or
+        "reset" when consumers need to rebuild everything, after an undo or
+        a scene change
+    :ivar name: Name of the matte
+    :ivar aov: The MatteAOV instance that was edited
+    :ivar nodes: Tuple of the nodes that were edited
+    :ivar color: New color of nodes for "color" changes
+    :ivar old_name: Previous name of the matte for "rename" changes
+    '''
+
+    __slots__ = ()
+
+
+class Journal(object):
+    '''Bounded log of changes. Subscribers are called with every change as
+    it is recorded.
+    '''
+
+    def __init__(self, size=JOURNAL_SIZE):
+        self._changes = deque(maxlen=size)
+        self._subscribers = []
+        self.seq = 0
+
+    def record(self, kind, aov=None, nodes=(), color=None, name=None,
+               old_name=None):
+        '''Record a change
+
+        :param kind: One of KINDS
+        :returns: the recorded Change
+        '''
+
+        if kind not in KINDS:
+            raise ValueError('Unknown change kind: ' + kind)
+
+        if name is None and aov is not None:
+            name = aov.name
+        if color is not None:
+            color = tuple(color)
+
+        self.seq += 1
+        change = Change(
+            self.seq,
+            kind,
+            name,
+            aov,
+            tuple(nodes),
+            color,
+            old_name
+        )
+        self._changes.append(change)
+        for subscriber in list(self._subscribers):
+            subscriber(change)
+        return change
+
+    def changes_since(self, seq):
+        '''Changes recorded after seq
+
+        :returns: list of Change or None when the journal no longer holds
+            every change since seq, consumers should then rebuild everything
+        '''
+
+        if seq >= self.seq:
+            return []
+        if not self._changes or self._changes[0].seq > seq + 1:
+            return None
+        start = seq + 1 - self._changes[0].seq
+        return list(self._changes)[start:]
+
+    def subscribe(self, callback):
+        '''Call callback with every recorded change'''
+
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def clear(self):
+        self._changes.clear()
+
+
+Journal = Journal()
@@ -0,0 +1,329 @@
+'''
+mtoatools.library
+=================
+Binary matte libraries. A library holds a header, the shape data of each
+matte, a table of interned strings and a table of contents. Libraries are
+read through mmap, so loading one matte of a huge library only touches the
+pages holding that matte and the strings it uses.
+
+Layout, little endian::
+
+    header    magic, version, matte count, toc offset,
+              string count, string table offset
+    mattes    per matte: uint32 name ids, uint32 namespace ids and
+              float32 rgb colors of its shapes
+    strings   uint64 offsets of each string followed by utf-8 text
+    toc       per matte: name id, info id, shape count, data offset
+
+Namespaces of shapes in the root namespace and mattes without info use the
+id 0xFFFFFFFF. Info holds the keys of a matte other than name and shapes,
+like packed, as json.
+'''
+
+import json
+import mmap
+import struct
+from .columns import MatteColumns
+try:
+    import numpy as np
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+__all__ = ['MatteLibrary', 'dump_library', 'yaml_to_library',
+           'library_to_yaml']
+
+
+MAGIC = b'MTOAMATT'
+VERSION = 1
+NONE = 0xFFFFFFFF
+HEADER = struct.Struct('<8sIIQIQ')
+TOC_ENTRY = struct.Struct('<IIIQ')
+
+
+def to_str(value):
+    '''Decode utf-8, keeping ascii text a str'''
+
+    value = value.decode('utf-8')
+    try:
+        return str(value)
+    except UnicodeError:
+        return value
+
+
+def pack_array(code, values):
+    '''Pack values as a little endian array of a struct type code'''
+
+    if numpy_enabled:
+        dtype = {'I': '<u4', 'f': '<f4'}[code]
+        return np.asarray(values, dtype=dtype).tobytes()
+    return struct.pack('<{}{}'.format(len(values), code), *values)
+
+
+def unpack_array(code, count, buffer, offset):
+    '''Unpack a little endian array, a copy of the values in buffer'''
+
+    if numpy_enabled:
+        dtype = {'I': '<u4', 'f': '<f4'}[code]
+        return np.frombuffer(buffer, dtype, count, offset).copy()
+    return struct.unpack_from('<{}{}'.format(count, code), buffer, offset)
+
+
+def dump_library(mattes, stream):
+    '''Write matte data to a binary library
+
+    :param mattes: iterable of matte data dicts, consumed one at a time
+    :param stream: seekable file like object opened for binary writing
+    '''
+
+    strings = {}
+
+    def intern(value):
+        if value is None:
+            return NONE
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    start = stream.tell()
+    stream.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0, 0))
+
+    toc = []
+    for matte_data in mattes:
+        shapes = matte_data.get('shapes') or []
+        info = dict(
+            (key, value) for key, value in matte_data.items()
+            if key not in ('name', 'shapes')
+        )
+        toc.append((
+            intern(matte_data['name']),
+            intern(json.dumps(info, sort_keys=True)) if info else NONE,
+            len(shapes),
+            stream.tell() - start
+        ))
+
+        colors = []
+        for shape in shapes:
+            colors.extend(shape['color'])
+        stream.write(pack_array('I', [intern(s['name']) for s in shapes]))
+        stream.write(pack_array('I', [
+            intern(s['namespace']) for s in shapes
+        ]))
+        stream.write(pack_array('f', colors))
+
+    values = sorted(strings, key=strings.get)
+    offsets = [0]
+    for value in values:
+        offsets.append(offsets[-1] + len(value))
+    strings_offset = stream.tell() - start
+    stream.write(struct.pack('<{}Q'.format(len(offsets)), *offsets))
+    stream.write(b''.join(values))
+
+    toc_offset = stream.tell() - start
+    for entry in toc:
+        stream.write(TOC_ENTRY.pack(*entry))
+
+    end = stream.tell()
+    stream.seek(start)
+    stream.write(HEADER.pack(
+        MAGIC,
+        VERSION,
+        len(toc),
+        toc_offset,
+        len(values),
+        strings_offset
+    ))
+    stream.seek(end)
+
+
+class MatteLibrary(object):
+    '''Memory mapped reader of a binary matte library
+
+    Usage::
+
+        with MatteLibrary('mattes.mtl') as library:
+            for name in library.names():
+                print name, len(library.columns(name))
+            matte_data = library['my_matte']
+    '''
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._file = open(filepath, 'rb')
+        try:
+            self._mmap = mmap.mmap(
+                self._file.fileno(),
+                0,
+                access=mmap.ACCESS_READ
+            )
+        except (ValueError, mmap.error):
+            self._file.close()
+            raise ValueError('Not a matte library: ' + filepath)
+
+        if len(self._mmap) < HEADER.size:
+            self.close()
+            raise ValueError('Not a matte library: ' + filepath)
+
+        header = HEADER.unpack_from(self._mmap, 0)
+        magic, version, count, toc_offset, string_count, strings_offset = (
+            header
+        )
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('Not a matte library: ' + filepath)
+        if version != VERSION:
+            self.close()
+            raise ValueError('Unsupported matte library version: {}'.format(
+                version
+            ))
+
+        self._toc = [
+            TOC_ENTRY.unpack_from(self._mmap, toc_offset + i * TOC_ENTRY.size)
+            for i in xrange(count)
+        ]
+        self._offsets = strings_offset
+        self._text = strings_offset + 8 * (string_count + 1)
+        self._strings = {}
+        self._index = None
+
+    def __repr__(self):
+        return '<MatteLibrary>({!r}, {} mattes)'.format(
+            self.filepath,
+            len(self)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._toc)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        for i in xrange(len(self._toc)):
+            yield self.data(i)
+
+    def __getitem__(self, name):
+        return self.data(self.index[name])
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def string(self, index):
+        '''String of the string table at index, None for NONE'''
+
+        if index == NONE:
+            return None
+
+        value = self._strings.get(index)
+        if value is None:
+            start, end = struct.unpack_from(
+                '<QQ',
+                self._mmap,
+                self._offsets + 8 * index
+            )
+            value = to_str(self._mmap[self._text + start:self._text + end])
+            self._strings[index] = value
+        return value
+
+    @property
+    def index(self):
+        '''Map matte names to their position in the library'''
+
+        if self._index is None:
+            self._index = dict(
+                (self.string(entry[0]), i)
+                for i, entry in enumerate(self._toc)
+            )
+        return self._index
+
+    def names(self):
+        '''Names of the mattes in library order'''
+
+        return [self.string(entry[0]) for entry in self._toc]
+
+    def columns(self, matte):
+        '''MatteColumns of the shapes of a matte
+
+        :param matte: name or position of a matte
+        '''
+
+        if not isinstance(matte, (int, long)):
+            matte = self.index[matte]
+        name_id, info_id, count, offset = self._toc[matte]
+
+        buffer = self._mmap
+        name_ids = unpack_array('I', count, buffer, offset)
+        namespace_ids = unpack_array('I', count, buffer, offset + 4 * count)
+        colors = unpack_array('f', count * 3, buffer, offset + 8 * count)
+
+        if numpy_enabled:
+            name_ids = name_ids.tolist()
+            ids, namespace_ids = np.unique(namespace_ids, return_inverse=True)
+            ids = ids.tolist()
+            namespace_ids = namespace_ids.astype(np.int32)
+            colors = colors.astype(np.float32).reshape(-1, 3)
+        else:
+            table = {}
+            ids = []
+            rows = []
+            for i in namespace_ids:
+                row = table.get(i)
+                if row is None:
+                    row = table[i] = len(ids)
+                    ids.append(i)
+                rows.append(row)
+            namespace_ids = rows
+            colors = zip(colors[::3], colors[1::3], colors[2::3])
+
+        return MatteColumns(
+            [None] * count,
+            [self.string(i) for i in ids],
+            namespace_ids,
+            [self.string(i) for i in name_ids],
+            colors
+        )
+
+    def data(self, matte):
+        '''Matte data dict of a matte, as loaded from a matte file
+
+        :param matte: name or position of a matte
+        '''
+
+        if not isinstance(matte, (int, long)):
+            matte = self.index[matte]
+        name_id, info_id, count, offset = self._toc[matte]
+
+        data = {}
+        if info_id != NONE:
+            data.update(json.loads(self.string(info_id)))
+        data['name'] = self.string(name_id)
+        data['shapes'] = self.columns(matte).data()
+        return data
+
+
+def yaml_to_library(yaml_path, library_path):
+    '''Convert a matte file to a binary library'''
+
+    from .files import iter_mattes
+
+    with open(yaml_path, 'r') as src, open(library_path, 'wb') as dst:
+        dump_library(iter_mattes(src), dst)
+
+
+def library_to_yaml(library_path, yaml_path):
+    '''Convert a binary library to a matte file'''
+
+    from .files import dump_mattes
+
+    with MatteLibrary(library_path) as src, open(yaml_path, 'w') as dst:
+        dump_mattes(iter(src), dst)
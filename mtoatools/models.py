@@ -3,48 +3,120 @@ mtoatools.models
 ================
 '''
 
-from operator import itemgetter
 from collections import defaultdict
+from maya import cmds
 import pymel.core as pmc
-from .utils import add_vector_attr, get_next_name
+import maya.api.OpenMaya as om
+from . import bulk
+from .utils import get_next_name, get_shape_index
+from .index import (MatteIndex, NodeHandle, get_node_name, get_mobject,
+                    get_mobjects, get_plug_value, get_source, get_string)
+from .index import get_color as get_attr_color
+from .packing import CHANNELS, ChannelPacker
+from .columns import MatteColumns
+from .journal import Journal
+from .colors import COLOR_TOLERANCE, ID_LEVELS, id_colors, id_key, quantize
+from .rules import HierarchyRule, Rule, apply_rules, install_rules
 from .packages import yaml
 
-__all__ = ['Defaults', 'create_aov', 'MatteAOV']
+__all__ = ['Defaults', 'create_aov', 'MatteAOV', 'PackedMatte',
+           'OperatorMatte', 'get_shape_mattes', 'repack']
+
+
+# Parsed matte rules by the text of their rules attribute
+_parsed_rules = {}
 
 
 class Defaults(object):
+    '''Cached access to the Arnold render settings nodes. Each node is looked
+    up once and held as a NodeHandle until a new scene is created or opened.
+    '''
+
+    node_names = {
+        'driver': 'defaultArnoldDriver',
+        'filter': 'defaultArnoldFilter',
+        'options': 'defaultArnoldRenderOptions',
+    }
 
     def __init__(self):
-        self._driver = None
-        self._filter = None
-        self._options = None
+        self._nodes = {}
+        self._callbacks = []
+
+    def _install(self):
+        if self._callbacks:
+            return
+
+        for msg in (om.MSceneMessage.kBeforeNew, om.MSceneMessage.kBeforeOpen):
+            self._callbacks.append(om.MSceneMessage.addCallback(
+                msg,
+                self._on_scene_changed
+            ))
+
+    def uninstall(self):
+        '''Remove all Maya callbacks and clear the cache'''
+
+        self.clear()
+        for callback_id in self._callbacks:
+            om.MMessage.removeCallback(callback_id)
+        self._callbacks = []
+
+    def clear(self):
+        self._nodes = {}
+
+    def _on_scene_changed(self, *args):
+        self.clear()
+
+    def get_node(self, key):
+        '''Get the cached NodeHandle of a render settings node
+
+        :param key: "driver", "filter" or "options"
+        '''
+
+        node = self._nodes.get(key)
+        if node is None or not node.isValid():
+            self._install()
+            try:
+                node = NodeHandle(self.node_names[key])
+            except RuntimeError:
+                raise Exception('Arnold is not the current renderer')
+            self._nodes[key] = node
+        return node
 
     @property
     def driver(self):
-        if not self._driver:
-            try:
-                self._driver = pmc.PyNode('defaultArnoldDriver')
-            except TypeError:
-                raise Exception('Arnod is not the current renderer')
-        return self._driver
+        return self.get_node('driver')
 
     @property
     def filter(self):
-        if not self._driver:
-            try:
-                self._driver = pmc.PyNode('defaultArnoldFilter')
-            except TypeError:
-                raise Exception('Arnod is not the current renderer')
-        return self._driver
+        return self.get_node('filter')
 
     @property
     def options(self):
-        if not self._driver:
-            try:
-                self._driver = pmc.PyNode('defaultArnoldRenderOptions')
-            except TypeError:
-                raise Exception('Arnod is not the current renderer')
-        return self._driver
+        return self.get_node('options')
+
+    def get(self, attrs, node='options'):
+        '''Read many attributes of a render settings node at once
+
+        :param attrs: list of attribute names
+        :param node: "driver", "filter" or "options"
+        :returns: dict mapping attribute names to values
+        '''
+
+        fn = om.MFnDependencyNode(self.get_node(node).object())
+        return dict(
+            (attr, get_plug_value(fn.findPlug(attr, False))) for attr in attrs
+        )
+
+    def set(self, values, node='options'):
+        '''Set many attributes of a render settings node in one undo step
+
+        :param values: dict mapping attribute names to values
+        :param node: "driver", "filter" or "options"
+        '''
+
+        modifier = om.MDGModifier()
+        bulk.set_values(modifier, self.get_node(node).object(), values)
+        bulk.execute(modifier)
 
 Defaults = Defaults()
 
@@ -62,26 +134,47 @@ def create_aov(name, _type):
 
 class MatteAOV(object):
     '''Arnold Matte AOV object. Used to manipulate a vector aov as if it were
-    a set.
+    a set. The aov and user data nodes are held as NodeHandles.
     '''
 
+    __slots__ = ('aov', 'user_data')
+
     def __init__(self, aov, user_data):
-        self.aov = aov
-        self.user_data = user_data
+        self.aov = NodeHandle(aov)
+        self.user_data = NodeHandle(user_data)
 
     def __repr__(self):
         return '<MatteAOV>({}, {})'.format(str(self.aov), str(self.user_data))
 
     def __iter__(self):
-        for node in self.get_objects():
-            yield node, node.attr(self.mesh_attr_name).get()
+        for node, color in MatteIndex.items(self.mesh_attr_name):
+            yield node, color
 
     @classmethod
-    def create(cls, name):
+    def create(cls, name, packed=False, operator=False, nodes=None):
+        '''Create a matte
+
+        :param nodes: Nodes added to the matte in white, defaults to the
+            selected transforms
+        '''
+
+        if packed:
+            return PackedMatte.create(name, nodes=nodes)
+        if operator:
+            return OperatorMatte.create(name, nodes=nodes)
+
         name = cls.get_unused_name(name)
+        if nodes is None:
+            nodes = pmc.selected(type='transform')
+
+        aov = cls._create_nodes(name)
+        Journal.record('create', aov)
+        aov.set_objects_color((1, 1, 1), *nodes)
 
-        selected = pmc.selected(type='transform')
+        return aov
 
+    @classmethod
+    def _create_nodes(cls, name):
         aov = create_aov(name, 'vector').node
         aov.addAttr('is_aov_matte', at='bool', dv=1)
         aov_name = str(aov).replace('aiAOV_', '')
@@ -90,18 +183,130 @@ class MatteAOV(object):
         user_data.colorAttrName.set(aov_name)
         user_data.outColor.connect(aov.defaultValue)
 
-        aov = cls(aov, user_data)
-        aov.set_objects_color((1, 1, 1), *selected)
+        return cls(aov, user_data)
 
-        return aov
+    @classmethod
+    def create_many(cls, specs):
+        '''Create many mattes in one batch and one undo step. Names are
+        allocated against a single snapshot of the existing aov names and all
+        nodes are created, wired and colored in three modifiers.
+
+        :param specs: list of matte names or dicts with a name and optional
+            nodes and color keys
+        :returns: list of MatteAOV instances
+        '''
+
+        specs = [
+            {'name': spec} if isinstance(spec, basestring) else dict(spec)
+            for spec in specs
+        ]
+        used = set(
+            node.replace('aiAOV_', '', 1)
+            for node in cmds.ls(type='aiAOV') or []
+        )
+        for spec in specs:
+            spec['name'] = get_next_name(spec['name'], used)
+            used.add(spec['name'])
+
+        options = bulk.get_plug('defaultArnoldRenderOptions.aovList')
+        driver = bulk.get_plug('defaultArnoldDriver.message')
+        filter_ = bulk.get_plug('defaultArnoldFilter.message')
+        nodes = []
+
+        def create_nodes(modifier):
+            for spec in specs:
+                aov = modifier.createNode('aiAOV')
+                modifier.renameNode(aov, 'aiAOV_' + spec['name'])
+                attr = om.MFnNumericAttribute().create(
+                    'is_aov_matte',
+                    'is_aov_matte',
+                    om.MFnNumericData.kBoolean,
+                    True
+                )
+                modifier.addAttribute(aov, attr)
+                user_data = modifier.createNode('aiUserDataColor')
+                modifier.renameNode(user_data, spec['name'] + '_color')
+                nodes.append((aov, user_data))
+
+        def wire_nodes(modifier):
+            index = bulk.next_index(options)
+            for spec, (aov, user_data) in zip(specs, nodes):
+                aov_fn = om.MFnDependencyNode(aov)
+                user_data_fn = om.MFnDependencyNode(user_data)
+                type_plug = aov_fn.findPlug('type', False)
+                vector = om.MFnEnumAttribute(
+                    type_plug.attribute()
+                ).fieldValue('vector')
+
+                modifier.newPlugValueString(
+                    aov_fn.findPlug('name', False),
+                    spec['name']
+                )
+                modifier.newPlugValueInt(type_plug, vector)
+                modifier.newPlugValueString(
+                    user_data_fn.findPlug('colorAttrName', False),
+                    spec['name']
+                )
+                modifier.connect(
+                    user_data_fn.findPlug('outColor', False),
+                    aov_fn.findPlug('defaultValue', False)
+                )
+                modifier.connect(
+                    aov_fn.findPlug('message', False),
+                    options.elementByLogicalIndex(index)
+                )
+                output = aov_fn.findPlug('outputs', False)
+                output = output.elementByLogicalIndex(0)
+                modifier.connect(
+                    driver,
+                    output.child(aov_fn.attribute('driver'))
+                )
+                modifier.connect(
+                    filter_,
+                    output.child(aov_fn.attribute('filter'))
+                )
+                index += 1
+
+        def color_nodes(modifier):
+            for spec in specs:
+                if spec.get('nodes'):
+                    bulk.set_colors(
+                        modifier,
+                        bulk.get_shapes(spec['nodes']),
+                        'mtoa_constant_' + spec['name'],
+                        spec.get('color', (1, 1, 1))
+                    )
+
+        bulk.execute(bulk.Batch(create_nodes, wire_nodes, color_nodes))
+
+        mattes = [cls(aov, user_data) for aov, user_data in nodes]
+        for matte in mattes:
+            Journal.record('create', matte)
+        return mattes
 
     @classmethod
     def ls(cls):
         aovs = []
-        for node in pmc.ls('*.is_aov_matte', r=True, objectsOnly=True):
-            inputs = node.defaultValue.inputs()
-            if inputs:
-                aovs.append(cls(node, inputs[0]))
+        for aov in cls.ls_all():
+            if aov.aov.hasAttr('is_packed_matte'):
+                aovs.extend(PackedMatte.from_physical(aov))
+            elif aov.aov.hasAttr('matte_operator'):
+                aovs.append(OperatorMatte(aov.aov, aov.user_data))
+            else:
+                aovs.append(aov)
+        return aovs
+
+    @classmethod
+    def ls_all(cls):
+        '''List all matte aovs including the physical aovs of packed mattes
+        '''
+
+        aovs = []
+        nodes = cmds.ls('*.is_aov_matte', r=True, objectsOnly=True) or []
+        for node in get_mobjects(nodes):
+            user_data = get_source(node, 'defaultValue')
+            if user_data is not None:
+                aovs.append(cls(node, user_data))
         return aovs
 
     @staticmethod
@@ -112,110 +317,441 @@ class MatteAOV(object):
 
     @property
     def name(self):
-        return self.aov.attr('name').get()
+        return get_string(self.aov.object(), 'name')
 
     def rename(self, name):
+        old_name = self.name
         name = self.get_unused_name(name)
         mesh_attr_name = 'mtoa_constant_' + name
+        old_attr_name = self.mesh_attr_name
+        shapes = MatteIndex.mobjects(old_attr_name)
+        aov, user_data = get_mobjects([self.aov, self.user_data])
+        MatteIndex.forget(old_attr_name)
 
-        # Rename mesh attributes
-        for obj in self.get_objects():
-            old_attr = str(obj.attr(self.mesh_attr_name))
-            pmc.renameAttr(old_attr, mesh_attr_name)
-            for c in 'RGB':
-                pmc.renameAttr(old_attr + c, mesh_attr_name + c)
+        with bulk.transaction() as tx:
+            # Rename mesh attributes
+            tx.apply(bulk.rename_attrs, shapes, old_attr_name, mesh_attr_name)
 
-        # Rename AOV
-        self.aov.attr('name').set(name)
-        self.aov.rename('aiAOV_' + name)
+            # Rename AOV, aiUserData and change attribute name
+            tx.apply(self._rename_nodes, aov, user_data, name)
 
-        # Rename aiUserData and change attribute name
-        self.user_data.rename(name + '_color')
-        self.user_data.colorAttrName.set(name)
+        Journal.record('rename', self, name=name, old_name=old_name)
+
+    @staticmethod
+    def _rename_nodes(modifier, aov, user_data, name):
+        bulk.set_string(modifier, aov, 'name', name)
+        modifier.renameNode(aov, 'aiAOV_' + name)
+        modifier.renameNode(user_data, name + '_color')
+        bulk.set_string(modifier, user_data, 'colorAttrName', name)
 
     @property
     def color_attr_name(self):
-        return self.user_data.colorAttrName.get()
+        return get_string(self.user_data.object(), 'colorAttrName')
 
     @property
     def mesh_attr_name(self):
         return 'mtoa_constant_' + self.color_attr_name
 
-    def get_sorted_objects(self):
-        objects = defaultdict(list)
-        for node in self.get_objects():
-            color = tuple(node.attr(self.mesh_attr_name).get())
-            objects[color].append(node)
+    def get_color(self, node):
+        return get_attr_color(get_mobject(node), self.mesh_attr_name)
+
+    @property
+    def rules_attr_name(self):
+        return 'matte_rules'
+
+    @property
+    def rules(self):
+        '''Rules adding shapes to this matte dynamically. Parsed rules are
+        cached by the text of the rules attribute, so editing the attribute
+        invalidates them.
+        '''
+
+        if not self.aov.hasAttr(self.rules_attr_name):
+            return []
+
+        text = get_string(self.aov.object(), self.rules_attr_name)
+        rules = _parsed_rules.get(text)
+        if rules is None:
+            if len(_parsed_rules) > 256:
+                _parsed_rules.clear()
+            data = yaml.safe_load(text or '')
+            rules = [Rule.from_data(rule) for rule in data or []]
+            _parsed_rules[text] = rules
+        return list(rules)
+
+    def set_rules(self, rules):
+        aov = self.aov.object()
+        with bulk.transaction() as tx:
+            if not self.aov.hasAttr(self.rules_attr_name):
+                tx.apply(bulk.add_string_attr, aov, self.rules_attr_name)
+            tx.apply(
+                bulk.set_string,
+                aov,
+                self.rules_attr_name,
+                yaml.safe_dump([rule.data() for rule in rules])
+            )
+        install_rules()
+
+    @property
+    def rule_shapes_attr_name(self):
+        return self.rules_attr_name + '_shapes'
+
+    @property
+    def rule_uuids(self):
+        '''Uuids of the shapes added to this matte by its rules'''
+
+        if not self.aov.hasAttr(self.rule_shapes_attr_name):
+            return set()
+        return set(
+            get_string(self.aov.object(), self.rule_shapes_attr_name).split()
+        )
+
+    @property
+    def rule_shapes(self):
+        '''Long names of the shapes added to this matte by its rules. Shapes
+        are stored by uuid so they are tracked through renames.
+        '''
+
+        uuids = self.rule_uuids
+        if not uuids:
+            return set()
+        return set(cmds.ls(list(uuids), long=True) or [])
+
+    def set_rule_shapes(self, shapes):
+        self.set_rule_uuids(cmds.ls(list(shapes), uuid=True) or [])
+
+    def set_rule_uuids(self, uuids):
+        aov = self.aov.object()
+        with bulk.transaction() as tx:
+            if not self.aov.hasAttr(self.rule_shapes_attr_name):
+                tx.apply(bulk.add_string_attr, aov, self.rule_shapes_attr_name)
+            tx.apply(
+                bulk.set_string,
+                aov,
+                self.rule_shapes_attr_name,
+                ' '.join(sorted(set(uuids)))
+            )
+
+    def has_member(self, mobject):
+        '''Is a shape a member, answered from the MatteIndex'''
+
+        return MatteIndex.color(self.mesh_attr_name, mobject) is not None
+
+    def add_rule(self, rule):
+        '''Add a rule and apply it to the scene
+
+        :param rule: NameRule, RegexRule, NamespaceRule, SetRule or ShaderRule
+        '''
+
+        rules = [r for r in self.rules if r != rule]
+        rules.append(rule)
+        with bulk.transaction():
+            self.set_rules(rules)
+            return apply_rules(self, rules)
+
+    def set_hierarchy_color(self, rgb, *nodes):
+        '''Color every shape below transforms or groups, including shapes
+        parented below them later. The hierarchies are walked once and a
+        HierarchyRule is stored for each transform.
+        '''
+
+        transforms = [
+            get_node_name(mobject) for mobject in get_mobjects(nodes)
+            if mobject.hasFn(om.MFn.kTransform)
+        ]
+        rules = [
+            rule for rule in self.rules
+            if not (isinstance(rule, HierarchyRule)
+                    and rule.root() in transforms)
+        ]
+        hierarchies = [HierarchyRule.from_node(t, rgb) for t in transforms]
+        rules.extend(hierarchies)
+
+        shapes = set().union(*[rule.select() for rule in hierarchies])
+        with bulk.transaction():
+            self.set_rules(rules)
+            self.set_objects_color(rgb, *nodes)
+            self.set_rule_uuids(
+                self.rule_uuids | set(cmds.ls(list(shapes), uuid=True) or [])
+            )
+
+    def remove_rule(self, rule):
+        '''Remove a rule, discarding the shapes no remaining rule matches'''
+
+        rules = [r for r in self.rules if r != rule]
+        with bulk.transaction():
+            self.set_rules(rules)
+            apply_rules(self, rules)
+
+    def apply_rules(self, prune=False, recolor=False):
+        '''Evaluate all rules against the whole scene. Shapes added by the
+        rules that no longer match are discarded.
+
+        :param prune: Also discard members added by hand that match no rule
+        :param recolor: Reset shapes added by the rules to the rule colors
+        '''
+
+        matched = apply_rules(self, self.rules, recolor=recolor)
+        if prune:
+            members = MatteIndex.mobjects(self.mesh_attr_name)
+            self.discard(*[
+                m for m in members if get_node_name(m) not in matched
+            ])
+        return matched
+
+    def get_sorted_objects(self, tolerance=COLOR_TOLERANCE):
+        '''List of (color, nodes) tuples sorted by color. Colors within
+        tolerance of each other are grouped together.
+        '''
+
+        return self.columns().groups(tolerance)
 
-        return sorted(objects.items(), key=itemgetter(0), reverse=True)
+    def columns(self):
+        '''Columnar mirror of this matte's members
+
+        :returns: MatteColumns
+        '''
+
+        return MatteIndex.columns(self.mesh_attr_name)
 
     def get_objects(self):
-        ls = set(pmc.ls('*.' + self.mesh_attr_name, r=True, objectsOnly=True))
-        return list(ls)
+        return MatteIndex.objects(self.mesh_attr_name)
+
+    def revision(self):
+        '''Value changing whenever the members or colors of this matte
+        change, used by files.SaveCache to skip unchanged mattes.
+        '''
+
+        return (
+            self.name,
+            MatteIndex.revision(self.mesh_attr_name),
+            self.default_color
+        )
 
     def add(self, *nodes):
-        added_nodes = []
-        for node in nodes:
-            if node.type() == 'transform':
-                node = node.getShape()
-            if not hasattr(node, self.mesh_attr_name):
-                add_vector_attr(node, self.mesh_attr_name)
-                added_nodes.append(node)
-        return added_nodes
+        shapes = bulk.get_shapes(nodes)
+        with bulk.transaction() as tx:
+            added = tx.apply(bulk.add_attrs, shapes, self.mesh_attr_name)
+            MatteIndex.update(self.mesh_attr_name, *added)
+            added = [NodeHandle(shape) for shape in added]
+            if added:
+                Journal.record('add', self, added)
+            if added and self.id_mode:
+                self.assign_id_colors(*added)
+        return added
+
+    @property
+    def id_mode(self):
+        '''ID matte mode, "shape", "namespace" or None'''
+
+        if self.aov.hasAttr('matte_id_mode'):
+            return get_string(self.aov.object(), 'matte_id_mode') or None
+
+    def set_id_mode(self, mode, levels=ID_LEVELS):
+        '''Turn this matte into an ID matte. Every member gets a
+        deterministic color derived from a hash of its name or namespace.
+
+        :param mode: "shape", "namespace" or None to turn ID mode off
+        :param levels: Steps per channel of the ID palette
+        '''
+
+        aov = self.aov.object()
+        with bulk.transaction() as tx:
+            if not self.aov.hasAttr('matte_id_mode'):
+                tx.apply(self._add_id_attrs, aov)
+            tx.apply(
+                bulk.set_values,
+                aov,
+                {'matte_id_mode': mode or '', 'matte_id_levels': levels}
+            )
+            if mode:
+                self.assign_id_colors()
+
+    @staticmethod
+    def _add_id_attrs(modifier, aov):
+        bulk.add_string_attr(modifier, aov, 'matte_id_mode')
+        attr = om.MFnNumericAttribute().create(
+            'matte_id_levels',
+            'matte_id_levels',
+            om.MFnNumericData.kInt,
+            ID_LEVELS
+        )
+        modifier.addAttribute(aov, attr)
+
+    def assign_id_colors(self, *nodes):
+        '''Assign ID colors to nodes, all members by default, in one batch.
+        Nodes sharing a key with other members take their color, other
+        nodes avoid the colors of the other members.
+        '''
+
+        mode = self.id_mode or 'shape'
+        levels = ID_LEVELS
+        if self.aov.hasAttr('matte_id_levels'):
+            levels = self.aov.matte_id_levels.get()
+
+        taken = {}
+        if nodes:
+            shapes = bulk.get_shapes(nodes)
+            batch = set(NodeHandle(s) for s in shapes)
+            for node, color in self:
+                if node not in batch:
+                    taken[id_key(node.long_name, mode)] = color
+        else:
+            shapes = MatteIndex.mobjects(self.mesh_attr_name)
+
+        names = [get_node_name(shape) for shape in shapes]
+        colors = id_colors(names, mode, levels, taken)
+        groups = defaultdict(list)
+        for name, shape in zip(names, shapes):
+            groups[colors[name]].append(shape)
+
+        with bulk.transaction():
+            for color, color_shapes in groups.iteritems():
+                self._set_color(color, color_shapes)
 
     def discard(self, *nodes):
-        removed_nodes = []
-        for node in nodes:
-            if (node.type() == 'transform'
-                and not hasattr(node, self.mesh_attr_name)):
-                node = node.getShape()
-            if hasattr(node, self.mesh_attr_name):
-                node.attr(self.mesh_attr_name).delete()
-                removed_nodes.append(node)
-        return removed_nodes
+        shapes = bulk.get_shapes(nodes, self.mesh_attr_name)
+        with bulk.transaction() as tx:
+            removed = tx.apply(bulk.remove_attrs, shapes, self.mesh_attr_name)
+        MatteIndex.update(self.mesh_attr_name, *removed)
+        removed = [NodeHandle(shape) for shape in removed]
+        if removed:
+            Journal.record('discard', self, removed)
+        return removed
+
+    @property
+    def default_color(self):
+        '''Color of shapes without a color of their own, the default value
+        of the user data node.
+        '''
+
+        return get_attr_color(self.user_data.object(), 'defaultValue')
 
     def set_default_color(self, rgb):
-        self.user_data.defaultValue.set(*rgb)
+        with bulk.transaction() as tx:
+            tx.apply(self._set_default, self.user_data.object(), rgb)
+
+    @staticmethod
+    def _set_default(modifier, user_data, rgb):
+        plug = om.MFnDependencyNode(user_data).findPlug('defaultValue', False)
+        for i, value in enumerate(rgb):
+            if value is not None:
+                modifier.newPlugValueFloat(plug.child(i), value)
 
     def set_all_objects_color(self, rgb):
-        for node in self.get_objects():
-            node.attr(self.mesh_attr_name).set(*rgb)
+        self._set_color(rgb, MatteIndex.mobjects(self.mesh_attr_name))
 
     def set_objects_color(self, rgb, *nodes):
-        for node in nodes:
-            if node.type() == 'transform':
-                node = node.getShape()
-            if not hasattr(node, self.mesh_attr_name):
-                self.add(node)
-            node.attr(self.mesh_attr_name).set(*rgb)
+        self._set_color(rgb, bulk.get_shapes(nodes))
+
+    def _set_color(self, rgb, shapes):
+        shapes = self._changed(shapes, rgb)
+        if not shapes:
+            return
+
+        # Shapes without the attribute become members when it is set
+        added = []
+        members = []
+        for shape in shapes:
+            if MatteIndex.color(self.mesh_attr_name, shape) is None:
+                added.append(NodeHandle(shape))
+            else:
+                members.append(NodeHandle(shape))
+
+        with bulk.transaction() as tx:
+            tx.apply(bulk.set_colors, shapes, self.mesh_attr_name, rgb)
+        MatteIndex.update(self.mesh_attr_name, *shapes)
+        if added:
+            Journal.record('add', self, added, rgb)
+        if members:
+            Journal.record('color', self, members, rgb)
+
+    def _changed(self, shapes, rgb):
+        '''Shapes whose indexed color differs from rgb'''
+
+        changed = []
+        for shape in shapes:
+            color = MatteIndex.color(self.mesh_attr_name, shape)
+            if color is None or any(
+                abs(a - b) > 1e-6 for a, b in zip(color, rgb)
+            ):
+                changed.append(shape)
+        return changed
 
     def delete(self):
-        self.discard(*self.get_objects())
-        pmc.delete(self.aov)
-        pmc.delete(self.user_data)
+        name = self.name
+        shapes = MatteIndex.mobjects(self.mesh_attr_name)
+        nodes = get_mobjects([self.aov, self.user_data])
+        with bulk.transaction() as tx:
+            tx.apply(bulk.remove_attrs, shapes, self.mesh_attr_name)
+            tx.apply(bulk.delete_nodes, nodes)
+        MatteIndex.forget(self.mesh_attr_name)
+        Journal.record('delete', self, name=name)
 
-    def data(self):
-        '''Simple dict representation of matte aov for use with serialization
+    @classmethod
+    def delete_many(cls, mattes):
+        '''Delete many mattes in one transaction and one undo step. The
+        attributes and nodes of all plain and operator mattes are removed by
+        a single modifier, packed mattes are released. The channels of the
+        remaining packed mattes do not change.
+
+        :param mattes: list of MatteAOV, PackedMatte or OperatorMatte
         '''
 
-        data = {'name': self.name, 'shapes': []}
-        for obj in self.get_objects():
-            full_name = str(obj)
-            parts = full_name.split(':')
+        names = [matte.name for matte in mattes]
+        attrs = []
+        nodes = []
+        packed = []
+        for matte in mattes:
+            if isinstance(matte, PackedMatte):
+                packed.append(matte)
+                continue
+            if isinstance(matte, OperatorMatte):
+                nodes.extend(matte._nodes())
+                continue
+            attrs.append(matte.mesh_attr_name)
+            nodes.extend(get_mobjects([matte.aov, matte.user_data]))
 
-            if len(parts) > 1:
-                namespace = ':'.join(parts[:-1])
-                name = parts[-1]
-            else:
-                namespace = None
-                name = full_name
+        # Rescan the attributes, shapes given one outside of mtoatools
+        # are only seen by a rescan
+        for attr_name in attrs:
+            MatteIndex.forget(attr_name)
+
+        def remove(modifier):
+            for attr_name in attrs:
+                bulk.remove_attrs(
+                    modifier,
+                    MatteIndex.mobjects(attr_name),
+                    attr_name
+                )
+            bulk.delete_nodes(modifier, nodes)
+
+        with bulk.transaction() as tx:
+            for matte in packed:
+                matte._release(tx)
+            tx.apply(remove)
+            if packed:
+                delete_empty_physicals()
+
+        for attr_name in attrs:
+            MatteIndex.forget(attr_name)
+        for matte, name in zip(mattes, names):
+            Journal.record('delete', matte, name=name)
+
+    @classmethod
+    def clear_all(cls):
+        '''Delete every matte in the scene in one undo step'''
 
-            data['shapes'].append({
-                'name': name,
-                'namespace': namespace,
-                'color': tuple(obj.attr(self.mesh_attr_name).get())
-            })
+        cls.delete_many(cls.ls())
 
+    def data(self):
+        '''Simple dict representation of matte aov for use with serialization
+        '''
+
+        data = {'name': self.name, 'shapes': self.columns().data()}
+        default_color = self.default_color
+        if any(default_color):
+            data['default_color'] = list(default_color)
         return data
 
     def yaml(self):
@@ -230,21 +766,876 @@ class MatteAOV(object):
         if isinstance(data, basestring):
             data = yaml.load(data)
 
+        if data.get('packed'):
+            return PackedMatte.load(data, ignore_namespaces)
+        if data.get('backend') == 'operator' and cls is MatteAOV:
+            return OperatorMatte.load(data, ignore_namespaces)
+
         matte_name = 'aiAOV_' + data['name']
         if not pmc.objExists(matte_name):
-            aov = cls.create(data['name'])
+            aov = cls.create(data['name'], nodes=())
         else:
-            pyaov = pmc.PyNode(matte_name)
-            pyuserdata = pmc.PyNode(data['name'] + '_color')
-            aov = cls(pyaov, pyuserdata)
+            aov = cls(matte_name, data['name'] + '_color')
+
+        aov.load_shapes(data['shapes'], ignore_namespaces)
+        if 'default_color' in data:
+            aov.set_default_color(data['default_color'])
+        return aov
+
+    def load_shapes(self, shapes, ignore_namespaces=False):
+        '''Apply serialized shape colors to the matching scene shapes'''
+
+        MatteIndex.forget(self.mesh_attr_name)
+        by_name, by_short_name = get_shape_index()
 
-        for shape in data['shapes']:
+        groups = defaultdict(list)
+        for shape in shapes:
             if ignore_namespaces or not shape['namespace']:
-                name = shape['name']
-                matches = pmc.ls(name, r=True)
+                matches = by_short_name.get(shape['name'], [])
             else:
                 name = shape['namespace'] + ':' + shape['name']
-                matches = pmc.ls(name)
-            aov.set_objects_color(shape['color'], *matches)
+                matches = by_name.get(name, [])
+            groups[tuple(shape['color'])].extend(matches)
+
+        for color, matches in groups.iteritems():
+            if matches:
+                self.set_objects_color(color, *matches)
+
+
+def get_shape_mattes(*nodes):
+    '''Reverse lookup of the mattes shapes belong to. Each shape's matte
+    attributes are read in a single pass instead of querying every matte,
+    the members of operator mattes are read once from their operators.
+
+    :param nodes: Shapes or transforms, defaults to every shape in a matte
+    :returns: dict mapping long shape names to lists of (matte, color)
+    '''
+
+    by_attr = defaultdict(list)
+    operators = []
+    for matte in MatteAOV.ls():
+        if isinstance(matte, OperatorMatte):
+            colors = {}
+            for color, members in matte._groups().iteritems():
+                colors.update(dict.fromkeys(members, color))
+            operators.append((matte, colors))
+        else:
+            by_attr[matte.mesh_attr_name].append(matte)
+
+    if nodes:
+        shapes = bulk.get_shapes(nodes)
+    else:
+        shapes = {}
+        for attr_name in by_attr:
+            for mobject in MatteIndex.mobjects(attr_name):
+                shapes[NodeHandle(mobject)] = mobject
+        for matte, colors in operators:
+            for mobject in get_mobjects(sorted(colors)):
+                shapes[NodeHandle(mobject)] = mobject
+        shapes = shapes.values()
+
+    result = {}
+    fn = om.MFnDependencyNode()
+    for shape in shapes:
+        fn.setObject(shape)
+        mattes = []
+        for attr_name, attr_mattes in by_attr.iteritems():
+            if not fn.hasAttribute(attr_name):
+                continue
+            plug = fn.findPlug(attr_name, False)
+            color = tuple(plug.child(i).asFloat() for i in xrange(3))
+            for matte in attr_mattes:
+                if isinstance(matte, PackedMatte):
+                    value = color[matte.channel]
+                    if value:
+                        mattes.append((matte, (value, value, value)))
+                else:
+                    mattes.append((matte, color))
+        name = get_node_name(shape)
+        for matte, colors in operators:
+            if name in colors:
+                mattes.append((matte, colors[name]))
+        if mattes:
+            result[name] = mattes
+    return result
+
+
+def ls_physical():
+    '''List the physical aovs holding packed mattes'''
+
+    return [
+        aov for aov in MatteAOV.ls_all() if aov.aov.hasAttr('is_packed_matte')
+    ]
+
+
+def get_packing_layout(physicals=None):
+    '''Get a dict mapping physical aov names to their channel slots'''
+
+    layout = {}
+    for aov in physicals or ls_physical():
+        layout[aov.name] = [
+            get_string(aov.aov.object(), 'matte_' + c) or None
+            for c in CHANNELS
+        ]
+    return layout
+
+
+def create_physical(name):
+    '''Create a physical aov with three free channels for packed mattes'''
+
+    aov = MatteAOV._create_nodes(MatteAOV.get_unused_name(name))
+    aov.aov.addAttr('is_packed_matte', at='bool', dv=1)
+    for c in CHANNELS:
+        aov.aov.addAttr('matte_' + c, dt='string')
+    aov.user_data.defaultValue.set(0, 0, 0)
+    return aov
+
+
+class PackedMatte(MatteAOV):
+    '''Logical matte stored in a single channel of a shared physical
+    MatteAOV. Shapes are members when their channel value is non zero.
+    '''
+
+    __slots__ = ('physical', 'channel')
+
+    def __init__(self, physical, channel):
+        super(PackedMatte, self).__init__(physical.aov, physical.user_data)
+        self.physical = physical
+        self.channel = channel
+
+    def __repr__(self):
+        return '<PackedMatte>({}, {})'.format(
+            str(self.aov),
+            CHANNELS[self.channel]
+        )
+
+    def __iter__(self):
+        for node, color in MatteIndex.items(self.mesh_attr_name):
+            value = color[self.channel]
+            if value:
+                yield node, (value, value, value)
+
+    @classmethod
+    def from_physical(cls, physical):
+        '''List the logical mattes packed in a physical aov'''
+
+        mattes = []
+        for channel, c in enumerate(CHANNELS):
+            if get_string(physical.aov.object(), 'matte_' + c):
+                mattes.append(cls(physical, channel))
+        return mattes
+
+    @classmethod
+    def create(cls, name, physical=None, channel=None, nodes=None):
+        '''Create a logical matte in the first free channel of the fullest
+        physical aov, or in a new physical aov when all channels are taken.
+
+        :param physical: Preferred physical aov name
+        :param channel: Preferred channel index
+        :param nodes: Nodes added to the matte, defaults to the selected
+            transforms
+        '''
+
+        name = cls.get_unused_name(name)
+        if nodes is None:
+            nodes = pmc.selected(type='transform')
+
+        physicals = dict((aov.name, aov) for aov in ls_physical())
+        packer = ChannelPacker(get_packing_layout(physicals.values()))
+        physical, channel = packer.assign(name, physical, channel)
+        if physical not in physicals:
+            physicals[physical] = create_physical(physical)
 
+        physical = physicals[physical]
+        physical.aov.attr('matte_' + CHANNELS[channel]).set(name)
+
+        matte = cls(physical, channel)
+        Journal.record('create', matte)
+        matte.set_objects_color((1, 1, 1), *nodes)
+        return matte
+
+    @staticmethod
+    def get_unused_name(name):
+        used = set()
+        for slots in get_packing_layout().values():
+            used.update(slots)
+
+        base = name
+        i = 0
+        while name in used or pmc.objExists('aiAOV_' + name):
+            i += 1
+            name = base + str(i)
+        return name
+
+    @property
+    def slot_attr_name(self):
+        return 'matte_' + CHANNELS[self.channel]
+
+    @property
+    def slot_attr(self):
+        return self.aov.attr(self.slot_attr_name)
+
+    @property
+    def name(self):
+        return get_string(self.aov.object(), self.slot_attr_name)
+
+    @property
+    def rules_attr_name(self):
+        return 'matte_rules_' + CHANNELS[self.channel]
+
+    def rename(self, name):
+        old_name = self.name
+        name = self.get_unused_name(name)
+        with bulk.transaction() as tx:
+            tx.apply(
+                bulk.set_string,
+                get_mobject(self.aov),
+                self.slot_attr_name,
+                name
+            )
+        Journal.record('rename', self, name=name, old_name=old_name)
+
+    def get_color(self, node):
+        color = get_attr_color(get_mobject(node), self.mesh_attr_name)
+        value = color[self.channel]
+        return value, value, value
+
+    @property
+    def id_mode(self):
+        return None
+
+    def set_id_mode(self, mode, levels=ID_LEVELS):
+        raise TypeError('Packed mattes store a single channel per shape and '
+                        'can not hold ID colors')
+
+    def get_objects(self):
+        return [node for node, color in self]
+
+    def columns(self):
+        return MatteIndex.columns(self.mesh_attr_name).channel(self.channel)
+
+    def has_member(self, mobject):
+        color = MatteIndex.color(self.mesh_attr_name, mobject)
+        return bool(color and color[self.channel])
+
+    def _members(self, shapes):
+        members = []
+        fn = om.MFnDependencyNode()
+        for shape in shapes:
+            fn.setObject(shape)
+            if not fn.hasAttribute(self.mesh_attr_name):
+                continue
+            plug = fn.findPlug(self.mesh_attr_name, False)
+            if plug.child(self.channel).asFloat():
+                members.append(shape)
+        return members
+
+    def _set_channel(self, value, shapes):
+        shapes = [
+            shape for shape in shapes
+            if abs(self._channel_value(shape) - value) > 1e-6
+        ]
+        if not shapes:
+            return
+
+        # Shapes with an empty channel become members when it is set
+        added = []
+        members = []
+        for shape in shapes:
+            if self._channel_value(shape):
+                members.append(NodeHandle(shape))
+            else:
+                added.append(NodeHandle(shape))
+
+        with bulk.transaction() as tx:
+            tx.apply(
+                bulk.set_channel,
+                shapes,
+                self.mesh_attr_name,
+                self.channel,
+                value
+            )
+        MatteIndex.update(self.mesh_attr_name, *shapes)
+        if added:
+            Journal.record('add', self, added, (value, value, value))
+        if members:
+            Journal.record('color', self, members, (value, value, value))
+
+    def _channel_value(self, shape):
+        color = MatteIndex.color(self.mesh_attr_name, shape)
+        return color[self.channel] if color else 0
+
+    def add(self, *nodes):
+        shapes = bulk.get_shapes(nodes)
+        members = set(NodeHandle(m) for m in self._members(shapes))
+        added = [
+            shape for shape in shapes if NodeHandle(shape) not in members
+        ]
+        if added:
+            self._set_channel(1, added)
+        return [NodeHandle(shape) for shape in added]
+
+    def discard(self, *nodes):
+        shapes = bulk.get_shapes(nodes, self.mesh_attr_name)
+        with bulk.transaction() as tx:
+            removed = tx.apply(
+                bulk.clear_channel,
+                shapes,
+                self.mesh_attr_name,
+                self.channel
+            )
+        MatteIndex.update(self.mesh_attr_name, *removed)
+        removed = [NodeHandle(shape) for shape in removed]
+        if removed:
+            Journal.record('discard', self, removed)
+        return removed
+
+    @property
+    def default_color(self):
+        value = get_attr_color(self.user_data.object(), 'defaultValue')
+        return (value[self.channel],) * 3
+
+    def set_default_color(self, rgb):
+        values = [None] * 3
+        values[self.channel] = max(rgb)
+        with bulk.transaction() as tx:
+            tx.apply(self._set_default, self.user_data.object(), values)
+
+    def set_all_objects_color(self, rgb):
+        self.set_objects_color(rgb, *self.get_objects())
+
+    def set_objects_color(self, rgb, *nodes):
+        value = max(rgb)
+        if not value:
+            return self.discard(*nodes)
+        self._set_channel(value, bulk.get_shapes(nodes))
+
+    def delete(self):
+        name = self.name
+        with bulk.transaction() as tx:
+            self._release(tx)
+            delete_empty_physicals()
+        Journal.record('delete', self, name=name)
+
+    def _release(self, tx):
+        '''Clear this matte's channel and free its slot'''
+
+        shapes = MatteIndex.mobjects(self.mesh_attr_name)
+        removed = tx.apply(
+            bulk.clear_channel,
+            shapes,
+            self.mesh_attr_name,
+            self.channel
+        )
+        MatteIndex.update(self.mesh_attr_name, *removed)
+        tx.apply(
+            bulk.set_string,
+            self.aov.object(),
+            self.slot_attr_name,
+            ''
+        )
+
+    def data(self):
+        data = super(PackedMatte, self).data()
+        data['packed'] = {
+            'aov': self.physical.name,
+            'channel': CHANNELS[self.channel],
+        }
+        return data
+
+    @classmethod
+    def load(cls, data, ignore_namespaces=False):
+        '''Deserialize a PackedMatte, restoring its physical aov and channel
+        when they are free.
+        '''
+
+        if isinstance(data, basestring):
+            data = yaml.load(data)
+
+        for matte in MatteAOV.ls():
+            if isinstance(matte, cls) and matte.name == data['name']:
+                break
+        else:
+            packed = data.get('packed') or {}
+            channel = packed.get('channel')
+            if channel is not None:
+                channel = CHANNELS.index(channel)
+            matte = cls.create(
+                data['name'],
+                packed.get('aov'),
+                channel,
+                nodes=()
+            )
+
+        matte.load_shapes(data['shapes'], ignore_namespaces)
+        if 'default_color' in data:
+            matte.set_default_color(data['default_color'])
+        return matte
+
+
+def delete_empty_physicals():
+    '''Delete the physical aovs left without packed mattes. Freed channels
+    of other physical aovs stay free until the next PackedMatte.create.
+    '''
+
+    for aov in ls_physical():
+        if not any(get_packing_layout([aov])[aov.name]):
+            aov.delete()
+
+
+def repack():
+    '''Compact packed mattes into as few physical aovs as possible. Channel
+    values are moved between physical aovs and empty physical aovs deleted.
+
+    Packed mattes change aov and channel, so comp setups reading them break.
+    Mattes are never repacked implicitly, call this explicitly.
+    '''
+
+    physicals = dict((aov.name, aov) for aov in ls_physical())
+    packer = ChannelPacker(get_packing_layout(physicals.values()))
+    moves, empty = packer.repack()
+
+    with bulk.transaction() as tx:
+        for name, (src, src_channel), (dst, dst_channel) in moves:
+            src, dst = physicals[src], physicals[dst]
+            shapes = MatteIndex.mobjects(src.mesh_attr_name)
+
+            tx.apply(
+                bulk.copy_channel,
+                shapes,
+                src.mesh_attr_name,
+                src_channel,
+                dst.mesh_attr_name,
+                dst_channel
+            )
+            tx.apply(
+                bulk.clear_channel,
+                shapes,
+                src.mesh_attr_name,
+                src_channel
+            )
+            tx.apply(
+                bulk.set_string,
+                get_mobject(dst.aov),
+                'matte_' + CHANNELS[dst_channel],
+                name
+            )
+            tx.apply(
+                bulk.set_string,
+                get_mobject(src.aov),
+                'matte_' + CHANNELS[src_channel],
+                ''
+            )
+            MatteIndex.update(src.mesh_attr_name, *shapes)
+            MatteIndex.update(dst.mesh_attr_name, *shapes)
+
+        for name in empty:
+            physicals[name].delete()
+
+
+def arnold_name(shape):
+    '''Arnold node name of a shape, its full dag path with / separators'''
+
+    return shape.replace('|', '/')
+
+
+def maya_name(node):
+    '''Long Maya name of an Arnold shape node name'''
+
+    return node.replace('/', '|')
+
+
+def get_root_operator():
+    '''Get the aiMerge operator all operator mattes feed into. It is created
+    and connected to the render options on first use, keeping any operator
+    already connected there as its first input.
+    '''
+
+    if cmds.objExists('mtoatools_mattes'):
+        return 'mtoatools_mattes'
+
+    root = cmds.createNode('aiMerge', name='mtoatools_mattes')
+    operator = 'defaultArnoldRenderOptions.operator'
+    inputs = cmds.listConnections(operator, source=True, plugs=True)
+    if inputs:
+        cmds.connectAttr(inputs[0], root + '.inputs[0]')
+    cmds.connectAttr(root + '.out', operator, force=True)
+    return root
+
+
+class OperatorMatte(MatteAOV):
+    '''Matte AOV without per-shape attributes. Membership is stored as
+    Arnold selection expressions on aiSetParameter operators, one per color,
+    merged by a single aiMerge operator per matte. mtoa applies them at
+    translation time, so referenced shapes get no reference edits.
+
+    Each operator also stores the uuids of its shapes, the OperatorSync
+    rewrites the selection expressions when shapes are renamed or
+    reparented.
+    '''
+
+    __slots__ = ()
+
+    def __init__(self, aov, user_data):
+        super(OperatorMatte, self).__init__(aov, user_data)
+        OperatorSync.install()
+
+    def __repr__(self):
+        return '<OperatorMatte>({}, {})'.format(
+            str(self.aov),
+            str(self.user_data)
+        )
+
+    def __iter__(self):
+        for color, (node, shapes) in sorted(self._read().items()):
+            shapes = sorted(cmds.ls(list(shapes), long=True) or [])
+            for mobject in get_mobjects(shapes):
+                yield NodeHandle(mobject), color
+
+    @classmethod
+    def create(cls, name, nodes=None):
+        name = cls.get_unused_name(name)
+        if nodes is None:
+            nodes = pmc.selected(type='transform')
+
+        aov = cls._create_nodes(name)
+        merge = pmc.createNode('aiMerge', name=name + '_operator')
+        aov.aov.addAttr('matte_operator', at='message')
+        merge.message.connect(aov.aov.matte_operator)
+
+        root = pmc.PyNode(get_root_operator())
+        index = bulk.next_index(bulk.get_plug(str(root) + '.inputs'))
+        merge.out.connect(root.inputs[index])
+
+        Journal.record('create', aov)
+        aov.set_objects_color((1, 1, 1), *nodes)
         return aov
+
+    @property
+    def operator(self):
+        return NodeHandle(get_source(self.aov.object(), 'matte_operator'))
+
+    def _read(self):
+        '''Read membership from the operators
+
+        :returns: dict mapping colors to (operator, set of long shape names)
+        '''
+
+        groups = {}
+        merge = str(self.operator)
+        nodes = cmds.listConnections(
+            merge + '.inputs',
+            source=True,
+            destination=False,
+            type='aiSetParameter'
+        ) or []
+        for node in nodes:
+            assignment = cmds.getAttr(node + '.assignment[1]') or ''
+            values = assignment.partition('=')[-1].split()
+            if len(values) != 3:
+                continue
+            color = quantize([float(v) for v in values])
+            if cmds.attributeQuery('matte_shapes', node=node, exists=True):
+                uuids = (cmds.getAttr(node + '.matte_shapes') or '').split()
+                shapes = set()
+                if uuids:
+                    shapes.update(cmds.ls(uuids, long=True) or [])
+            else:
+                selection = cmds.getAttr(node + '.selection') or ''
+                shapes = set(
+                    maya_name(s) for s in selection.split(' or ') if s
+                )
+            groups[color] = (node, shapes)
+        return groups
+
+    def _write(self, groups):
+        '''Write membership back to the operators in one transaction. One
+        aiSetParameter per color is kept, emptied ones are deleted.
+
+        :param groups: dict mapping colors to sets of long shape names
+        '''
+
+        current = self._read()
+        merge = get_mobject(self.operator)
+        inputs = om.MFnDependencyNode(merge).findPlug('inputs', False)
+        attr_name = self.color_attr_name
+
+        with bulk.transaction() as tx:
+            for color, (node, shapes) in current.iteritems():
+                if not groups.get(color):
+                    tx.apply(bulk.delete_nodes, [get_mobject(node)])
+
+            for color, shapes in groups.iteritems():
+                if not shapes:
+                    continue
+                if color in current:
+                    node = get_mobject(current[color][0])
+                else:
+                    node = tx.apply(self._create_operator, attr_name)
+                    tx.apply(
+                        self._connect_operator,
+                        node,
+                        inputs.elementByLogicalIndex(bulk.next_index(inputs))
+                    )
+                if not om.MFnDependencyNode(node).hasAttribute('matte_shapes'):
+                    tx.apply(bulk.add_string_attr, node, 'matte_shapes')
+                tx.apply(
+                    self._set_operator,
+                    node,
+                    attr_name,
+                    color,
+                    shapes
+                )
+
+    @staticmethod
+    def _create_operator(modifier, attr_name):
+        node = modifier.createNode('aiSetParameter')
+        modifier.renameNode(node, attr_name + '_setParameter')
+        return node
+
+    @staticmethod
+    def _connect_operator(modifier, node, plug):
+        out = om.MFnDependencyNode(node).findPlug('out', False)
+        modifier.connect(out, plug)
+
+    @staticmethod
+    def _selection(shapes):
+        return ' or '.join(arnold_name(s) for s in sorted(shapes))
+
+    @classmethod
+    def _set_operator(cls, modifier, node, attr_name, color, shapes):
+        fn = om.MFnDependencyNode(node)
+        selection = cls._selection(shapes)
+        uuids = ' '.join(sorted(cmds.ls(list(shapes), uuid=True) or []))
+        modifier.newPlugValueString(fn.findPlug('matte_shapes', False), uuids)
+        assignments = [
+            'declare {} constant RGB'.format(attr_name),
+            '{} = {} {} {}'.format(attr_name, *color),
+        ]
+        modifier.newPlugValueString(fn.findPlug('selection', False), selection)
+        assignment = fn.findPlug('assignment', False)
+        enable = fn.findPlug('enableAssignment', False)
+        for i, value in enumerate(assignments):
+            modifier.newPlugValueString(
+                assignment.elementByLogicalIndex(i),
+                value
+            )
+            modifier.newPlugValueBool(enable.elementByLogicalIndex(i), True)
+
+    def _groups(self):
+        return dict(
+            (color, set(shapes))
+            for color, (node, shapes) in self._read().iteritems()
+        )
+
+    def has_member(self, mobject):
+        name = get_node_name(mobject)
+        return any(name in shapes for shapes in self._groups().values())
+
+    def sync(self):
+        '''Rewrite the selection expressions of shapes renamed or reparented
+        since they were added. The selections follow the stored uuids, so
+        the edit is made outside the undo queue and redone by undoing the
+        rename.
+        '''
+
+        modifier = om.MDGModifier()
+        changed = False
+        for color, (node, shapes) in self._read().iteritems():
+            selection = self._selection(shapes)
+            if selection != (cmds.getAttr(node + '.selection') or ''):
+                plug = om.MFnDependencyNode(get_mobject(node)).findPlug(
+                    'selection',
+                    False
+                )
+                modifier.newPlugValueString(plug, selection)
+                changed = True
+        if changed:
+            modifier.doIt()
+        return changed
+
+    @staticmethod
+    def _long_names(nodes):
+        return set(get_node_name(s) for s in bulk.get_shapes(nodes))
+
+    @staticmethod
+    def _handles(shapes):
+        shapes = sorted(cmds.ls(list(shapes), long=True) or [])
+        return [NodeHandle(m) for m in get_mobjects(shapes)]
+
+    def columns(self):
+        return MatteColumns.from_items(list(self))
+
+    def revision(self):
+        '''Membership is stored on the operators, any shape rename or delete
+        in the scene changes the revision.
+        '''
+
+        groups = sorted(
+            (color, sorted(shapes))
+            for color, shapes in self._groups().iteritems()
+        )
+        return self.name, groups, MatteIndex.dag_version, self.default_color
+
+    def get_color(self, node):
+        shape = get_node_name(get_mobject(node))
+        for color, shapes in self._groups().iteritems():
+            if shape in shapes:
+                return color
+
+    def get_objects(self):
+        return [node for node, color in self]
+
+    def add(self, *nodes):
+        groups = self._groups()
+        members = set().union(*groups.values()) if groups else set()
+        added = self._long_names(nodes) - members
+        if not added:
+            return []
+        groups.setdefault((0, 0, 0), set()).update(added)
+        self._write(groups)
+        added = self._handles(added)
+        Journal.record('add', self, added)
+        return added
+
+    def discard(self, *nodes):
+        groups = self._groups()
+        shapes = self._long_names(nodes)
+        removed = set()
+        for members in groups.itervalues():
+            removed.update(members & shapes)
+            members -= shapes
+        if not removed:
+            return []
+        self._write(groups)
+        removed = self._handles(removed)
+        Journal.record('discard', self, removed)
+        return removed
+
+    def set_all_objects_color(self, rgb):
+        groups = self._groups()
+        members = set().union(*groups.values()) if groups else set()
+        self._write({quantize(rgb): members})
+        Journal.record('color', self, self._handles(members), rgb)
+
+    def set_objects_color(self, rgb, *nodes):
+        groups = self._groups()
+        shapes = self._long_names(nodes)
+        added = set(shapes)
+        for members in groups.itervalues():
+            added -= members
+            members -= shapes
+        groups.setdefault(quantize(rgb), set()).update(shapes)
+        self._write(groups)
+        if added:
+            Journal.record('add', self, self._handles(added), rgb)
+        if shapes - added:
+            Journal.record('color', self, self._handles(shapes - added), rgb)
+
+    def _set_color(self, rgb, shapes):
+        self.set_objects_color(rgb, *shapes)
+
+    def rename(self, name):
+        old_name = self.name
+        groups = self._groups()
+        name = self.get_unused_name(name)
+        aov, user_data = get_mobjects([self.aov, self.user_data])
+        operator = get_mobject(self.operator)
+
+        with bulk.transaction() as tx:
+            tx.apply(self._rename_nodes, aov, user_data, name)
+            tx.apply(self._rename_operator, operator, name)
+            self._write(groups)
+        Journal.record('rename', self, name=name, old_name=old_name)
+
+    @staticmethod
+    def _rename_operator(modifier, operator, name):
+        modifier.renameNode(operator, name + '_operator')
+
+    def _nodes(self):
+        '''Operators, aov and user data nodes of this matte'''
+
+        nodes = [get_mobject(n) for n, s in self._read().itervalues()]
+        nodes.extend(get_mobjects([self.operator, self.aov, self.user_data]))
+        return nodes
+
+    def delete(self):
+        name = self.name
+        with bulk.transaction() as tx:
+            tx.apply(bulk.delete_nodes, self._nodes())
+        Journal.record('delete', self, name=name)
+
+    def data(self):
+        data = super(OperatorMatte, self).data()
+        data['backend'] = 'operator'
+        return data
+
+    @classmethod
+    def load(cls, data, ignore_namespaces=False):
+        '''Deserialize an OperatorMatte'''
+
+        if isinstance(data, basestring):
+            data = yaml.load(data)
+
+        for matte in MatteAOV.ls():
+            if isinstance(matte, cls) and matte.name == data['name']:
+                break
+        else:
+            matte = cls.create(data['name'], nodes=())
+
+        matte.load_shapes(data['shapes'], ignore_namespaces)
+        if 'default_color' in data:
+            matte.set_default_color(data['default_color'])
+        return matte
+
+
+class OperatorSync(object):
+    '''Keeps the selection expressions of operator mattes in sync with
+    shape names. Renames and reparents are collected and every operator
+    matte is synced once, in a deferred flush.
+    '''
+
+    def __init__(self):
+        self._scheduled = False
+        self._callbacks = []
+
+    def install(self):
+        if self._callbacks:
+            return
+
+        self._callbacks.append(om.MNodeMessage.addNameChangedCallback(
+            om.MObject.kNullObj,
+            self._on_name_changed
+        ))
+        self._callbacks.append(om.MDagMessage.addChildAddedCallback(
+            self._on_child_added
+        ))
+
+    def uninstall(self):
+        for callback_id in self._callbacks:
+            om.MMessage.removeCallback(callback_id)
+        self._callbacks = []
+
+    def schedule(self):
+        if om.MFileIO.isReadingFile() or self._scheduled:
+            return
+        self._scheduled = True
+        cmds.evalDeferred(self.flush, lowestPriority=True)
+
+    def _on_name_changed(self, mobject, old_name, data):
+        if mobject.hasFn(om.MFn.kDagNode):
+            self.schedule()
+
+    def _on_child_added(self, child, parent, data):
+        self.schedule()
+
+    def flush(self):
+        '''Sync the selection expressions of every operator matte'''
+
+        self._scheduled = False
+        for matte in MatteAOV.ls():
+            if isinstance(matte, OperatorMatte):
+                matte.sync()
+
+
+OperatorSync = OperatorSync()
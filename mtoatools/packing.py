@@ -0,0 +1,129 @@
+'''
+mtoatools.packing
+=================
+Assigns logical mattes to the R, G and B channels of shared physical AOVs.
+Pure python, the Maya side lives in mtoatools.models.PackedMatte.
+'''
+
+CHANNELS = 'RGB'
+
+
+class ChannelPacker(object):
+    '''Greedy packer mapping logical matte names to (physical, channel).
+
+    :param layout: dict mapping physical names to a list of three logical
+        names, None marking a free channel
+    :param new_name: callable returning the name of a new physical aov
+    '''
+
+    def __init__(self, layout=None, new_name=None):
+        self.layout = dict(
+            (physical, list(slots))
+            for physical, slots in (layout or {}).items()
+        )
+        self.new_name = new_name or self._new_name
+
+    def _new_name(self):
+        i = len(self.layout)
+        while True:
+            name = 'packed_matte' + (str(i) if i else '')
+            if name not in self.layout:
+                return name
+            i += 1
+
+    def used(self, physical):
+        return len([s for s in self.layout[physical] if s is not None])
+
+    def find(self, name):
+        '''Get the (physical, channel) a logical matte is packed into'''
+
+        for physical, slots in self.layout.items():
+            if name in slots:
+                return physical, slots.index(name)
+
+    def assign(self, name, physical=None, channel=None):
+        '''Assign a logical matte to a free channel. The fullest physical aov
+        with a free channel is filled first, a new physical aov is only
+        added when every channel is taken.
+
+        :param physical: Preferred physical aov
+        :param channel: Preferred channel index in the physical aov
+        :returns: (physical, channel) tuple
+        '''
+
+        location = self.find(name)
+        if location:
+            return location
+
+        if physical is not None:
+            slots = self.layout.setdefault(physical, [None, None, None])
+            if channel is not None and slots[channel] is None:
+                slots[channel] = name
+                return physical, channel
+
+        candidates = [
+            p for p, slots in self.layout.items() if None in slots
+        ]
+        if candidates:
+            physical = max(candidates, key=lambda p: (self.used(p), p))
+        else:
+            physical = self.new_name()
+            self.layout[physical] = [None, None, None]
+
+        slots = self.layout[physical]
+        channel = slots.index(None)
+        slots[channel] = name
+        return physical, channel
+
+    def release(self, name):
+        '''Free the channel used by a logical matte. Other mattes keep their
+        channels, the free channel is reused by the next assign.
+        '''
+
+        location = self.find(name)
+        if location:
+            physical, channel = location
+            self.layout[physical][channel] = None
+        return location
+
+    def rename(self, name, new_name):
+        physical, channel = self.find(name)
+        self.layout[physical][channel] = new_name
+
+    def repack(self):
+        '''Move logical mattes out of the emptiest physical aovs into free
+        channels of fuller ones, until at most one physical aov is partially
+        filled. Only done on request, moved mattes change channels.
+
+        :returns: (moves, empty) where moves is a list of
+            (name, (src physical, src channel), (dst physical, dst channel))
+            and empty lists the physical aovs left without mattes
+        '''
+
+        moves = []
+        while True:
+            partial = [
+                p for p in self.layout if 0 < self.used(p) < len(CHANNELS)
+            ]
+            if len(partial) < 2:
+                break
+
+            partial.sort(key=lambda p: (self.used(p), p))
+            src, dst = partial[0], partial[-1]
+            src_slots = self.layout[src]
+            dst_slots = self.layout[dst]
+            src_channel = max(
+                i for i, s in enumerate(src_slots) if s is not None
+            )
+            dst_channel = dst_slots.index(None)
+            name = src_slots[src_channel]
+
+            src_slots[src_channel] = None
+            dst_slots[dst_channel] = name
+            moves.append((name, (src, src_channel), (dst, dst_channel)))
+
+        empty = sorted(p for p in self.layout if not self.used(p))
+        for physical in empty:
+            self.layout.pop(physical)
+
+        return moves, empty
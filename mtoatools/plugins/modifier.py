@@ -0,0 +1,63 @@
+import sys
+import maya.api.OpenMaya as om
+
+
+def maya_useNewAPI():
+    pass
+
+
+class MtoatoolsModifier(om.MPxCommand):
+    '''Executes the modifier pending in mtoatools.bulk as a single undoable
+    command. Python api modifiers do not reach Maya's undo queue on their own.
+    '''
+
+    name = 'mtoatoolsModifier'
+
+    def __init__(self):
+        super(MtoatoolsModifier, self).__init__()
+        self.modifier = None
+
+    @classmethod
+    def creator(cls):
+        return cls()
+
+    def doIt(self, args):
+        from mtoatools import bulk
+        self.modifier = bulk.pop_pending()
+        self.modifier.doIt()
+
+    def redoIt(self):
+        from mtoatools.journal import Journal
+        self.modifier.doIt()
+        Journal.record('reset')
+
+    def undoIt(self):
+        from mtoatools.journal import Journal
+        self.modifier.undoIt()
+        Journal.record('reset')
+
+    def isUndoable(self):
+        return True
+
+
+def initializePlugin(obj):
+    plugin = om.MFnPlugin(obj, "Dan Bradham", "1.0", "Any")
+
+    try:
+        plugin.registerCommand(
+            MtoatoolsModifier.name,
+            MtoatoolsModifier.creator
+        )
+    except:
+        sys.stderr.write("Failed to register command\n")
+        raise
+
+
+def uninitializePlugin(obj):
+    plugin = om.MFnPlugin(obj)
+
+    try:
+        plugin.deregisterCommand(MtoatoolsModifier.name)
+    except:
+        sys.stderr.write("Failed to deregister command\n")
+        pass
@@ -0,0 +1,413 @@
+'''
+mtoatools.rules
+===============
+Rule based dynamic matte membership. Rules are stored on the matte aov and
+evaluated incrementally: only shapes touched by node added, child added,
+rename and set or shader connection messages are checked against the rules
+of each matte. The shapes a matte's rules added are stored with the rules,
+so shapes that stop matching are discarded again while shapes the artist
+added by hand are left alone.
+
+The RuleEngine is installed by MatteAOV.set_rules and by install_rules,
+call install_rules after opening a scene that already carries rules.
+'''
+
+import re
+from abc import ABCMeta, abstractmethod
+from fnmatch import fnmatchcase
+from collections import defaultdict
+from maya import cmds
+import maya.api.OpenMaya as om
+from .index import (NodeHandle, get_mobject, get_mobjects, get_node_name,
+                    get_uuid)
+from .bulk import transaction
+from .journal import Journal
+
+__all__ = ['NameRule', 'RegexRule', 'NamespaceRule', 'SetRule',
+           'ShaderRule', 'HierarchyRule', 'RuleEngine', 'install_rules']
+
+
+def short_name(shape):
+    '''Leaf name of a dag path including its namespace'''
+
+    return shape.rpartition('|')[-1]
+
+
+def get_set_shapes(set_name):
+    '''Long names of the shapes in an objectSet, transforms are expanded'''
+
+    members = [m for m in cmds.sets(set_name, q=True) or [] if '.' not in m]
+    if not members:
+        return set()
+    shapes = set(cmds.ls(members, shapes=True, long=True) or [])
+    shapes.update(cmds.listRelatives(
+        members,
+        allDescendents=True,
+        type='shape',
+        fullPath=True
+    ) or [])
+    return shapes
+
+
+class Rule(object):
+    '''Abstract base rule. Subclasses implement match for single shapes and
+    may implement select to query every matching shape at once.
+    '''
+
+    __metaclass__ = ABCMeta
+
+    kind = None
+
+    def __init__(self, value, color=(1, 1, 1)):
+        self.value = value
+        self.color = tuple(color)
+
+    def __repr__(self):
+        return '<{}>({!r}, {})'.format(
+            self.__class__.__name__,
+            self.value,
+            self.color
+        )
+
+    def __eq__(self, other):
+        return (isinstance(other, Rule)
+                and self.kind == other.kind
+                and self.value == other.value)
+
+    def __ne__(self, other):
+        return not self == other
+
+    @abstractmethod
+    def match(self, shape):
+        '''Does the shape at a long dag path match this rule?'''
+
+    def select(self):
+        shapes = cmds.ls(type='shape', long=True) or []
+        return self.filter(shapes)
+
+    def filter(self, shapes):
+        return set(s for s in shapes if self.match(s))
+
+    def data(self):
+        return {'kind': self.kind, 'value': self.value, 'color': self.color}
+
+    @staticmethod
+    def from_data(data):
+        rule_type = RULE_TYPES[data['kind']]
+        return rule_type(data['value'], data.get('color', (1, 1, 1)))
+
+
+class NameRule(Rule):
+    '''Matches shape names against a glob pattern, namespaces included'''
+
+    kind = 'name'
+
+    def match(self, shape):
+        return fnmatchcase(short_name(shape), self.value)
+
+
+class RegexRule(Rule):
+    '''Matches shape names against a regular expression'''
+
+    kind = 'regex'
+
+    def __init__(self, value, color=(1, 1, 1)):
+        super(RegexRule, self).__init__(value, color)
+        self.pattern = re.compile(value)
+
+    def match(self, shape):
+        return bool(self.pattern.search(short_name(shape)))
+
+
+class NamespaceRule(Rule):
+    '''Matches shapes in a namespace, glob patterns are allowed'''
+
+    kind = 'namespace'
+
+    def match(self, shape):
+        namespace = short_name(shape).rpartition(':')[0]
+        return fnmatchcase(namespace, self.value.strip(':'))
+
+
+class SetRule(Rule):
+    '''Matches shapes that are members of an objectSet'''
+
+    kind = 'set'
+
+    def match(self, shape):
+        if not cmds.objExists(self.value):
+            return False
+        return shape in get_set_shapes(self.value)
+
+    def select(self):
+        if not cmds.objExists(self.value):
+            return set()
+        return get_set_shapes(self.value)
+
+    def filter(self, shapes):
+        return self.select() & set(shapes)
+
+
+class ShaderRule(Rule):
+    '''Matches shapes assigned to a shader or shadingEngine'''
+
+    kind = 'shader'
+
+    def shading_engines(self):
+        if not cmds.objExists(self.value):
+            return []
+        if cmds.nodeType(self.value) == 'shadingEngine':
+            return [self.value]
+        return cmds.listConnections(
+            self.value,
+            destination=True,
+            source=False,
+            type='shadingEngine'
+        ) or []
+
+    def match(self, shape):
+        engines = cmds.listConnections(
+            shape,
+            destination=True,
+            source=False,
+            type='shadingEngine'
+        ) or []
+        return bool(set(engines) & set(self.shading_engines()))
+
+    def select(self):
+        shapes = set()
+        for engine in set(self.shading_engines()):
+            shapes.update(get_set_shapes(engine))
+        return shapes
+
+    def filter(self, shapes):
+        return self.select() & set(shapes)
+
+
+class HierarchyRule(Rule):
+    '''Matches every shape below a transform or group, instances included.
+    The root is stored by uuid so the rule survives renaming and reparenting
+    it, dag paths stored by older versions are still resolved.
+    '''
+
+    kind = 'hierarchy'
+
+    @classmethod
+    def from_node(cls, node, color=(1, 1, 1)):
+        '''Rule matching the hierarchy below a transform'''
+
+        uuids = cmds.ls(get_node_name(get_mobject(node)), uuid=True)
+        return cls(uuids[0], color)
+
+    def root(self):
+        roots = cmds.ls(self.value, long=True) or []
+        return roots[0] if roots else None
+
+    def match(self, shape):
+        return bool(self.filter([shape]))
+
+    def select(self):
+        root = self.root()
+        if root is None:
+            return set()
+        return set(cmds.listRelatives(
+            root,
+            allDescendents=True,
+            type='shape',
+            noIntermediate=True,
+            fullPath=True
+        ) or [])
+
+    def filter(self, shapes):
+        root = self.root()
+        if root is None:
+            return set()
+        prefix = root + '|'
+        paths = cmds.ls(list(shapes), long=True, allPaths=True) or []
+        return set(
+            get_node_name(get_mobject(path))
+            for path in paths if path.startswith(prefix)
+        )
+
+
+RULE_TYPES = dict(
+    (rule_type.kind, rule_type)
+    for rule_type in (NameRule, RegexRule, NamespaceRule, SetRule, ShaderRule,
+                      HierarchyRule)
+)
+
+
+class RuleEngine(object):
+    '''Incrementally evaluates matte rules. Shapes touched by node added,
+    child added and name changed messages or set and shader connections
+    made or broken are collected and checked once, in a deferred flush,
+    against every matte carrying rules. The list of mattes is cached until
+    the Journal records a matte being created, renamed or deleted.
+    '''
+
+    def __init__(self):
+        self._touched = set()
+        self._scheduled = False
+        self._callbacks = []
+        self._mattes = None
+
+    def install(self):
+        if self._callbacks:
+            return
+
+        self._callbacks.append(om.MDGMessage.addNodeAddedCallback(
+            self._on_node_added,
+            'shape'
+        ))
+        self._callbacks.append(om.MDGMessage.addConnectionCallback(
+            self._on_connection
+        ))
+        self._callbacks.append(om.MDagMessage.addChildAddedCallback(
+            self._on_child_added
+        ))
+        self._callbacks.append(om.MNodeMessage.addNameChangedCallback(
+            om.MObject.kNullObj,
+            self._on_name_changed
+        ))
+        Journal.subscribe(self._on_change)
+
+    def uninstall(self):
+        for callback_id in self._callbacks:
+            om.MMessage.removeCallback(callback_id)
+        Journal.unsubscribe(self._on_change)
+        self._callbacks = []
+        self._touched = set()
+        self._mattes = None
+
+    def _on_change(self, change):
+        if change.kind in ('create', 'rename', 'delete', 'reset'):
+            self._mattes = None
+
+    def touch(self, mobject):
+        '''Queue a shape to be checked on the next flush'''
+
+        self._touched.add(NodeHandle(mobject))
+        if not self._scheduled:
+            self._scheduled = True
+            cmds.evalDeferred(self.flush, lowestPriority=True)
+
+    def _on_node_added(self, mobject, data):
+        if om.MFileIO.isReadingFile():
+            return
+        self.touch(mobject)
+
+    def _on_connection(self, src_plug, dst_plug, made, data):
+        if om.MFileIO.isReadingFile():
+            return
+        if not dst_plug.node().hasFn(om.MFn.kSet):
+            return
+
+        self.touch_hierarchy(src_plug.node())
+
+    def _on_child_added(self, child, parent, data):
+        if om.MFileIO.isReadingFile():
+            return
+        self.touch_hierarchy(child.node())
+
+    def _on_name_changed(self, mobject, old_name, data):
+        if om.MFileIO.isReadingFile():
+            return
+        if mobject.hasFn(om.MFn.kDagNode):
+            self.touch_hierarchy(mobject)
+
+    def touch_hierarchy(self, node):
+        '''Queue a shape, or every shape below a transform'''
+
+        if node.hasFn(om.MFn.kShape):
+            self.touch(node)
+        elif node.hasFn(om.MFn.kTransform):
+            dag_iter = om.MItDag()
+            dag_iter.reset(node, om.MItDag.kDepthFirst, om.MFn.kShape)
+            while not dag_iter.isDone():
+                self.touch(dag_iter.currentItem())
+                dag_iter.next()
+
+    def flush(self):
+        '''Check all touched shapes against the rules of every matte'''
+
+        from .models import MatteAOV
+
+        self._scheduled = False
+        touched, self._touched = self._touched, set()
+        shapes = [
+            handle.long_name for handle in touched if handle.isValid()
+        ]
+        if not shapes:
+            return
+
+        if self._mattes is None:
+            self._mattes = MatteAOV.ls()
+        for matte in self._mattes:
+            if not matte.aov.isValid():
+                self._mattes = None
+                continue
+            rules = matte.rules
+            if rules or matte.rule_uuids:
+                apply_rules(matte, rules, shapes)
+
+
+def install_rules():
+    '''Start evaluating the rules of every matte as the scene changes'''
+
+    RuleEngine.install()
+
+
+def apply_rules(matte, rules, shapes=None, recolor=False):
+    '''Sync a matte with its rules. Shapes matching a rule are added with
+    the rule's color and remembered as added by the rules. Shapes added by
+    the rules that no longer match are discarded. Members the artist added
+    by hand are never recolored or discarded.
+
+    :param shapes: Long shape names to check, defaults to the whole scene
+    :param recolor: Reset the colors of shapes already added by the rules,
+        otherwise only new shapes are colored keeping colors set by hand
+    :returns: set of matching shapes
+    '''
+
+    colors = {}
+    for rule in rules:
+        if shapes is None:
+            result = rule.select()
+        else:
+            result = rule.filter(shapes)
+        for shape in result:
+            colors.setdefault(shape, rule.color)
+
+    owned = matte.rule_uuids
+    if shapes is None:
+        shapes = set(colors) | matte.rule_shapes
+    shapes = list(shapes)
+
+    by_color = defaultdict(list)
+    stale = []
+    keep = set(owned)
+    for shape, mobject in zip(shapes, get_mobjects(shapes)):
+        uuid = get_uuid(mobject)
+        color = colors.get(shape)
+        if color is None:
+            if uuid in owned:
+                stale.append(shape)
+                keep.discard(uuid)
+        elif not matte.has_member(mobject):
+            by_color[color].append(shape)
+            keep.add(uuid)
+        elif recolor and uuid in owned:
+            by_color[color].append(shape)
+
+    with transaction():
+        for color, nodes in by_color.iteritems():
+            matte.set_objects_color(color, *nodes)
+        if stale:
+            matte.discard(*stale)
+        if keep != owned:
+            matte.set_rule_uuids(keep)
+
+    return set(colors)
+
+
+RuleEngine = RuleEngine()
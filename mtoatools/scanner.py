@@ -0,0 +1,340 @@
+'''
+mtoatools.scanner
+=================
+Namespace partitioned scanning of matte attributes. Shapes carrying a matte
+attribute are listed one namespace at a time. Results of referenced
+namespaces are cached on disk, keyed by the reference file path, its
+modification time and the matte edits made to the reference, so a rescan
+only pays for the namespaces that changed.
+
+Listing the matte edits of a reference is slow, so the edits signature of
+each reference is kept for the session. It is recomputed after a matte
+attribute of a referenced node changed or the scene changed, both seen by
+the MatteIndex. All matte attributes should be scanned in a single call.
+The cache is written to disk on idle, never while scanning, to a temporary
+file renamed into place. Entries unused for CACHE_MAX_AGE seconds are
+dropped, and only the CACHE_MAX_ENTRIES most recently used are kept.
+'''
+
+import os
+import sys
+import json
+import time
+import hashlib
+import tempfile
+from maya import cmds
+import maya.api.OpenMaya as om
+from .index import ATTR_PREFIX, get_color, get_node_name
+
+__all__ = ['Scanner']
+
+
+CACHE_VERSION = 2
+CACHE_MAX_AGE = 30 * 24 * 60 * 60
+CACHE_MAX_ENTRIES = 512
+
+
+def get_cache_path():
+    '''Path of the scan cache, set MTOATOOLS_SCAN_CACHE to override'''
+
+    path = os.environ.get('MTOATOOLS_SCAN_CACHE')
+    if not path:
+        path = os.path.join(
+            cmds.internalVar(userAppDir=True),
+            'mtoatools',
+            'scan_cache.json'
+        )
+    return path
+
+
+def list_namespaces():
+    '''All namespaces of the scene, the root namespace as ""'''
+
+    namespaces = cmds.namespaceInfo(
+        ':',
+        listOnlyNamespaces=True,
+        recurse=True
+    ) or []
+    return [''] + [ns for ns in namespaces if ns not in ('UI', 'shared')]
+
+
+def get_references():
+    '''Map the namespaces of loaded references to (reference node, path)'''
+
+    references = {}
+    for node in cmds.ls(type='reference') or []:
+        try:
+            if not cmds.referenceQuery(node, isLoaded=True):
+                continue
+            path = cmds.referenceQuery(
+                node,
+                filename=True,
+                withoutCopyNumber=True
+            )
+            namespace = cmds.referenceQuery(node, namespace=True)
+        except RuntimeError:
+            continue
+        references[namespace.lstrip(':')] = (node, path)
+    return references
+
+
+def get_edits_signature(reference):
+    '''Hash of the matte attribute edits made to a reference'''
+
+    edits = cmds.referenceQuery(reference, editStrings=True) or []
+    edits = sorted(edit for edit in edits if ATTR_PREFIX in edit)
+    return hashlib.md5('\n'.join(edits).encode('utf-8')).hexdigest()
+
+
+def prune_cache(cache, now=None):
+    '''Drop the entries of a cache unused for CACHE_MAX_AGE seconds and all
+    but the CACHE_MAX_ENTRIES most recently used.
+    '''
+
+    if now is None:
+        now = time.time()
+    keys = sorted(cache, key=lambda key: cache[key]['used'], reverse=True)
+    for i, key in enumerate(keys):
+        if i >= CACHE_MAX_ENTRIES or now - cache[key]['used'] > CACHE_MAX_AGE:
+            del cache[key]
+
+
+def write_json(data, path):
+    '''Write json to a temporary file renamed into place, so readers never
+    see a partial file.
+    '''
+
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        if sys.platform == 'win32' and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def relative_name(long_name, namespace):
+    '''Trailing dag path components of long_name inside namespace, with the
+    namespace stripped.
+    '''
+
+    parts = []
+    for part in reversed(long_name.split('|')):
+        part_namespace, _, name = part.rpartition(':')
+        if not part or part_namespace != namespace:
+            break
+        parts.insert(0, name)
+    return '|'.join(parts)
+
+
+def absolute_name(name, namespace):
+    '''Inverse of relative_name, a partial dag path'''
+
+    return '|'.join(namespace + ':' + part for part in name.split('|'))
+
+
+def scan_namespace(namespace, attrs):
+    '''List the nodes directly inside a namespace carrying attrs
+
+    :returns: dict mapping attribute names to {long name: color}
+    '''
+
+    prefix = namespace + ':' if namespace else ''
+    result = {}
+    for attr_name in attrs:
+        nodes = cmds.ls(
+            prefix + '*.' + attr_name,
+            objectsOnly=True,
+            long=True
+        ) or []
+        members = {}
+        sel = om.MSelectionList()
+        for node in set(nodes):
+            sel.add(node)
+        for i in xrange(sel.length()):
+            mobject = sel.getDependNode(i)
+            members[get_node_name(mobject)] = get_color(mobject, attr_name)
+        result[attr_name] = members
+    return result
+
+
+class Scanner(object):
+    '''Scans the scene for matte attributes namespace by namespace, reusing
+    cached results of unchanged referenced namespaces.
+    '''
+
+    def __init__(self):
+        self._cache = None
+        self._signatures = {}
+        self._dirty = False
+        self._scheduled = False
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = self._read_cache()
+        return self._cache
+
+    def _read_cache(self):
+        path = get_cache_path()
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if data.get('version') != CACHE_VERSION:
+            return {}
+        return data['references']
+
+    def save(self):
+        '''Prune the cache and write it to disk'''
+
+        self._dirty = False
+        prune_cache(self.cache)
+        write_json(
+            {'version': CACHE_VERSION, 'references': self.cache},
+            get_cache_path()
+        )
+
+    def clear(self):
+        '''Forget every cached result'''
+
+        self._cache = {}
+        self._signatures = {}
+        self._dirty = False
+        path = get_cache_path()
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def _save_deferred(self):
+        self._scheduled = False
+        if not self._dirty:
+            return
+        try:
+            self.save()
+        except (IOError, OSError):
+            pass
+
+    def _schedule_save(self):
+        if not self._scheduled:
+            self._scheduled = True
+            cmds.evalDeferred(self._save_deferred, lowestPriority=True)
+
+    def invalidate(self):
+        '''Recompute the edits signatures of the references on next scan'''
+
+        self._signatures = {}
+
+    def signature(self, reference):
+        '''Edits signature of a reference, kept until invalidated'''
+
+        signature = self._signatures.get(reference)
+        if signature is None:
+            signature = get_edits_signature(reference)
+            self._signatures[reference] = signature
+        return signature
+
+    def _cached(self, namespace, reference, path, attrs):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return scan_namespace(namespace, attrs)
+
+        key = path + '|' + self.signature(reference)
+        entry = self.cache.get(key)
+        if entry is None or entry['mtime'] != mtime:
+            for other in list(self.cache):
+                if other.rpartition('|')[0] == path:
+                    if self.cache[other]['mtime'] != mtime:
+                        del self.cache[other]
+            entry = {'mtime': mtime, 'attrs': {}}
+            self.cache[key] = entry
+
+        # Last use times only need to be saved roughly for pruning
+        now = time.time()
+        if now - entry.get('used', 0) > 60 * 60:
+            self._dirty = True
+        entry['used'] = now
+
+        missing = [a for a in attrs if a not in entry['attrs']]
+        if missing:
+            for attr_name, members in scan_namespace(
+                namespace,
+                missing
+            ).iteritems():
+                entry['attrs'][attr_name] = dict(
+                    (relative_name(name, namespace), color)
+                    for name, color in members.iteritems()
+                )
+            self._dirty = True
+
+        result = {}
+        for attr_name in attrs:
+            result[attr_name] = dict(
+                (absolute_name(name, namespace), tuple(color))
+                for name, color in entry['attrs'][attr_name].iteritems()
+                if name
+            )
+        return result
+
+    def scan(self, attrs):
+        '''List every node carrying attrs, in one pass over the namespaces
+        of the scene. New cache entries are saved on idle.
+
+        :param attrs: list of attribute names
+        :returns: dict mapping attribute names to {node name: color}
+        '''
+
+        references = get_references()
+        result = dict((attr_name, {}) for attr_name in attrs)
+        for namespace in list_namespaces():
+            if namespace in references:
+                reference, path = references[namespace]
+                found = self._cached(namespace, reference, path, attrs)
+            else:
+                found = scan_namespace(namespace, attrs)
+            for attr_name, members in found.iteritems():
+                result[attr_name].update(members)
+
+        if self._dirty:
+            self._schedule_save()
+        return result
+
+    def resolve(self, attr_name, members):
+        '''Resolve scanned node names to MObjects. Names matching several
+        nodes have the colors of each node read from the scene.
+
+        :param members: dict mapping node names to colors
+        :returns: list of (MObject, color) tuples
+        '''
+
+        sel = om.MSelectionList()
+        resolved = []
+        fn = om.MFnDependencyNode()
+        for name, color in members.iteritems():
+            start = sel.length()
+            try:
+                sel.add(name)
+            except RuntimeError:
+                continue
+            end = sel.length()
+            if end - start == 1:
+                resolved.append((sel.getDependNode(start), color))
+                continue
+            for i in xrange(start, end):
+                mobject = sel.getDependNode(i)
+                if fn.setObject(mobject).hasAttribute(attr_name):
+                    resolved.append((mobject, get_color(mobject, attr_name)))
+        return resolved
+
+
+Scanner = Scanner()
@@ -0,0 +1,232 @@
+'''
+mtoatools.snapshot
+==================
+Scene-wide matte snapshots. A Snapshot captures the names, memberships and
+colors of many mattes, from the scene or from serialized matte data. Two
+snapshots can be diffed, and a diff applied to the scene performing only
+the adds, discards and color changes actually needed.
+'''
+
+from collections import defaultdict
+from .colors import COLOR_TOLERANCE, quantize
+
+__all__ = ['Snapshot', 'SnapshotDiff', 'diff']
+
+
+class Snapshot(object):
+    '''Memberships and colors of many mattes.
+
+    :param mattes: dict mapping matte names to dicts of
+        (namespace, name) shape keys to colors
+    :param info: dict mapping matte names to extra serialized keys, like the
+        packed channel or backend of the matte
+    '''
+
+    def __init__(self, mattes=None, info=None):
+        self.mattes = mattes or {}
+        self.info = info or {}
+
+    def __repr__(self):
+        return '<Snapshot>({} mattes)'.format(len(self.mattes))
+
+    @classmethod
+    def from_data(cls, data, tolerance=COLOR_TOLERANCE):
+        '''Snapshot of serialized matte data
+
+        :param data: list of matte data dicts as returned by MatteAOV.data
+        '''
+
+        mattes = {}
+        info = {}
+        for matte_data in data:
+            shapes = {}
+            for shape in matte_data['shapes']:
+                key = (shape['namespace'] or None, shape['name'])
+                shapes[key] = quantize(shape['color'], tolerance)
+            mattes[matte_data['name']] = shapes
+            info[matte_data['name']] = dict(
+                (k, v) for k, v in matte_data.items()
+                if k not in ('name', 'shapes')
+            )
+        return cls(mattes, info)
+
+    @classmethod
+    def from_scene(cls, mattes=None, tolerance=COLOR_TOLERANCE):
+        '''Snapshot of mattes in the current scene
+
+        :param mattes: MatteAOVs to capture, defaults to all
+        '''
+
+        if mattes is None:
+            from .models import MatteAOV
+            mattes = MatteAOV.ls()
+        return cls.from_data([matte.data() for matte in mattes], tolerance)
+
+    def data(self):
+        '''Serializable list of matte data dicts'''
+
+        data = []
+        for name in sorted(self.mattes):
+            matte_data = dict(self.info.get(name, {}))
+            matte_data['name'] = name
+            matte_data['shapes'] = [
+                {'name': shape, 'namespace': namespace, 'color': color}
+                for (namespace, shape), color in sorted(
+                    self.mattes[name].items(),
+                    key=lambda item: (item[0][0] or '', item[0][1])
+                )
+            ]
+            data.append(matte_data)
+        return data
+
+
+class SnapshotDiff(object):
+    '''Changes turning one snapshot into another
+
+    :ivar created: names of mattes missing from the source snapshot
+    :ivar deleted: names of mattes missing from the target snapshot
+    :ivar adds: dict mapping matte names to {shape key: color} to add
+    :ivar discards: dict mapping matte names to sets of shape keys
+    :ivar colors: dict mapping matte names to {shape key: color} to change
+    :ivar ignore_namespaces: True when shape keys have no namespaces
+    '''
+
+    def __init__(self, info=None, ignore_namespaces=False):
+        self.info = info or {}
+        self.ignore_namespaces = ignore_namespaces
+        self.created = []
+        self.deleted = []
+        self.adds = defaultdict(dict)
+        self.discards = defaultdict(set)
+        self.colors = defaultdict(dict)
+
+    def __repr__(self):
+        return (
+            '<SnapshotDiff>({} created, {} deleted, {} adds, {} discards, '
+            '{} colors)'
+        ).format(
+            len(self.created),
+            len(self.deleted),
+            sum(len(v) for v in self.adds.values()),
+            sum(len(v) for v in self.discards.values()),
+            sum(len(v) for v in self.colors.values()),
+        )
+
+    def __nonzero__(self):
+        return bool(
+            self.created or self.deleted or any(self.adds.values())
+            or any(self.discards.values()) or any(self.colors.values())
+        )
+
+    __bool__ = __nonzero__
+
+    def apply(self, ignore_namespaces=None, discard=True, delete=False):
+        '''Apply the changes to the scene in a single transaction. Shapes are
+        resolved against one index of all scene shapes. Shapes an add or
+        color change resolved to are never discarded.
+
+        :param ignore_namespaces: Match shapes by name in any namespace,
+            defaults to the ignore_namespaces of the diff
+        :param discard: Discard members missing from the target snapshot
+        :param delete: Delete mattes missing from the target snapshot
+        '''
+
+        from .models import MatteAOV
+        from .utils import get_shape_index
+        from .bulk import transaction
+
+        if ignore_namespaces is None:
+            ignore_namespaces = self.ignore_namespaces
+        by_name, by_short_name = get_shape_index()
+
+        def resolve(keys):
+            shapes = []
+            for namespace, name in keys:
+                if ignore_namespaces or not namespace:
+                    shapes.extend(by_short_name.get(name, []))
+                else:
+                    shapes.extend(by_name.get(namespace + ':' + name, []))
+            return shapes
+
+        with transaction():
+            mattes = dict((matte.name, matte) for matte in MatteAOV.ls())
+            for name in self.created:
+                matte_data = dict(self.info.get(name, {}))
+                matte_data.update({'name': name, 'shapes': []})
+                mattes[name] = MatteAOV.load(matte_data)
+
+            applied = defaultdict(set)
+            for name in set(self.adds) | set(self.colors):
+                groups = defaultdict(list)
+                for changes in (self.adds[name], self.colors[name]):
+                    for key, color in changes.items():
+                        groups[color].append(key)
+                for color, keys in groups.items():
+                    shapes = resolve(keys)
+                    if shapes:
+                        mattes[name].set_objects_color(color, *shapes)
+                        applied[name].update(shapes)
+
+            if discard:
+                for name, keys in self.discards.items():
+                    shapes = [
+                        shape for shape in resolve(keys)
+                        if shape not in applied[name]
+                    ]
+                    if shapes and name in mattes:
+                        mattes[name].discard(*shapes)
+
+            if delete:
+                for name in self.deleted:
+                    if name in mattes:
+                        mattes[name].delete()
+
+
+def strip_namespaces(shapes):
+    '''Shape keys of a matte without their namespaces'''
+
+    return dict(((None, name), color) for (_, name), color in shapes.items())
+
+
+def diff(a, b, ignore_namespaces=False):
+    '''Diff two snapshots
+
+    :param a: Source snapshot, usually the scene
+    :param b: Target snapshot, usually a matte file
+    :param ignore_namespaces: Compare shapes by name only, a shape moving
+        to another namespace is then unchanged
+    :returns: SnapshotDiff turning a into b
+    '''
+
+    a_mattes, b_mattes = a.mattes, b.mattes
+    if ignore_namespaces:
+        a_mattes = dict(
+            (name, strip_namespaces(shapes))
+            for name, shapes in a.mattes.items()
+        )
+        b_mattes = dict(
+            (name, strip_namespaces(shapes))
+            for name, shapes in b.mattes.items()
+        )
+
+    result = SnapshotDiff(b.info, ignore_namespaces)
+    result.created = sorted(set(b_mattes) - set(a_mattes))
+    result.deleted = sorted(set(a_mattes) - set(b_mattes))
+
+    for name, shapes in b_mattes.items():
+        current = a_mattes.get(name, {})
+        for key, color in shapes.items():
+            if key not in current:
+                result.adds[name][key] = color
+            elif current[key] != color:
+                result.colors[name][key] = color
+
+    for name, shapes in a_mattes.items():
+        target = b_mattes.get(name)
+        if target is None:
+            continue
+        discards = set(shapes) - set(target)
+        if discards:
+            result.discards[name] = discards
+
+    return result
@@ -1,5 +1,6 @@
 import os
 from functools import partial
+from itertools import islice
 from collections import defaultdict
 from contextlib import contextmanager
 from Qt import QtWidgets, QtCore
@@ -8,13 +9,17 @@ from maya import OpenMaya
 from .dialogs import (MatteDialog, MatteWidget, ObjectWidget, ObjectItem,
                       MatteSaveDialog, MatteLoadDialog)
 from .utils import get_maya_window
-from ..packages import yaml
+from .. import bulk
 from ..models import MatteAOV
+from ..index import NodeHandle
+from ..journal import Journal
+from ..files import index_mattes, read_matte
 from ..api import save_mattes
 
 
 _MAYA_MADE_SELECTION_ = False
 _UI_MADE_SELECTION_ = False
+LOAD_BATCH_SIZE = 16
 
 
 @contextmanager
@@ -154,8 +159,102 @@ class MattesController(MatteDialog):
         self.maya_hooks.scene_changed.connect(self.refresh_matte_list)
         self.maya_hooks.scene_selection_changed.connect(self.scene_sel_changed)
 
+        self.aov = None
+        self.obj_items = {}
+        self.seq = Journal.seq
+        self.changes_pending = False
         self.refresh_matte_list()
 
+    def showEvent(self, event):
+        Journal.subscribe(self.journal_changed)
+        self.apply_changes()
+        super(MattesController, self).showEvent(event)
+
+    def closeEvent(self, event):
+        Journal.unsubscribe(self.journal_changed)
+        super(MattesController, self).closeEvent(event)
+
+    def journal_changed(self, change):
+        '''Apply journal changes once control returns to the event loop'''
+
+        if self.changes_pending:
+            return
+        self.changes_pending = True
+        QtCore.QTimer.singleShot(0, self.apply_changes)
+
+    def apply_changes(self):
+        '''Update the lists with the changes recorded since the last update,
+        rebuilding them only after an undo, a scene change or when the
+        journal was trimmed.
+        '''
+
+        self.changes_pending = False
+        changes = Journal.changes_since(self.seq)
+        if changes is None or any(c.kind == 'reset' for c in changes):
+            self.refresh_matte_list()
+            return
+
+        self.seq = Journal.seq
+        for change in changes:
+            getattr(self, 'apply_' + change.kind)(change)
+
+    def apply_create(self, change):
+        if self.matte_item(change.name) is None:
+            self.new_matte_item(change.aov)
+
+    def apply_delete(self, change):
+        item = self.matte_item(change.name)
+        if item is None:
+            return
+        self.matte_list.takeItem(self.matte_list.row(item))
+        if item.pynode is self.aov:
+            self.aov = None
+            self.clear_obj_list()
+
+    def apply_rename(self, change):
+        item = self.matte_item(change.old_name)
+        if item is None:
+            return
+        item.matte_name = change.name
+        self.matte_list.itemWidget(item).label.setText(change.name)
+
+    def apply_add(self, change):
+        if not self.is_current(change):
+            return
+        for node in change.nodes:
+            if node.long_name not in self.obj_items:
+                node = node.pynode()
+                self.new_obj_item(node, self.aov.get_color(node))
+        self.obj_list.sortItems()
+
+    def apply_discard(self, change):
+        if not self.is_current(change):
+            return
+        for node in change.nodes:
+            self.remove_obj_item(node.long_name)
+
+    def apply_color(self, change):
+        if not self.is_current(change):
+            return
+        for node in change.nodes:
+            item = self.obj_items.get(node.long_name)
+            if item is not None:
+                item.refresh_color()
+        self.obj_list.sortItems()
+
+    def is_current(self, change):
+        item = self.matte_list.currentItem()
+        return (
+            self.aov is not None and item is not None and
+            item.pynode is self.aov and item.matte_name == change.name
+        )
+
+    def matte_item(self, name):
+        for i in xrange(self.matte_list.count()):
+            item = self.matte_list.item(i)
+            if item.matte_name == name:
+                return item
+
     def set_aov(self, aov):
         self.aov = aov
         self.refresh_obj_list()
@@ -195,9 +294,6 @@ class MattesController(MatteDialog):
 
             nodes = [item.pynode for item in items]
             self.aov.set_objects_color(color, *nodes)
-            for item in items:
-                item.refresh_color()
-            self.obj_list.sortItems()
 
         return on_click
 
@@ -206,12 +302,9 @@ class MattesController(MatteDialog):
             return
 
         nodes = pmc.ls(sl=True, transforms=True)
-        color = (1, 1, 1)
-        added_nodes = self.aov.add(*nodes)
-        for node in added_nodes:
-            node.attr(self.aov.mesh_attr_name).set(*color)
-            self.new_obj_item(node, color)
-        self.obj_list.sortItems()
+        with bulk.transaction():
+            added_nodes = self.aov.add(*nodes)
+            self.aov.set_objects_color((1, 1, 1), *added_nodes)
 
     def new_clicked(self):
         name = self.matte_line.text()
@@ -219,12 +312,12 @@ class MattesController(MatteDialog):
             self.matte_line.setFocus()
             return
 
-        aov = MatteAOV.create(name)
-        self.new_matte_item(aov)
+        MatteAOV.create(name)
 
     def new_matte_item(self, aov):
         item = QtWidgets.QListWidgetItem()
         item.pynode = aov
+        item.matte_name = aov.name
 
         widget = MatteWidget(aov.name)
 
@@ -242,11 +335,7 @@ class MattesController(MatteDialog):
         aov.rename(new_name)
 
     def delete_matte_item(self, item, aov):
-        self.matte_list.takeItem(self.matte_list.indexFromItem(item).row())
         aov.delete()
-        if aov == self.aov:
-            self.aov = None
-            self.obj_list.clear()
 
     def refresh_item_color(self, item):
         item.refresh_color()
@@ -254,7 +343,7 @@ class MattesController(MatteDialog):
 
     def delete_obj_item(self, item):
         try:
-            self.obj_list.takeItem(self.obj_list.indexFromItem(item).row())
+            self.remove_obj_item(item.long_name)
             self.aov.discard(item.pynode)
         except RuntimeError as e:
             if "Internal C++ object (ObjectItem) already deleted" in str(e):
@@ -262,12 +351,16 @@ class MattesController(MatteDialog):
             raise
 
     def new_obj_item(self, node, color):
+        if isinstance(node, NodeHandle):
+            node = node.pynode()
 
         widget = ObjectWidget(str(node))
         widget.set_color(*color)
 
         item = ObjectItem(self.aov, node, widget)
+        item.long_name = node.longName()
         item.setSizeHint(widget.sizeHint())
+        self.obj_items[item.long_name] = item
 
         self.obj_list.addItem(item)
         self.obj_list.setItemWidget(item, widget)
@@ -285,22 +378,30 @@ class MattesController(MatteDialog):
         widget.del_button.clicked.connect(del_callback)
         self.maya_hooks.add_about_to_delete_callback(node, del_callback)
 
-    def clear_lists(self):
+    def remove_obj_item(self, long_name):
+        item = self.obj_items.pop(long_name, None)
+        if item is not None:
+            self.obj_list.takeItem(self.obj_list.row(item))
+
+    def clear_obj_list(self):
         self.maya_hooks.clear_callbacks()
-        self.matte_list.clear()
+        self.obj_items = {}
         self.obj_list.clear()
 
-    def refresh_matte_list(self):
-        self.maya_hooks.clear_callbacks()
+    def clear_lists(self):
+        self.clear_obj_list()
         self.matte_list.clear()
-        self.obj_list.clear()
+
+    def refresh_matte_list(self):
+        self.seq = Journal.seq
+        self.aov = None
+        self.clear_lists()
 
         for aov in MatteAOV.ls():
             self.new_matte_item(aov)
 
     def refresh_obj_list(self):
-        self.maya_hooks.clear_callbacks()
-        self.obj_list.clear()
+        self.clear_obj_list()
 
         for node, color in self.aov:
             self.new_obj_item(node, color)
@@ -379,17 +480,31 @@ class MattesController(MatteDialog):
         if not filepath:
             return
 
-        with open(filepath, 'r') as f:
-            data = yaml.load(f.read())
-
         dialog = MatteLoadDialog(self)
+        f = open(filepath, 'rb')
+        mattes = index_mattes(f)
 
-        for matte_data in data:
-            item = QtWidgets.QListWidgetItem(matte_data['name'])
-            item.matte_data = matte_data
-            dialog.matte_list.addItem(item)
+        def list_mattes():
+            # List a batch of matte names per event loop cycle, mattes are
+            # only parsed in full once selected and accepted
+            if f.closed:
+                return
 
-        dialog.matte_list.selectAll()
+            count = 0
+            for name, offset, position in islice(mattes, LOAD_BATCH_SIZE):
+                item = QtWidgets.QListWidgetItem(name)
+                item.matte_offset = (offset, position)
+                dialog.matte_list.addItem(item)
+                item.setSelected(True)
+                count += 1
+
+            if count == LOAD_BATCH_SIZE:
+                QtCore.QTimer.singleShot(0, list_mattes)
+            else:
+                f.close()
+
+        def on_finished(*args):
+            f.close()
 
         def on_accepted():
             items = dialog.matte_list.selectedItems()
@@ -398,13 +513,15 @@ class MattesController(MatteDialog):
 
             ignore_namespaces = dialog.ignore_namespaces.isChecked()
 
-            data = [item.matte_data for item in items]
-            for matte_data in data:
-                MatteAOV.load(matte_data, ignore_namespaces)
-
-            self.refresh_matte_list()
+            offsets = sorted(item.matte_offset for item in items)
+            with open(filepath, 'rb') as stream:
+                for offset, position in offsets:
+                    matte_data = read_matte(stream, offset, position)
+                    MatteAOV.load(matte_data, ignore_namespaces)
 
         dialog.accepted.connect(on_accepted)
+        dialog.finished.connect(on_finished)
+        list_mattes()
         dialog.exec_()
 
     def show_help(self):
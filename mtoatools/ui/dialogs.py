@@ -89,7 +89,7 @@ class ObjectItem(QtWidgets.QListWidgetItem):
         return self.color() < other.color()
 
     def color(self):
-        return self.pynode.attr(self.aov.mesh_attr_name).get()
+        return self.aov.get_color(self.pynode)
 
     def refresh_color(self):
         self.widget.set_color(*self.color())
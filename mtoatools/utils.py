@@ -1,3 +1,5 @@
+from collections import defaultdict
+from maya import cmds
 import pymel.core as pmc
 
 
@@ -11,11 +13,19 @@ def add_vector_attr(node, name):
         node.attr(name + c).set(e=True, k=True)
 
 
-def get_next_name(name):
+def get_next_name(name, used=None):
+    '''Get the next unused aov name
+
+    :param used: Optional set of used aov names to check instead of the scene
+    '''
+
     i = 0
     while True:
 
-        if not pmc.objExists('aiAOV_' + name):
+        if used is None:
+            if not pmc.objExists('aiAOV_' + name):
+                return name
+        elif name not in used:
             return name
 
         try:
@@ -24,3 +34,19 @@ def get_next_name(name):
         except ValueError:
             name = name + str(i + 1)
         i += 1
+
+
+def get_shape_index():
+    '''Index every dag shape in the scene by name, once.
+
+    :returns: (by_name, by_short_name) dicts mapping a namespaced name and a
+        name without namespaces to lists of long shape names
+    '''
+
+    by_name = defaultdict(list)
+    by_short_name = defaultdict(list)
+    for shape in cmds.ls(shapes=True, long=True) or []:
+        name = shape.rpartition('|')[-1]
+        by_name[name].append(shape)
+        by_short_name[name.rpartition(':')[-1]].append(shape)
+    return by_name, by_short_name
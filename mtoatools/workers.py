@@ -0,0 +1,175 @@
+'''
+mtoatools.workers
+=================
+Parse matte files in worker processes. Workers are started explicitly with
+subprocess, running mayapy, or python outside of Maya, with a bootstrap that
+registers an empty mtoatools package. So workers only import the modules
+reading matte files, never Maya or the mtoatools package itself, and the
+running Maya process is neither forked nor changed.
+
+Parsing runs at a few MB per second while starting a worker and sending its
+mattes back costs a fraction of a second. Files are only parsed in workers
+when each worker gets at least WORKER_BYTES of matte files. Binary
+libraries are read through mmap in the calling process.
+'''
+
+import os
+import sys
+import logging
+import subprocess
+import multiprocessing
+import cPickle as pickle
+from .files import merge_mattes, read_matte_file
+from .library import MAGIC
+
+__all__ = ['read_matte_files']
+
+log = logging.getLogger(__name__)
+
+WORKER_BYTES = 4 * 1024 * 1024
+PACKAGE_PATH = os.path.dirname(os.path.abspath(__file__))
+BOOTSTRAP = '''
+import sys
+import types
+package = types.ModuleType('mtoatools')
+package.__path__ = [sys.argv[1]]
+sys.modules['mtoatools'] = package
+from mtoatools.workers import main
+main(sys.argv[2:])
+'''
+
+
+def get_python():
+    '''Python executable for workers. Inside Maya, maya.bin on Linux or
+    Maya.app/Contents/MacOS/Maya on macOS, that is mayapy from
+    $MAYA_LOCATION/bin or next to the Maya executable. None when it can not
+    be found.
+    '''
+
+    name = os.path.splitext(os.path.basename(sys.executable).lower())[0]
+    if sys.executable and not (
+        name.startswith('maya') and not name.startswith('mayapy')
+    ):
+        return sys.executable
+
+    mayapy = 'mayapy.exe' if sys.platform == 'win32' else 'mayapy'
+    folders = [os.path.dirname(sys.executable)]
+    location = os.environ.get('MAYA_LOCATION')
+    if location:
+        folders.insert(0, os.path.join(location, 'bin'))
+    for folder in folders:
+        path = os.path.join(folder, mayapy)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def is_library(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def split_files(filepaths, sizes, count):
+    '''Split files in count lists of about equal total size, the largest
+    files are handed out first to the smallest list.
+
+    :returns: list of lists of indices into filepaths
+    '''
+
+    chunks = [[] for i in xrange(count)]
+    totals = [0] * count
+    for i in sorted(xrange(len(filepaths)), key=lambda i: -sizes[i]):
+        j = totals.index(min(totals))
+        chunks[j].append(i)
+        totals[j] += sizes[i]
+    return [chunk for chunk in chunks if chunk]
+
+
+def start_worker(python, filepaths):
+    return subprocess.Popen(
+        [python, '-c', BOOTSTRAP, PACKAGE_PATH] + list(filepaths),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+
+
+def main(filepaths):
+    '''Worker entry point, writes the pickled mattes of each file to
+    stdout.
+    '''
+
+    if sys.platform == 'win32':
+        import msvcrt
+        msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+
+    files = [read_matte_file(filepath) for filepath in filepaths]
+    pickle.dump(files, sys.stdout, pickle.HIGHEST_PROTOCOL)
+    sys.stdout.flush()
+
+
+def read_matte_files(filepaths, precedence='last', merge_shapes=False,
+                     processes=None, worker_bytes=WORKER_BYTES):
+    '''Parse matte files, in worker processes when they are large enough,
+    and merge their mattes.
+
+    :param filepaths: list of matte files or binary libraries, in the order
+        used by precedence, like sequence, shot and asset files
+    :param precedence: "first", "last" or a callable, see
+        files.merge_mattes
+    :param merge_shapes: Combine the shapes of mattes of the same name
+    :param processes: Maximum number of workers, defaults to one per cpu
+    :param worker_bytes: Minimum size of matte files parsed per worker
+    :returns: list of merged matte data dicts
+    '''
+
+    filepaths = list(filepaths)
+    files = [None] * len(filepaths)
+
+    parse = []
+    for i, filepath in enumerate(filepaths):
+        if is_library(filepath):
+            files[i] = read_matte_file(filepath)
+        else:
+            parse.append(i)
+
+    sizes = [os.path.getsize(filepaths[i]) for i in parse]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(
+        processes,
+        len(parse),
+        sum(sizes) // max(worker_bytes, 1)
+    )
+    python = get_python() if processes > 1 else None
+    if processes > 1 and python is None:
+        log.warning(
+            'mayapy not found, reading %d matte files serially',
+            len(parse)
+        )
+    elif processes < 2:
+        log.debug('Reading %d matte files serially', len(parse))
+
+    if python is None:
+        for i in parse:
+            files[i] = read_matte_file(filepaths[i])
+        return merge_mattes(files, precedence, merge_shapes)
+
+    workers = []
+    for chunk in split_files(parse, sizes, processes):
+        indices = [parse[i] for i in chunk]
+        paths = [filepaths[i] for i in indices]
+        workers.append((indices, start_worker(python, paths)))
+
+    errors = []
+    for indices, worker in workers:
+        out, err = worker.communicate()
+        if worker.returncode:
+            errors.append(err.strip())
+            continue
+        for i, mattes in zip(indices, pickle.loads(out)):
+            files[i] = mattes
+
+    if errors:
+        raise RuntimeError('Failed to read matte files:\n' + '\n'.join(errors))
+
+    return merge_mattes(files, precedence, merge_shapes)
@@ -16,6 +16,18 @@ def main():
         show_dialogs.matte_ui()
         return
 
+    if args and args[0] == '-benchmark':
+        setup_path()
+        from tests import benchmark_files
+        benchmark_files.matte_files()
+        return
+
+    if args and args[0] == '-benchmark_scan':
+        setup_path()
+        from tests import benchmark_scan
+        benchmark_scan.scan()
+        return
+
     os.system('mayapy -m unittest discover tests -v')
 
 
@@ -0,0 +1,40 @@
+import time
+import random
+from mtoatools.columns import MatteColumns
+from mtoatools.analysis import MatteReport
+
+
+def generate_columns(mattes, shapes, groups):
+    random.seed(0)
+    for i in xrange(mattes):
+        colors = [
+            (random.random(), random.random(), random.random())
+            for j in xrange(groups)
+        ]
+        names = ['shape_{}Shape'.format(j) for j in xrange(shapes)]
+        yield MatteColumns.from_rows(
+            range(shapes),
+            names,
+            [colors[j % groups] for j in xrange(shapes)]
+        )
+
+
+def analysis(mattes=100, shapes=10000, groups=200):
+    '''Time grouping shapes by color and finding collisions of many
+    mattes, the columnar mirrors are built up front.
+    '''
+
+    columns = list(generate_columns(mattes, shapes, groups))
+
+    start = time.time()
+    matte_groups = [c.groups() for c in columns]
+    grouped = time.time()
+    reports = [MatteReport(i, g) for i, g in enumerate(matte_groups)]
+    done = time.time()
+
+    print '{} mattes of {} shapes in {} groups'.format(mattes, shapes, groups)
+    print 'group by color   {:>8.3f}s'.format(grouped - start)
+    print 'collisions       {:>8.3f}s  {} collisions'.format(
+        done - grouped,
+        sum(len(r.collisions) for r in reports)
+    )
@@ -0,0 +1,58 @@
+import os
+import time
+import random
+import tempfile
+from mtoatools.packages import yaml
+from mtoatools.files import dump_mattes, load_documents
+
+
+def generate_mattes(mattes, shapes):
+    random.seed(0)
+    for i in xrange(mattes):
+        yield {
+            'name': 'matte_{}'.format(i),
+            'shapes': [
+                {
+                    'name': 'shape_{}Shape'.format(j),
+                    'namespace': 'asset_{}'.format(j % 20) if j % 3 else None,
+                    'color': [random.choice((0, 1)), random.random(), 0.5],
+                }
+                for j in xrange(shapes)
+            ],
+        }
+
+
+def measure(name, load, filepath):
+    start = time.time()
+    with open(filepath, 'r') as f:
+        count = sum(1 for document in load(f))
+    print '{:<20} {:>8.3f}s  {} documents'.format(
+        name,
+        time.time() - start,
+        count
+    )
+
+
+def matte_files(mattes=50, shapes=2000):
+    '''Compare the matte parser to yaml on a generated matte file'''
+
+    fd, filepath = tempfile.mkstemp(suffix='.yml')
+    os.close(fd)
+    try:
+        with open(filepath, 'w') as f:
+            dump_mattes(generate_mattes(mattes, shapes), f)
+        print 'matte file: {:.1f} MB'.format(
+            os.path.getsize(filepath) / 1024.0 / 1024.0
+        )
+
+        measure('yaml.load_all', yaml.load_all, filepath)
+        measure('yaml.safe_load_all', yaml.safe_load_all, filepath)
+        if yaml.__with_libyaml__:
+            measure(
+                'CSafeLoader',
+                lambda f: yaml.load_all(f, Loader=yaml.CSafeLoader),
+                filepath
+            )
+        measure('load_documents', load_documents, filepath)
+    finally:
+        os.remove(filepath)
@@ -0,0 +1,62 @@
+import os
+import time
+import shutil
+import tempfile
+
+
+def measure(name, function):
+    start = time.time()
+    function()
+    print '{:<24} {:>8.3f}s'.format(name, time.time() - start)
+
+
+def create_asset(filepath, mattes, shapes):
+    from maya import cmds
+    from mtoatools.models import MatteAOV
+
+    cmds.file(new=True, force=True)
+    cubes = [
+        cmds.polyCube(name='cube_{}'.format(i))[0] for i in xrange(shapes)
+    ]
+    cmds.select(clear=True)
+    for i in xrange(mattes):
+        MatteAOV.create('matte_{}'.format(i)).add(*cubes)
+    cmds.file(rename=filepath)
+    cmds.file(save=True, type='mayaAscii', force=True)
+
+
+def scan(references=20, mattes=10, shapes=100):
+    '''Compare scanning matte attributes one at a time to one pass'''
+
+    from maya import standalone
+    standalone.initialize(name='python')
+    from maya import cmds
+    cmds.loadPlugin('mtoa', quiet=True)
+    from mtoatools.scanner import Scanner
+
+    tempdir = tempfile.mkdtemp()
+    os.environ['MTOATOOLS_SCAN_CACHE'] = os.path.join(tempdir, 'cache.json')
+    try:
+        asset = os.path.join(tempdir, 'asset.ma')
+        create_asset(asset, mattes, shapes)
+        cmds.file(new=True, force=True)
+        for i in xrange(references):
+            cmds.file(asset, reference=True, namespace='asset_{}'.format(i))
+
+        attrs = ['mtoa_constant_matte_{}'.format(i) for i in xrange(mattes)]
+        print '{} references, {} mattes, {} shapes'.format(
+            references,
+            mattes,
+            shapes
+        )
+
+        Scanner.clear()
+        measure('cold, one pass', lambda: Scanner.scan(attrs))
+        measure('warm, one pass', lambda: Scanner.scan(attrs))
+        measure(
+            'warm, per attribute',
+            lambda: [Scanner.scan([attr_name]) for attr_name in attrs]
+        )
+    finally:
+        del os.environ['MTOATOOLS_SCAN_CACHE']
+        shutil.rmtree(tempdir)
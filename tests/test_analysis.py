@@ -0,0 +1,106 @@
+import random
+import unittest
+from mtoatools import analysis
+from mtoatools.analysis import (MatteReport, analyze, find_collisions,
+                                min_distances, propose_colors)
+
+
+COLORS = [(1, 0, 0), (0.98, 0.01, 0), (0, 0, 1), (0, 0.05, 1), (0, 1, 0)]
+
+
+class Matte(object):
+
+    def __init__(self, groups):
+        self.groups = groups
+
+    def get_sorted_objects(self):
+        return self.groups
+
+
+class AnalysisTests(object):
+
+    def test_find_collisions(self):
+        '''Pairs closer than the threshold are found once, i < j'''
+
+        pairs = find_collisions(COLORS)
+        self.assertEqual([(i, j) for i, j, d in pairs], [(0, 1), (2, 3)])
+        self.assertAlmostEqual(pairs[1][2], 0.05)
+        self.assertEqual(find_collisions(COLORS, 0.01), [])
+        self.assertEqual(find_collisions(COLORS[:1]), [])
+
+    def test_find_collisions_chunked(self):
+        '''Chunked sweeps find the same pairs as comparing every pair'''
+
+        random.seed(0)
+        colors = [
+            (random.random(), random.random(), random.random())
+            for i in range(300)
+        ]
+        expected = [
+            (i, j) for i in range(300) for j in range(i + 1, 300)
+            if sum((x - y) ** 2 for x, y in zip(colors[i], colors[j])) < 0.01
+        ]
+        chunk_bytes = analysis.CHUNK_BYTES
+        analysis.CHUNK_BYTES = 32 * 300 * 7
+        try:
+            pairs = find_collisions(colors)
+        finally:
+            analysis.CHUNK_BYTES = chunk_bytes
+        self.assertEqual([(i, j) for i, j, d in pairs], expected)
+
+    def test_min_distances(self):
+        distances = min_distances([(0, 0, 0), (1, 0, 0)], [(1, 0, 0)])
+        self.assertEqual([float(d) for d in distances], [1, 0])
+        self.assertEqual(list(min_distances([(0, 0, 0)], [])), [float('inf')])
+
+    def test_propose_colors(self):
+        '''The smaller group of each pair moves away from every kept color'''
+
+        pairs = find_collisions(COLORS)
+        sizes = [5, 1, 1, 5, 1]
+        proposal = propose_colors(COLORS, pairs, sizes)
+        self.assertEqual(sorted(proposal), [1, 2])
+
+        kept = [c for i, c in enumerate(COLORS) if i not in proposal]
+        colors = kept + list(proposal.values())
+        self.assertEqual(find_collisions(colors), [])
+        self.assertNotEqual(proposal[1], proposal[2])
+
+    def test_analyze(self):
+        '''Reports list the collisions of each matte and a proposal'''
+
+        clean = Matte([((0, 0, 1), ['a']), ((1, 0, 0), ['b'])])
+        matte = Matte([
+            ((1, 0, 0), ['a', 'b']),
+            ((0.99, 0, 0), ['c']),
+            ((0, 1, 0), ['d']),
+        ])
+        reports = analyze([clean, matte])
+        self.assertEqual([r.matte for r in reports], [matte])
+
+        report = reports[0]
+        self.assertEqual(len(report.collisions), 1)
+        self.assertEqual(list(report.proposal), [(0.99, 0, 0)])
+        colors = [(1, 0, 0), (0, 1, 0), report.proposal[0.99, 0, 0]]
+        self.assertEqual(find_collisions(colors), [])
+
+    def test_report_without_collisions(self):
+        report = MatteReport('matte', [((1, 0, 0), ['a'])])
+        self.assertEqual((report.collisions, report.proposal), ([], {}))
+
+
+@unittest.skipUnless(analysis.numpy_enabled, 'requires numpy')
+class TestAnalysis(AnalysisTests, unittest.TestCase):
+    pass
+
+
+class TestAnalysisPure(AnalysisTests, unittest.TestCase):
+    '''The same tests with numpy disabled'''
+
+    def setUp(self):
+        self.numpy_enabled = analysis.numpy_enabled
+        analysis.numpy_enabled = False
+
+    def tearDown(self):
+        analysis.numpy_enabled = self.numpy_enabled
+
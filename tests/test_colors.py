@@ -0,0 +1,58 @@
+import unittest
+from mtoatools.colors import id_color, id_colors, id_palette, quantize
+from mtoatools.analysis import COLLISION_THRESHOLD
+
+
+def distance(a, b):
+    return sum((x - y) ** 2 for x, y in zip(a, b)) ** 0.5
+
+
+class TestIdColors(unittest.TestCase):
+
+    def test_palette_distinct(self):
+        '''Palette colors stay distinct after quantization'''
+
+        palette = id_palette()
+        self.assertEqual(len(palette), 999)
+        self.assertEqual(len(set(quantize(c) for c in palette)), len(palette))
+
+    def test_palette_min_distance(self):
+        '''Nearest pair of the default palette is separable in comp'''
+
+        palette = id_palette()
+        nearest = min(
+            distance(a, palette[j])
+            for i, a in enumerate(palette)
+            for j in range(i + 1, len(palette))
+        )
+        self.assertGreater(nearest, COLLISION_THRESHOLD)
+
+    def test_id_color(self):
+        '''ID colors are stable and keyed on namespaces in namespace mode'''
+
+        names = ['|geo|part{}Shape'.format(i) for i in range(40)]
+        colors = [id_color(name) for name in names]
+        self.assertEqual(colors, [id_color(name) for name in names])
+        self.assertEqual(
+            id_color('a:bShape', 'namespace'),
+            id_color('a:cShape', 'namespace')
+        )
+
+    def test_id_colors(self):
+        '''Batches get distinct colors independent of the name order'''
+
+        names = ['|geo|part{}Shape'.format(i) for i in range(500)]
+        colors = id_colors(names)
+        self.assertEqual(len(set(colors.values())), len(names))
+        self.assertEqual(colors, id_colors(reversed(names)))
+
+    def test_id_colors_taken(self):
+        '''Keys outside the batch keep their color, others avoid it'''
+
+        name = '|geo|partShape'
+        color = id_color(name)
+        colors = id_colors(['a:bShape', name], 'namespace', taken={'a': color})
+        self.assertEqual(colors['a:bShape'], color)
+
+        colors = id_colors([name], taken={'other': color})
+        self.assertNotEqual(colors[name], color)
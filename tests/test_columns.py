@@ -0,0 +1,53 @@
+import unittest
+from mtoatools.columns import MatteColumns
+
+
+SHAPES = [
+    {'name': 'b', 'namespace': 'ns', 'color': (1, 0, 0)},
+    {'name': 'a', 'namespace': None, 'color': (0.5, 0.5, 0.5)},
+    {'name': 'c', 'namespace': 'ns', 'color': (0, 1, 0)},
+]
+
+
+class TestMatteColumns(unittest.TestCase):
+
+    def test_data_roundtrip(self):
+        '''Columns serialize back to the shape dicts they were built from'''
+
+        columns = MatteColumns.from_data(SHAPES)
+        self.assertEqual(columns.namespaces, ['ns', None])
+        self.assertEqual(columns.data(), SHAPES)
+
+    def test_filters(self):
+        '''Namespace, pattern and channel filters select rows'''
+
+        columns = MatteColumns.from_data(SHAPES)
+        self.assertEqual(columns.in_namespace('ns').names, ['b', 'c'])
+        self.assertEqual(columns.in_namespace(None).names, ['a'])
+        self.assertEqual(columns.match('[ab]').names, ['b', 'a'])
+        self.assertEqual(
+            columns.channel(0).color_list(),
+            [(1, 1, 1), (0.5, 0.5, 0.5)]
+        )
+
+    def test_diff(self):
+        '''Diff reports added, removed and recolored rows'''
+
+        columns = MatteColumns.from_data(SHAPES)
+        other = MatteColumns.from_data([
+            {'name': 'b', 'namespace': 'ns', 'color': (1, 0, 0)},
+            {'name': 'c', 'namespace': 'ns', 'color': (0, 0, 1)},
+            {'name': 'z', 'namespace': None, 'color': (0, 0, 1)},
+        ])
+        self.assertEqual(columns.diff(other), ([2], [1], [1]))
+
+    def test_groups(self):
+        '''Groups collect nodes by color in reverse color order'''
+
+        columns = MatteColumns.from_items([
+            ('n1', (0, 0, 1)), ('n2', (1, 0, 0)), ('n3', (0, 0, 1))
+        ])
+        self.assertEqual(
+            columns.groups(),
+            [((1, 0, 0), ['n2']), ((0, 0, 1), ['n1', 'n3'])]
+        )
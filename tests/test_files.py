@@ -0,0 +1,237 @@
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from mtoatools.packages import yaml
+from mtoatools.journal import Journal
+from mtoatools.library import dump_library
+from mtoatools.files import (dump_mattes, iter_mattes, load_documents,
+                             index_mattes, read_matte, SaveCache,
+                             read_matte_file, merge_mattes)
+
+
+MATTES = [
+    {
+        'name': 'a',
+        'shapes': [{'name': 'cube', 'namespace': 'ns', 'color': [1, 0, 0]}]
+    },
+    {
+        'name': 'b',
+        'shapes': [{'name': 'sphere', 'namespace': None, 'color': [0, 0, 1]}]
+    },
+]
+
+
+class TestMatteFiles(unittest.TestCase):
+
+    def test_roundtrip(self):
+        '''Mattes are written as one document each and read back'''
+
+        stream = StringIO()
+        dump_mattes(iter(MATTES), stream)
+        self.assertEqual(stream.getvalue().count('---'), 2)
+
+        stream.seek(0)
+        self.assertEqual(list(iter_mattes(stream)), MATTES)
+
+    def test_lazy(self):
+        '''Mattes are parsed only as they are requested'''
+
+        stream = StringIO()
+        dump_mattes(MATTES, stream)
+        stream.seek(0)
+        mattes = iter_mattes(stream)
+        self.assertEqual(next(mattes)['name'], 'a')
+        self.assertEqual(next(mattes)['name'], 'b')
+        self.assertRaises(StopIteration, next, mattes)
+
+    def test_index(self):
+        '''Mattes are listed by name and read one at a time by offset'''
+
+        stream = StringIO()
+        dump_mattes(MATTES, stream)
+        stream.write(yaml.safe_dump(MATTES, explicit_start=True))
+        stream.seek(0)
+        entries = list(index_mattes(stream))
+        self.assertEqual([name for name, o, p in entries], ['a', 'b'] * 2)
+        for i in (3, 0, 2, 1):
+            name, offset, position = entries[i]
+            self.assertEqual(
+                read_matte(stream, offset, position),
+                MATTES[i % 2]
+            )
+
+    def test_single_document(self):
+        '''Files holding a single list of mattes are still read'''
+
+        stream = StringIO(yaml.safe_dump(MATTES))
+        self.assertEqual(list(iter_mattes(stream)), MATTES)
+
+
+class TestMatteParser(unittest.TestCase):
+
+    def assertParsed(self, mattes):
+        stream = StringIO()
+        dump_mattes(mattes, stream)
+        stream.seek(0)
+        expected = list(yaml.safe_load_all(stream))
+        stream.seek(0)
+        self.assertEqual(list(load_documents(stream)), expected)
+
+    def test_schema(self):
+        '''Parsed mattes equal the mattes loaded by yaml'''
+
+        self.assertParsed(MATTES + [
+            {
+                'name': 'packed',
+                'packed': {'aov': 'matte_packed', 'channel': 'r'},
+                'shapes': [
+                    {'name': 'yes', 'namespace': '123', 'color': [1.0, 0, 0]},
+                    {'name': "it's", 'namespace': None, 'color': [1e-5, 0, 1]},
+                ],
+            },
+            {'name': 'operator', 'backend': 'operator', 'shapes': []},
+            {'name': 'default', 'default_color': [0.5, 0, 0], 'shapes': []},
+            {'name': u'\xe9t\xe9', 'shapes': []},
+        ])
+
+    def test_fallback(self):
+        '''Documents outside of the schema are loaded by yaml'''
+
+        self.assertParsed([
+            {'name': 'a' * 100 + ' ' + 'b' * 100, 'shapes': []},
+            {'name': 'rules', 'shapes': [], 'extra': {'nested': [1, 2]}},
+            {'name': '- a # b', 'shapes': [{'color': [float('inf'), 0, 0]}]},
+            [{'name': 'old', 'shapes': []}],
+        ])
+        stream = StringIO('%YAML 1.1\n--- {name: a, shapes: []}\n...\n')
+        self.assertEqual(list(load_documents(stream)), [
+            {'name': 'a', 'shapes': []}
+        ])
+
+
+class Matte(object):
+
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+        self.queries = 0
+        self.version = 0
+
+    def data(self):
+        self.queries += 1
+        return self._data
+
+    def revision(self):
+        return self.version
+
+
+class TestSaveCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'mattes.yml')
+        self.mattes = [Matte(data['name'], data) for data in MATTES]
+
+    def tearDown(self):
+        SaveCache.forget()
+        shutil.rmtree(self.tempdir)
+
+    def load(self):
+        with open(self.path, 'r') as f:
+            return list(iter_mattes(f))
+
+    def test_unchanged(self):
+        '''Unchanged mattes are copied from the existing file'''
+
+        SaveCache.save(self.mattes, self.path)
+        SaveCache.save(self.mattes, self.path)
+        self.assertEqual([m.queries for m in self.mattes], [1, 1])
+        self.assertEqual(self.load(), MATTES)
+
+    def test_changed(self):
+        '''Mattes changed in the journal are queried again'''
+
+        SaveCache.save(self.mattes, self.path)
+        Journal.record('color', name='b', nodes=['n'], color=(1, 1, 1))
+        SaveCache.save(self.mattes, self.path)
+        self.assertEqual([m.queries for m in self.mattes], [1, 2])
+
+        Journal.record('reset')
+        SaveCache.save(self.mattes[:1], self.path)
+        self.assertEqual([m.queries for m in self.mattes], [2, 2])
+        self.assertEqual(self.load(), MATTES[:1])
+
+    def test_revised(self):
+        '''Mattes edited outside of the journal are queried again'''
+
+        SaveCache.save(self.mattes, self.path)
+        self.mattes[0].version += 1
+        SaveCache.save(self.mattes, self.path)
+        self.assertEqual([m.queries for m in self.mattes], [2, 1])
+
+    def test_edited_on_disk(self):
+        '''Documents edited on disk are written again'''
+
+        SaveCache.save(self.mattes, self.path)
+        with open(self.path, 'r') as f:
+            text = f.read()
+        with open(self.path, 'w') as f:
+            f.write(text.replace('sphere', 'cone'))
+        SaveCache.save(self.mattes, self.path)
+        self.assertEqual([m.queries for m in self.mattes], [1, 2])
+        self.assertEqual(self.load(), MATTES)
+
+
+class TestMergeMattes(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_read(self):
+        '''Matte files and binary libraries are read alike'''
+
+        yaml_path = os.path.join(self.tempdir, 'mattes.yml')
+        library_path = os.path.join(self.tempdir, 'mattes.mtl')
+        with open(yaml_path, 'w') as f:
+            dump_mattes(MATTES, f)
+        with open(library_path, 'wb') as f:
+            dump_library(MATTES, f)
+
+        self.assertEqual(read_matte_file(yaml_path), MATTES)
+        self.assertEqual(
+            [m['name'] for m in read_matte_file(library_path)],
+            ['a', 'b']
+        )
+
+    def test_precedence(self):
+        '''Mattes of the winning file replace mattes of the same name'''
+
+        a, b = MATTES
+        shot = [dict(a, shapes=[])]
+        self.assertEqual(merge_mattes([MATTES, shot]), [shot[0], b])
+        self.assertEqual(merge_mattes([MATTES, shot], 'first'), MATTES)
+        self.assertRaises(ValueError, merge_mattes, [MATTES], 'middle')
+
+    def test_merge_shapes(self):
+        '''Shapes of mattes of the same name are combined'''
+
+        a = MATTES[0]
+        shot = [{
+            'name': 'a',
+            'shapes': [
+                {'name': 'cube', 'namespace': 'ns', 'color': [0, 1, 0]},
+                {'name': 'cone', 'namespace': None, 'color': [0, 0, 1]},
+            ]
+        }]
+        merged = merge_mattes([[a], shot], merge_shapes=True)
+        self.assertEqual(merged[0]['shapes'], shot[0]['shapes'])
+        merged = merge_mattes([[a], shot], 'first', merge_shapes=True)
+        self.assertEqual(
+            merged[0]['shapes'],
+            a['shapes'] + shot[0]['shapes'][1:]
+        )
@@ -0,0 +1,40 @@
+import unittest
+from mtoatools.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.journal = type(Journal)(size=3)
+
+    def test_changes_since(self):
+        '''Changes are returned in order after a sequence number'''
+
+        self.journal.record('create', name='a')
+        self.journal.record('add', name='a', nodes=['n1'])
+        self.journal.record('rename', name='b', old_name='a')
+        changes = self.journal.changes_since(1)
+        self.assertEqual([c.kind for c in changes], ['add', 'rename'])
+        self.assertEqual(changes[0].nodes, ('n1',))
+        self.assertEqual(changes[1].old_name, 'a')
+        self.assertEqual(self.journal.changes_since(3), [])
+
+    def test_trimmed(self):
+        '''None is returned once changes since seq were trimmed'''
+
+        for i in range(5):
+            self.journal.record('color', name='a', color=[i, i, i])
+        self.assertIsNone(self.journal.changes_since(1))
+        self.assertEqual(len(self.journal.changes_since(2)), 3)
+        self.assertEqual(self.journal.changes_since(4)[0].color, (4, 4, 4))
+
+    def test_subscribe(self):
+        '''Subscribers receive every recorded change'''
+
+        received = []
+        self.journal.subscribe(received.append)
+        change = self.journal.record('delete', name='a')
+        self.journal.unsubscribe(received.append)
+        self.journal.record('reset')
+        self.assertEqual(received, [change])
+        self.assertRaises(ValueError, self.journal.record, 'unknown')
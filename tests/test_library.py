@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mtoatools.files import dump_mattes, iter_mattes
+from mtoatools.library import (MatteLibrary, dump_library, yaml_to_library,
+                               library_to_yaml)
+
+
+MATTES = [
+    {
+        'name': 'a',
+        'shapes': [
+            {'name': 'cube', 'namespace': 'ns', 'color': (1.0, 0.0, 0.0)},
+            {'name': 'sphere', 'namespace': None, 'color': (0.5, 0.5, 1.0)},
+        ]
+    },
+    {
+        'name': 'packed',
+        'packed': {'aov': 'matte_packed', 'channel': 'g'},
+        'shapes': [
+            {'name': 'cube', 'namespace': 'ns', 'color': (0.0, 1.0, 0.0)},
+        ]
+    },
+    {'name': u'\xe9t\xe9', 'shapes': []},
+]
+
+
+class TestMatteLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'mattes.mtl')
+        with open(self.path, 'wb') as f:
+            dump_library(MATTES, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_roundtrip(self):
+        '''Mattes read from a library equal the mattes written'''
+
+        with MatteLibrary(self.path) as library:
+            self.assertEqual(library.names(), ['a', 'packed', u'\xe9t\xe9'])
+            self.assertEqual(list(library), MATTES)
+
+    def test_random_access(self):
+        '''Single mattes are read by name'''
+
+        with MatteLibrary(self.path) as library:
+            self.assertTrue('packed' in library)
+            self.assertFalse('b' in library)
+            self.assertEqual(library['packed'], MATTES[1])
+            columns = library.columns('a')
+            self.assertEqual(columns.namespaces, ['ns', None])
+            self.assertEqual(columns.names, ['cube', 'sphere'])
+
+    def test_invalid(self):
+        '''Files that are not libraries raise ValueError'''
+
+        path = os.path.join(self.tempdir, 'mattes.yml')
+        with open(path, 'w') as f:
+            dump_mattes(MATTES, f)
+        self.assertRaises(ValueError, MatteLibrary, path)
+
+    def test_convert(self):
+        '''Libraries convert to matte files and back'''
+
+        yaml_path = os.path.join(self.tempdir, 'mattes.yml')
+        library_path = os.path.join(self.tempdir, 'converted.mtl')
+        library_to_yaml(self.path, yaml_path)
+        yaml_to_library(yaml_path, library_path)
+
+        with open(yaml_path, 'r') as f:
+            self.assertEqual(len(list(iter_mattes(f))), 3)
+        with MatteLibrary(library_path) as library:
+            self.assertEqual(list(library), MATTES)
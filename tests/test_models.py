@@ -0,0 +1,642 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+module_namespace = locals()
+
+
+def setUpModule():
+    from maya import standalone
+    standalone.initialize(name='python')
+    from maya import cmds
+    cmds.loadPlugin('mtoa', quiet=True)
+    from mtoatools.models import (MatteAOV, PackedMatte, OperatorMatte,
+                                  OperatorSync, get_shape_mattes)
+    from mtoatools.journal import Journal
+    from mtoatools.api import save_mattes, load_mattes
+    from mtoatools.files import SaveCache, read_matte_file
+    from mtoatools.snapshot import Snapshot, diff
+    from mtoatools.rules import NameRule, Rule, RuleEngine
+    from mtoatools.index import Members, MatteIndex
+    from mtoatools.bulk import transaction
+
+    module_namespace['cmds'] = cmds
+    module_namespace['MatteAOV'] = MatteAOV
+    module_namespace['PackedMatte'] = PackedMatte
+    module_namespace['OperatorMatte'] = OperatorMatte
+    module_namespace['OperatorSync'] = OperatorSync
+    module_namespace['get_shape_mattes'] = get_shape_mattes
+    module_namespace['Journal'] = Journal
+    module_namespace['save_mattes'] = save_mattes
+    module_namespace['load_mattes'] = load_mattes
+    module_namespace['SaveCache'] = SaveCache
+    module_namespace['read_matte_file'] = read_matte_file
+    module_namespace['Snapshot'] = Snapshot
+    module_namespace['diff'] = diff
+    module_namespace['NameRule'] = NameRule
+    module_namespace['Rule'] = Rule
+    module_namespace['RuleEngine'] = RuleEngine
+    module_namespace['Members'] = Members
+    module_namespace['MatteIndex'] = MatteIndex
+    module_namespace['transaction'] = transaction
+
+
+def recorded(seq):
+    '''List (kind, shape names) of the changes since seq'''
+
+    return [
+        (change.kind, sorted(node.name for node in change.nodes))
+        for change in Journal.changes_since(seq)
+    ]
+
+
+class TestMembers(unittest.TestCase):
+
+    def test_version(self):
+        '''Only actual changes bump the version'''
+
+        members = Members()
+        members[1] = (1, 0, 0)
+        self.assertEqual(members.version, 1)
+        self.assertEqual(members.pop(2, None), None)
+        self.assertEqual(members.version, 1)
+        members.pop(1)
+        self.assertEqual(members.version, 2)
+
+
+class TestMatteIndex(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        self.cube = cmds.polyCube(name='cube')[0]
+        cmds.select(clear=True)
+        self.matte = MatteAOV.create('index')
+        self.matte.add(self.cube)
+
+    def members(self):
+        return sorted(node.name for node in self.matte.get_objects())
+
+    def test_watch_members_only(self):
+        '''New shapes without matte attributes get no callbacks'''
+
+        watched = len(MatteIndex._node_callbacks)
+        for i in range(10):
+            cmds.polySphere()
+        self.assertEqual(self.members(), ['cubeShape'])
+        self.assertEqual(len(MatteIndex._node_callbacks), watched)
+
+    def test_duplicate(self):
+        '''Duplicated members are indexed'''
+
+        cmds.duplicate(self.cube, name='copy')
+        self.assertEqual(self.members(), ['copyShape', 'cubeShape'])
+
+    def test_undo_discard(self):
+        '''Undoing a discard restores the member'''
+
+        self.matte.discard(self.cube)
+        self.assertEqual(self.members(), [])
+        cmds.undo()
+        self.assertEqual(self.members(), ['cubeShape'])
+
+    def test_external_attr(self):
+        '''Attributes added outside of mtoatools are seen after a forget'''
+
+        sphere = cmds.polySphere(name='sphere')[0] + 'Shape'
+        self.assertEqual(self.members(), ['cubeShape'])
+        cmds.addAttr(sphere, ln='mtoa_constant_index', at='float3')
+        for c in 'XYZ':
+            cmds.addAttr(
+                sphere,
+                ln='mtoa_constant_index' + c,
+                at='float',
+                parent='mtoa_constant_index'
+            )
+        MatteIndex.forget(self.matte.mesh_attr_name)
+        self.assertEqual(self.members(), ['cubeShape', 'sphereShape'])
+
+
+class TestColorAttrs(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        self.shape = cmds.polyCube(name='cube')[0] + 'Shape'
+        cmds.select(clear=True)
+
+    def assertColor(self, attr_name, rgb):
+        plug = self.shape + '.' + attr_name
+        self.assertEqual(
+            [cmds.addAttr(plug + c, q=True, defaultValue=True) for c in 'RGB'],
+            [0, 0, 0]
+        )
+        self.assertEqual(tuple(cmds.getAttr(plug)[0]), rgb)
+
+    def test_new_attr_defaults(self):
+        '''New attributes default to black and hold the color as a value'''
+
+        matte = MatteAOV.create('plain')
+        matte.set_objects_color((0.5, 0.25, 1), self.shape)
+        self.assertColor(matte.mesh_attr_name, (0.5, 0.25, 1))
+
+        packed = PackedMatte.create('packed')
+        packed.set_objects_color((0.5, 0.5, 0.5), self.shape)
+        rgb = [0, 0, 0]
+        rgb[packed.channel] = 0.5
+        self.assertColor(packed.mesh_attr_name, tuple(rgb))
+
+    def test_default_color(self):
+        '''Default colors are saved and loaded with the matte'''
+
+        matte = MatteAOV.create('plain')
+        self.assertNotIn('default_color', matte.data())
+        matte.set_default_color((0.25, 0, 0))
+        data = matte.data()
+        self.assertEqual(data['default_color'], [0.25, 0, 0])
+
+        matte.set_default_color((0, 0, 0))
+        MatteAOV.load(data)
+        self.assertEqual(matte.default_color, (0.25, 0, 0))
+
+
+class TestPackedDelete(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        cmds.select(clear=True)
+
+    def test_channels_stable(self):
+        '''Deleting a packed matte leaves the other mattes in place'''
+
+        mattes = [PackedMatte.create(name) for name in 'abcd']
+        locations = [(m.physical.name, m.channel) for m in mattes]
+        mattes[1].delete()
+
+        packed = dict(
+            (m.name, (m.physical.name, m.channel))
+            for m in MatteAOV.ls() if isinstance(m, PackedMatte)
+        )
+        self.assertEqual(
+            packed,
+            {'a': locations[0], 'c': locations[2], 'd': locations[3]}
+        )
+        matte = PackedMatte.create('e')
+        self.assertEqual((matte.physical.name, matte.channel), locations[1])
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        self.cube = cmds.polyCube(name='cube')[0]
+        self.sphere = cmds.polySphere(name='sphere')[0]
+        cmds.select(clear=True)
+
+    def assertAdds(self, matte):
+        matte.add(self.cube)
+        seq = Journal.seq
+        matte.set_objects_color((0.5, 0, 0), self.cube, self.sphere)
+        self.assertEqual(
+            recorded(seq),
+            [('add', ['sphereShape']), ('color', ['cubeShape'])]
+        )
+
+    def test_set_color_records_adds(self):
+        '''Shapes made members by setting their color are recorded as adds'''
+
+        self.assertAdds(MatteAOV.create('matte'))
+
+    def test_packed_set_color_records_adds(self):
+        '''Packed mattes record shapes set to a color as adds'''
+
+        self.assertAdds(PackedMatte.create('matte'))
+
+    def test_operator_set_color_records_adds(self):
+        '''Operator mattes record shapes set to a color as adds'''
+
+        self.assertAdds(OperatorMatte.create('matte'))
+
+
+class TestSaveCache(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'mattes.yml')
+        cube = cmds.polyCube(name='cube')[0]
+        cmds.select(clear=True)
+        self.matte = MatteAOV.create('matte')
+        self.matte.set_objects_color((1, 0, 0), cube)
+        save_mattes([self.matte], self.path)
+
+    def tearDown(self):
+        SaveCache.forget()
+        shutil.rmtree(self.tempdir)
+
+    def saved_shapes(self):
+        save_mattes([self.matte], self.path)
+        return [
+            (shape['name'], shape['color'])
+            for shape in read_matte_file(self.path)[0]['shapes']
+        ]
+
+    def test_attribute_edit(self):
+        '''Colors set outside of the models are saved'''
+
+        cmds.setAttr('cubeShape.mtoa_constant_matte', 0, 1, 0)
+        self.assertEqual(self.saved_shapes(), [('cubeShape', [0, 1, 0])])
+
+    def test_shape_rename(self):
+        '''Renamed shapes are saved with their new name'''
+
+        cmds.rename('cubeShape', 'boxShape')
+        self.assertEqual(self.saved_shapes(), [('boxShape', [1, 0, 0])])
+
+    def test_shape_delete(self):
+        '''Deleted shapes are no longer saved'''
+
+        cmds.delete('cube')
+        self.assertEqual(self.saved_shapes(), [])
+
+
+class TestSnapshotApply(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        cmds.namespace(add='ns1')
+        cmds.polyCube(name='ns1:x')
+        self.matte = MatteAOV.create('matte', nodes=['ns1:x'])
+
+    def test_namespace_move(self):
+        '''Shapes moving namespace keep their membership when namespaces
+        are ignored.
+        '''
+
+        target = Snapshot.from_data([{
+            'name': 'matte',
+            'shapes': [{'name': 'xShape', 'namespace': 'ns2',
+                        'color': (0, 1, 0)}],
+        }])
+        diff(Snapshot.from_scene(), target).apply(ignore_namespaces=True)
+        diff(Snapshot.from_scene(), target, True).apply()
+        self.assertEqual(
+            [(str(node), color) for node, color in self.matte],
+            [('ns1:xShape', (0, 1, 0))]
+        )
+
+    def test_created_ignore_selection(self):
+        '''Mattes created by a diff do not add the selection'''
+
+        cmds.select('ns1:x')
+        target = Snapshot.from_data([
+            {'name': 'matte', 'shapes': []},
+            {'name': 'other', 'shapes': []},
+        ])
+        diff(Snapshot.from_scene(), target).apply()
+        other = [m for m in MatteAOV.ls() if m.name == 'other'][0]
+        self.assertEqual(list(other), [])
+
+
+class TestRules(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        self.cube = cmds.polyCube(name='rock_cube')[0]
+        self.sphere = cmds.polySphere(name='tree_sphere')[0]
+        cmds.select(clear=True)
+        self.matte = MatteAOV.create('rules')
+        self.matte.add_rule(NameRule('rock_*', (1, 0, 0)))
+
+    def members(self):
+        return sorted(node.name for node in self.matte.get_objects())
+
+    def test_rule_is_abstract(self):
+        self.assertRaises(TypeError, Rule, 'value')
+
+    def test_rename_out_of_pattern(self):
+        self.assertEqual(self.members(), ['rock_cubeShape'])
+        cmds.rename(self.cube + 'Shape', 'pebbleShape')
+        RuleEngine.flush()
+        self.assertEqual(self.members(), [])
+
+    def test_rename_into_pattern(self):
+        cmds.rename(self.sphere + 'Shape', 'rock_sphereShape')
+        RuleEngine.flush()
+        self.assertEqual(
+            self.members(),
+            ['rock_cubeShape', 'rock_sphereShape']
+        )
+
+    def test_keep_hand_edits(self):
+        '''Flushes keep colors set by hand and members added by hand'''
+
+        self.matte.set_objects_color((0, 0, 1), self.cube, self.sphere)
+        RuleEngine.touch_hierarchy(
+            self.matte.get_objects()[0].object()
+        )
+        RuleEngine.flush()
+        self.assertEqual(
+            self.matte.get_color(self.cube + 'Shape'),
+            (0, 0, 1)
+        )
+        self.matte.remove_rule(NameRule('rock_*'))
+        self.assertEqual(self.members(), ['tree_sphereShape'])
+
+    def test_rules_cache(self):
+        '''Editing the rules attribute invalidates the parsed rules'''
+
+        self.assertIs(self.matte.rules[0], self.matte.rules[0])
+        self.matte.aov.pynode().attr(self.matte.rules_attr_name).set(
+            '- {kind: name, value: tree_*, color: [0, 1, 0]}'
+        )
+        self.assertEqual(self.matte.rules, [NameRule('tree_*', (0, 1, 0))])
+
+    def test_untouched_shapes(self):
+        '''Flushes only check the touched shapes'''
+
+        cmds.rename(self.sphere + 'Shape', 'rock_sphereShape')
+        RuleEngine._touched = {}
+        RuleEngine.flush()
+        self.assertEqual(self.members(), ['rock_cubeShape'])
+
+
+class TestHierarchyRules(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        self.cube = cmds.polyCube(name='cube')[0]
+        self.group = cmds.group(self.cube, name='grp')
+        self.other = cmds.group(empty=True, name='other')
+        cmds.select(clear=True)
+        self.matte = MatteAOV.create('hierarchy')
+        self.matte.set_hierarchy_color((1, 0, 0), self.group)
+
+    def members(self):
+        return sorted(node.name for node in self.matte.get_objects())
+
+    def test_rename_root(self):
+        '''Renaming the root keeps its shapes in the matte'''
+
+        cmds.rename(self.group, 'renamed')
+        RuleEngine.flush()
+        self.assertEqual(self.members(), ['cubeShape'])
+
+    def test_reparent_root(self):
+        '''Reparenting the root keeps its shapes in the matte'''
+
+        cmds.parent(self.group, self.other)
+        RuleEngine.flush()
+        self.assertEqual(self.members(), ['cubeShape'])
+
+        cmds.parent(self.cube, world=True)
+        RuleEngine.flush()
+        self.assertEqual(self.members(), [])
+
+
+class TestOperatorMatte(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        self.cube = cmds.polyCube(name='cube')[0]
+        self.sphere = cmds.polySphere(name='sphere')[0]
+        cmds.select(clear=True)
+        self.matte = OperatorMatte.create('operator')
+
+    def members(self):
+        return sorted(
+            (node.name, color) for node, color in self.matte
+        )
+
+    def test_add_discard(self):
+        self.matte.add(self.cube, self.sphere)
+        self.assertEqual(
+            self.members(),
+            [('cubeShape', (0, 0, 0)), ('sphereShape', (0, 0, 0))]
+        )
+        self.matte.discard(self.sphere)
+        self.assertEqual(self.members(), [('cubeShape', (0, 0, 0))])
+
+    def test_set_color(self):
+        self.matte.add(self.cube)
+        self.matte.set_objects_color((1, 0, 0), self.cube, self.sphere)
+        self.assertEqual(
+            self.members(),
+            [('cubeShape', (1, 0, 0)), ('sphereShape', (1, 0, 0))]
+        )
+        self.assertEqual(self.matte.get_color(self.cube), (1, 0, 0))
+
+    def test_data_load(self):
+        self.matte.set_objects_color((0, 1, 0), self.cube)
+        data = self.matte.data()
+        self.assertEqual(data['backend'], 'operator')
+        self.matte.discard(self.cube)
+
+        matte = OperatorMatte.load(data)
+        self.assertEqual(matte.name, 'operator')
+        self.assertEqual(self.members(), [('cubeShape', (0, 1, 0))])
+
+    def test_get_shape_mattes(self):
+        self.matte.set_objects_color((0, 0, 1), self.cube)
+        result = get_shape_mattes()
+        self.assertEqual(list(result), ['|cube|cubeShape'])
+        (matte, color), = result['|cube|cubeShape']
+        self.assertEqual((matte.name, color), ('operator', (0, 0, 1)))
+
+    def test_rename_reparent(self):
+        '''Members and selections follow renamed and reparented shapes'''
+
+        self.matte.add(self.cube)
+        group = cmds.group(empty=True, name='grp')
+        cmds.rename(self.cube, 'box')
+        cmds.parent('box', group)
+        OperatorSync.flush()
+        self.assertEqual(self.members(), [('boxShape', (0, 0, 0))])
+
+        node, shapes = self.matte._read()[(0, 0, 0)]
+        self.assertEqual(
+            cmds.getAttr(node + '.selection'),
+            '/grp/box/boxShape'
+        )
+
+
+class TestTransaction(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        self.cube = cmds.polyCube(name='cube')[0]
+        cmds.select(clear=True)
+        self.matte = MatteAOV.create('matte')
+
+    def members(self):
+        return sorted(node.name for node in self.matte.get_objects())
+
+    def test_rollback(self):
+        '''A failing step rolls back modifier and cmds edits alike'''
+
+        def fail():
+            with transaction():
+                self.matte.add(self.cube)
+                self.matte.set_id_mode('shape')
+                cmds.polySphere(name='sphere')
+                raise RuntimeError('step failed')
+
+        self.assertRaises(RuntimeError, fail)
+        self.assertEqual(self.members(), [])
+        self.assertFalse(cmds.objExists('sphere'))
+        self.assertEqual(self.matte.id_mode, None)
+        self.assertTrue(cmds.objExists('cube'))
+
+    def test_single_undo(self):
+        '''Modifier and cmds edits of a transaction undo as one step'''
+
+        with transaction():
+            self.matte.add(self.cube)
+            cmds.polySphere(name='sphere')
+            self.matte.set_objects_color((1, 0, 0), 'sphere')
+        self.assertEqual(self.members(), ['cubeShape', 'sphereShape'])
+
+        cmds.undo()
+        self.assertEqual(self.members(), [])
+        self.assertFalse(cmds.objExists('sphere'))
+        self.assertTrue(cmds.objExists('cube'))
+
+
+class TestCreateMany(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        self.cube = cmds.polyCube(name='cube')[0]
+        cmds.select(clear=True)
+
+    def test_wiring(self):
+        '''Batched mattes are wired like mattes created one by one'''
+
+        mattes = MatteAOV.create_many(
+            ['a', {'name': 'b', 'nodes': [self.cube], 'color': (1, 0, 0)}]
+        )
+        self.assertEqual([matte.name for matte in mattes], ['a', 'b'])
+
+        aovs = cmds.listConnections(
+            'defaultArnoldRenderOptions.aovList',
+            source=True,
+            destination=False
+        )
+        for matte in mattes:
+            aov = str(matte.aov)
+            user_data = str(matte.user_data)
+            self.assertEqual(aov, 'aiAOV_' + matte.name)
+            self.assertIn(aov, aovs)
+            self.assertEqual(cmds.getAttr(aov + '.name'), matte.name)
+            self.assertEqual(cmds.getAttr(aov + '.type', asString=True),
+                             'vector')
+            self.assertTrue(cmds.getAttr(aov + '.is_aov_matte'))
+            self.assertEqual(cmds.nodeType(user_data), 'aiUserDataColor')
+            self.assertEqual(cmds.getAttr(user_data + '.colorAttrName'),
+                             matte.name)
+            self.assertEqual(
+                cmds.listConnections(
+                    aov + '.defaultValue',
+                    source=True,
+                    destination=False,
+                    plugs=True
+                ),
+                [user_data + '.outColor']
+            )
+            self.assertEqual(
+                cmds.listConnections(aov + '.outputs[0].driver'),
+                ['defaultArnoldDriver']
+            )
+
+        self.assertEqual(list(mattes[0].get_objects()), [])
+        self.assertEqual(
+            [(node.name, tuple(color)) for node, color in mattes[1]],
+            [('cubeShape', (1, 0, 0))]
+        )
+
+    def test_unique_names(self):
+        '''Names are unique against existing and batched mattes'''
+
+        MatteAOV.create('a')
+        mattes = MatteAOV.create_many(['a', 'a'])
+        names = [matte.name for matte in MatteAOV.ls()]
+        self.assertEqual(len(set(names)), 3)
+        self.assertNotIn('a', [matte.name for matte in mattes])
+
+    def test_single_undo(self):
+        '''One undo removes the whole batch'''
+
+        MatteAOV.create_many(['a', {'name': 'b', 'nodes': [self.cube]}])
+        cmds.undo()
+        self.assertEqual(MatteAOV.ls(), [])
+        self.assertFalse(cmds.objExists('aiAOV_a'))
+        self.assertFalse(cmds.objExists('b_color'))
+        self.assertFalse(cmds.objExists('cubeShape.mtoa_constant_b'))
+
+
+class TestDeleteMany(unittest.TestCase):
+
+    def setUp(self):
+        cmds.file(new=True, force=True)
+        self.cube = cmds.polyCube(name='cube')[0]
+        cmds.select(clear=True)
+        self.mattes = [
+            MatteAOV.create('a', nodes=[self.cube]),
+            MatteAOV.create('b', nodes=[self.cube]),
+            PackedMatte.create('c', nodes=[self.cube]),
+            OperatorMatte.create('d', nodes=[self.cube]),
+        ]
+        self.nodes = [
+            str(node) for matte in self.mattes[:2]
+            for node in (matte.aov, matte.user_data)
+        ]
+        self.attrs = ['cubeShape.' + m.mesh_attr_name for m in self.mattes[:3]]
+
+    def assertDeleted(self):
+        self.assertEqual(MatteAOV.ls(), [])
+        for node in self.nodes:
+            self.assertFalse(cmds.objExists(node))
+        self.assertEqual(cmds.ls(type='aiSetParameter'), [])
+        for attr in self.attrs:
+            self.assertFalse(cmds.objExists(attr))
+
+    def assertRestored(self):
+        self.assertEqual(
+            sorted(matte.name for matte in MatteAOV.ls()),
+            ['a', 'b', 'c', 'd']
+        )
+        for node in self.nodes:
+            self.assertTrue(cmds.objExists(node))
+        for attr in self.attrs:
+            self.assertTrue(cmds.objExists(attr))
+        for matte in MatteAOV.ls():
+            self.assertEqual(
+                [node.name for node in matte.get_objects()],
+                ['cubeShape']
+            )
+
+    def test_delete_many(self):
+        '''Nodes and attributes are removed and restored in one undo step'''
+
+        MatteAOV.delete_many(self.mattes)
+        self.assertDeleted()
+        cmds.undo()
+        self.assertRestored()
+
+    def test_clear_all(self):
+        '''Every matte is removed and restored in one undo step'''
+
+        MatteAOV.clear_all()
+        self.assertDeleted()
+        cmds.undo()
+        self.assertRestored()
+
+    def test_keep_others(self):
+        '''Mattes not deleted keep their nodes and members'''
+
+        MatteAOV.delete_many(self.mattes[:1])
+        self.assertEqual(
+            sorted(matte.name for matte in MatteAOV.ls()),
+            ['b', 'c', 'd']
+        )
+        self.assertFalse(cmds.objExists(self.attrs[0]))
+        self.assertTrue(cmds.objExists(self.attrs[1]))
@@ -0,0 +1,60 @@
+import unittest
+from mtoatools.packing import ChannelPacker
+
+
+class TestChannelPacker(unittest.TestCase):
+
+    def test_assign_fills_channels(self):
+        '''Assign fills a physical aov before creating another'''
+
+        packer = ChannelPacker()
+        locations = [packer.assign(name) for name in 'abcd']
+
+        self.assertEqual(
+            locations,
+            [('packed_matte', 0), ('packed_matte', 1),
+             ('packed_matte', 2), ('packed_matte1', 0)]
+        )
+
+    def test_assign_prefers_fullest(self):
+        '''Assign picks the fullest physical aov with a free channel'''
+
+        packer = ChannelPacker({
+            'p0': ['a', None, None],
+            'p1': ['b', 'c', None],
+        })
+        self.assertEqual(packer.assign('d'), ('p1', 2))
+
+    def test_assign_preferred_location(self):
+        '''Assign honors a free preferred location'''
+
+        packer = ChannelPacker({'p0': ['a', None, None]})
+        self.assertEqual(packer.assign('b', 'p0', 2), ('p0', 2))
+        self.assertEqual(packer.assign('c', 'p0', 2), ('p0', 1))
+
+    def test_release_reuses_channel(self):
+        '''Released channels stay free and are reused without moving mattes'''
+
+        packer = ChannelPacker()
+        for name in 'abcd':
+            packer.assign(name)
+        packer.release('b')
+
+        self.assertEqual(packer.find('c'), ('packed_matte', 2))
+        self.assertEqual(packer.find('d'), ('packed_matte1', 0))
+        self.assertEqual(packer.assign('e'), ('packed_matte', 1))
+
+    def test_repack(self):
+        '''Repack leaves at most one partially filled physical aov'''
+
+        packer = ChannelPacker({
+            'p0': ['a', None, None],
+            'p1': [None, 'b', None],
+            'p2': ['c', 'd', 'e'],
+        })
+        moves, empty = packer.repack()
+
+        self.assertEqual(len(moves), 1)
+        self.assertEqual(len(empty), 1)
+        self.assertEqual(len(packer.layout), 2)
+        self.assertEqual(packer.layout['p2'], ['c', 'd', 'e'])
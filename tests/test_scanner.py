@@ -0,0 +1,178 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+module_namespace = locals()
+
+
+def setUpModule():
+    from maya import standalone
+    standalone.initialize(name='python')
+    from maya import cmds
+    cmds.loadPlugin('mtoa', quiet=True)
+    from mtoatools import scanner
+    from mtoatools.index import MatteIndex
+    from mtoatools.models import MatteAOV
+
+    module_namespace['cmds'] = cmds
+    module_namespace['scanner'] = scanner
+    module_namespace['MatteIndex'] = MatteIndex
+    module_namespace['MatteAOV'] = MatteAOV
+
+
+ATTRS = ['mtoa_constant_x', 'mtoa_constant_y']
+
+
+def create_asset(filepath):
+    '''Save a scene with two mattes holding a cube'''
+
+    cmds.file(new=True, force=True)
+    cube = cmds.polyCube(name='cube')[0]
+    cmds.select(clear=True)
+    for name in ('x', 'y'):
+        MatteAOV.create(name).add(cube)
+    cmds.file(rename=filepath)
+    cmds.file(save=True, type='mayaAscii', force=True)
+
+
+class TestScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tempdir, 'scan_cache.json')
+        os.environ['MTOATOOLS_SCAN_CACHE'] = self.cache_path
+
+        asset = os.path.join(self.tempdir, 'asset.ma')
+        create_asset(asset)
+        cmds.file(new=True, force=True)
+        for namespace in ('a', 'b'):
+            cmds.file(asset, reference=True, namespace=namespace)
+
+        scanner.Scanner.clear()
+        MatteIndex.clear()
+        self.calls = []
+
+    def tearDown(self):
+        cmds.file(new=True, force=True)
+        del os.environ['MTOATOOLS_SCAN_CACHE']
+        shutil.rmtree(self.tempdir)
+
+    def counting(self, function):
+        def wrapper(*args, **kwargs):
+            self.calls.append(args)
+            return function(*args, **kwargs)
+        return wrapper
+
+    def test_one_signature_per_reference(self):
+        '''Each reference's edits are queried once per scan'''
+
+        get_edits_signature = scanner.get_edits_signature
+        scanner.get_edits_signature = self.counting(get_edits_signature)
+        try:
+            found = scanner.Scanner.scan(ATTRS)
+        finally:
+            scanner.get_edits_signature = get_edits_signature
+
+        self.assertEqual(len(self.calls), 2)
+        for attr_name in ATTRS:
+            self.assertEqual(
+                sorted(found[attr_name]),
+                ['a:cube|a:cubeShape', 'b:cube|b:cubeShape']
+            )
+
+    def test_deferred_save(self):
+        '''Scans do not write the cache, it is saved on idle'''
+
+        scanner.Scanner.scan(ATTRS)
+        self.assertFalse(os.path.isfile(self.cache_path))
+        scanner.Scanner._save_deferred()
+        self.assertTrue(os.path.isfile(self.cache_path))
+
+    def test_index_scans_once(self):
+        '''Building the index scans every matte attribute in one pass'''
+
+        scan = scanner.Scanner.scan
+        scanner.Scanner.scan = self.counting(scan)
+        try:
+            for attr_name in ATTRS:
+                self.assertEqual(len(MatteIndex.objects(attr_name)), 2)
+        finally:
+            scanner.Scanner.scan = scan
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(sorted(self.calls[0][0]), ATTRS)
+
+    def scanned_namespaces(self):
+        '''Scan from a fresh index and on disk cache, return the namespaces
+        scanned in the scene instead of read from the cache.
+        '''
+
+        scanner.Scanner._save_deferred()
+        scanner.Scanner._cache = None
+        MatteIndex.clear()
+        self.calls = []
+        scan_namespace = scanner.scan_namespace
+        scanner.scan_namespace = self.counting(scan_namespace)
+        try:
+            found = scanner.Scanner.scan(ATTRS)
+        finally:
+            scanner.scan_namespace = scan_namespace
+        return sorted(args[0] for args in self.calls), found
+
+    def test_cache_reuse(self):
+        '''Unchanged references are read from the cache'''
+
+        scanner.Scanner.scan(ATTRS)
+        namespaces, found = self.scanned_namespaces()
+        self.assertNotIn('a', namespaces)
+        self.assertNotIn('b', namespaces)
+        self.assertEqual(len(found['mtoa_constant_x']), 2)
+
+    def test_cache_mtime(self):
+        '''Saving a referenced file again invalidates its entries'''
+
+        scanner.Scanner.scan(ATTRS)
+        asset = os.path.join(self.tempdir, 'asset.ma')
+        mtime = os.path.getmtime(asset) + 10
+        os.utime(asset, (mtime, mtime))
+        namespaces, found = self.scanned_namespaces()
+        self.assertIn('a', namespaces)
+        self.assertIn('b', namespaces)
+
+    def test_cache_edits(self):
+        '''Matte edits made to a reference invalidate its entry'''
+
+        MatteIndex.objects('mtoa_constant_x')
+        cmds.setAttr('a:cubeShape.mtoa_constant_x', 0, 1, 0)
+        namespaces, found = self.scanned_namespaces()
+        self.assertIn('a', namespaces)
+        self.assertNotIn('b', namespaces)
+        self.assertEqual(
+            found['mtoa_constant_x']['a:cube|a:cubeShape'],
+            (0, 1, 0)
+        )
+
+    def test_atomic_save(self):
+        '''Saves leave no temporary files behind'''
+
+        scanner.Scanner.scan(ATTRS)
+        scanner.Scanner.save()
+        self.assertEqual(os.listdir(self.tempdir).count('scan_cache.json'), 1)
+        self.assertFalse(
+            [name for name in os.listdir(self.tempdir)
+             if name.endswith('.tmp')]
+        )
+
+    def test_prune(self):
+        '''Old entries and entries past the maximum count are dropped'''
+
+        now = 1000000000
+        cache = dict(
+            (str(i), {'used': now - i}) for i in range(1000)
+        )
+        cache['old'] = {'used': now - scanner.CACHE_MAX_AGE - 1}
+        scanner.prune_cache(cache, now)
+        self.assertEqual(len(cache), scanner.CACHE_MAX_ENTRIES)
+        self.assertNotIn('old', cache)
+        self.assertIn('0', cache)
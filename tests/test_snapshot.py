@@ -0,0 +1,87 @@
+import unittest
+from mtoatools.snapshot import Snapshot, diff
+
+
+def matte_data(name, *shapes, **info):
+    data = dict(info)
+    data['name'] = name
+    data['shapes'] = [
+        {'name': shape, 'namespace': namespace, 'color': color}
+        for namespace, shape, color in shapes
+    ]
+    return data
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_diff_changes(self):
+        '''Diff finds adds, discards and color changes only'''
+
+        a = Snapshot.from_data([matte_data(
+            'matte',
+            (None, 'keep', (1, 0, 0)),
+            (None, 'recolor', (1, 0, 0)),
+            ('ns', 'drop', (0, 1, 0)),
+        )])
+        b = Snapshot.from_data([matte_data(
+            'matte',
+            (None, 'keep', (1.00001, 0, 0)),
+            (None, 'recolor', (0, 0, 1)),
+            ('ns', 'add', (0, 1, 0)),
+        )])
+        result = diff(a, b)
+
+        self.assertEqual(result.adds['matte'], {('ns', 'add'): (0, 1, 0)})
+        self.assertEqual(result.colors['matte'], {(None, 'recolor'): (0, 0, 1)})
+        self.assertEqual(result.discards['matte'], set([('ns', 'drop')]))
+        self.assertFalse(result.created or result.deleted)
+
+    def test_diff_mattes(self):
+        '''Diff finds created and deleted mattes and keeps their info'''
+
+        a = Snapshot.from_data([matte_data('old')])
+        b = Snapshot.from_data([
+            matte_data('new', packed={'aov': 'packed_matte', 'channel': 'G'})
+        ])
+        result = diff(a, b)
+
+        self.assertEqual(result.created, ['new'])
+        self.assertEqual(result.deleted, ['old'])
+        self.assertEqual(result.info['new']['packed']['channel'], 'G')
+
+    def test_diff_identical(self):
+        '''Identical snapshots produce an empty diff'''
+
+        data = [matte_data('matte', ('ns', 'shape', (1, 1, 1)))]
+        self.assertFalse(diff(Snapshot.from_data(data),
+                              Snapshot.from_data(data)))
+
+    def test_diff_ignore_namespaces(self):
+        '''Shapes moving to another namespace are unchanged when namespaces
+        are ignored, instead of being added and discarded.
+        '''
+
+        a = Snapshot.from_data([matte_data('matte', ('ns1', 'x', (1, 0, 0)))])
+        b = Snapshot.from_data([matte_data('matte', ('ns2', 'x', (1, 0, 0)))])
+
+        result = diff(a, b)
+        self.assertEqual(list(result.adds['matte']), [('ns2', 'x')])
+        self.assertEqual(result.discards['matte'], set([('ns1', 'x')]))
+
+        result = diff(a, b, ignore_namespaces=True)
+        self.assertTrue(result.ignore_namespaces)
+        self.assertFalse(result)
+
+        b = Snapshot.from_data([matte_data('matte', ('ns2', 'x', (0, 1, 0)))])
+        result = diff(a, b, ignore_namespaces=True)
+        self.assertEqual(result.colors['matte'], {(None, 'x'): (0, 1, 0)})
+        self.assertFalse(result.adds['matte'] or result.discards['matte'])
+
+    def test_data_roundtrip(self):
+        '''Snapshot data loads back into an equal snapshot'''
+
+        a = Snapshot.from_data([
+            matte_data('matte', ('ns', 'b', (1, 0, 0)), (None, 'a', (0, 1, 0)))
+        ])
+        b = Snapshot.from_data(a.data())
+        self.assertEqual(a.mattes, b.mattes)
@@ -0,0 +1,106 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from mtoatools.files import dump_mattes
+from mtoatools.library import dump_library
+from mtoatools.workers import get_python, read_matte_files, split_files
+
+
+MATTES = [
+    {
+        'name': 'a',
+        'shapes': [{'name': 'cube', 'namespace': 'ns', 'color': [1, 0, 0]}]
+    },
+    {
+        'name': 'b',
+        'shapes': [{'name': 'sphere', 'namespace': None, 'color': [0, 0, 1]}]
+    },
+]
+SHOT = [
+    {
+        'name': 'b',
+        'shapes': [{'name': 'cone', 'namespace': None, 'color': [0, 1, 0]}]
+    },
+    {'name': 'c', 'shapes': []},
+]
+
+
+class TestWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filepaths = []
+        for i, mattes in enumerate((MATTES, SHOT, MATTES)):
+            filepath = os.path.join(self.tempdir, '{}.yml'.format(i))
+            with open(filepath, 'w') as f:
+                dump_mattes(mattes, f)
+            self.filepaths.append(filepath)
+
+        filepath = os.path.join(self.tempdir, 'shot.mtl')
+        with open(filepath, 'wb') as f:
+            dump_library(SHOT, f)
+        self.filepaths.append(filepath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_pool(self):
+        '''Files parsed by workers merge like files parsed in process'''
+
+        environ = dict(os.environ)
+        serial = read_matte_files(self.filepaths, processes=1)
+        pooled = read_matte_files(self.filepaths, processes=2, worker_bytes=0)
+        self.assertEqual(pooled, serial)
+        self.assertEqual([m['name'] for m in pooled], ['a', 'b', 'c'])
+        self.assertEqual(pooled[1]['shapes'][0]['name'], 'cone')
+        self.assertEqual(dict(os.environ), environ)
+
+    def test_worker_error(self):
+        '''Worker errors are raised in the calling process'''
+
+        filepath = os.path.join(self.tempdir, 'broken.yml')
+        with open(filepath, 'w') as f:
+            f.write('--- [unclosed\n')
+        self.assertRaises(
+            RuntimeError,
+            read_matte_files,
+            [self.filepaths[0], filepath],
+            processes=2,
+            worker_bytes=0
+        )
+
+    def test_split_files(self):
+        '''Files are spread over workers by size'''
+
+        chunks = split_files(['a', 'b', 'c', 'd'], [10, 1, 8, 2], 2)
+        self.assertEqual(chunks, [[0, 1], [2, 3]])
+        self.assertEqual(split_files(['a'], [10], 2), [[0]])
+
+    def test_get_python(self):
+        '''mayapy is found from MAYA_LOCATION inside Maya on every platform'''
+
+        bin_dir = os.path.join(self.tempdir, 'Contents', 'bin')
+        os.makedirs(bin_dir)
+        mayapy = 'mayapy.exe' if sys.platform == 'win32' else 'mayapy'
+        open(os.path.join(bin_dir, mayapy), 'w').close()
+
+        executable = sys.executable
+        location = os.environ.get('MAYA_LOCATION')
+        os.environ['MAYA_LOCATION'] = os.path.dirname(bin_dir)
+        try:
+            for path in ('/maya2018/bin/maya.bin', '/Maya.app/MacOS/Maya'):
+                sys.executable = path
+                self.assertEqual(get_python(), os.path.join(bin_dir, mayapy))
+            sys.executable = '/maya2018/bin/mayapy'
+            self.assertEqual(get_python(), '/maya2018/bin/mayapy')
+            del os.environ['MAYA_LOCATION']
+            sys.executable = '/maya2018/bin/maya.bin'
+            self.assertEqual(get_python(), None)
+        finally:
+            sys.executable = executable
+            if location is None:
+                os.environ.pop('MAYA_LOCATION', None)
+            else:
+                os.environ['MAYA_LOCATION'] = location